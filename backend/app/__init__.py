@@ -1,3 +1,7 @@
+# 起動時間の計測を最初に始める (他のモジュールの読み込みも含める)
+from app.startup import startup_timer  # noqa: F401
+
+# isort: split
 from app.app import app
 from app.config import settings
 from app.models import SearchRequest, SearchResponse
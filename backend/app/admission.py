@@ -0,0 +1,212 @@
+"""
+検索の受付制御 (アドミッション制御とバックプレッシャー)
+
+検索は 1 件ごとにモデル呼び出しと最大 6 件の画像取得・アップロードを行うため、
+同時に実行する検索の数を制限する。枠が空くのを待つ待ち行列は短く期限付きにし、
+溢れた・待ちきれなかったリクエストは 503、クライアントごとのレート制限
+(トークンバケット) を超えたリクエストは 429 で、Retry-After を付けてすぐに断る。
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+
+from app.metrics import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUED,
+    ADMISSION_REJECTED,
+    stage,
+)
+
+
+class RejectedError(Exception):
+    """受け付けなかったリクエスト"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After ヘッダーの値 (1 以上の整数秒)"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """rate 個/秒で補充され、最大 burst 個までためられるトークンバケット"""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def take(self, now: float) -> tuple[bool, float]:
+        """トークンを 1 個使う
+
+        Returns:
+            tuple[bool, float]: (使えたか, 次のトークンまでの秒数)
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """同時実行数・待ち行列・クライアントごとのレートを制限する"""
+
+    def __init__(
+        self,
+        max_in_flight: int = 32,
+        max_queue: int = 64,
+        queue_timeout: float = 2.0,
+        rate: float = 0,
+        burst: float = 10,
+        max_clients: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            max_in_flight: 同時に実行する検索の最大数
+            max_queue: 枠が空くのを待てるリクエストの最大数
+            queue_timeout: 待ち行列で待つ最大秒数
+            rate: クライアントごとに 1 秒あたり受け付ける数 (0 なら制限しない)
+            burst: クライアントごとに連続して受け付ける最大数
+            max_clients:
+                トークンバケットを保持するクライアント数の上限 (古いものから捨てる)
+            clock: 時刻関数 (テスト用)
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._clock = clock
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected: dict[str, int] = {
+            "rate_limited": 0,
+            "queue_full": 0,
+            "queue_timeout": 0,
+        }
+
+    def _reject(
+        self, status_code: int, reason: str, retry_after: float
+    ) -> RejectedError:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.inc(reason=reason)
+        return RejectedError(status_code, reason, retry_after)
+
+    def check_rate(self, client_id: str) -> None:
+        """クライアントのレート制限を確認し、1 件分のトークンを使う
+
+        Raises:
+            RejectedError: レート制限を超えた場合 (429)
+        """
+        if self.rate <= 0:
+            return
+        now = self._clock()
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = self._buckets[client_id] = TokenBucket(self.rate, self.burst, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client_id)
+
+        allowed, retry_after = bucket.take(now)
+        if not allowed:
+            raise self._reject(429, "rate_limited", retry_after)
+
+    async def acquire(self, client_id: str) -> None:
+        """実行の枠を確保する (release() で返す)
+
+        Raises:
+            RejectedError: レート制限 (429)、待ち行列が満杯・期限切れ (503) の場合
+        """
+        self.check_rate(client_id)
+
+        if self._slots.locked():
+            if self.queued >= self.max_queue:
+                raise self._reject(503, "queue_full", self.queue_timeout)
+            self.queued += 1
+            ADMISSION_QUEUED.inc()
+            try:
+                with stage("queue"):
+                    await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except TimeoutError:
+                raise self._reject(503, "queue_timeout", self.queue_timeout) from None
+            finally:
+                self.queued -= 1
+                ADMISSION_QUEUED.dec()
+        else:
+            await self._slots.acquire()
+
+        self._enter()
+
+    async def try_acquire(self) -> bool:
+        """空きがあれば待たずに枠を確保して True を返す (release() で返す)
+
+        キャッシュの裏での更新など、リクエストに紐づかない処理用。
+        空きが無ければ待たずに False を返す。
+        """
+        if self._slots.locked():
+            return False
+        await self._slots.acquire()
+        self._enter()
+        return True
+
+    def _enter(self) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        ADMISSION_IN_FLIGHT.inc()
+
+    def release(self) -> None:
+        """acquire() で確保した枠を返す"""
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.dec()
+        self._slots.release()
+
+    @asynccontextmanager
+    async def admit(self, client_id: str) -> AsyncIterator[None]:
+        """ブロックの間、実行の枠を確保する"""
+        await self.acquire(client_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """ブロックの間、実行の枠を確保する (検索ジョブのワーカー用)
+
+        レートは受付時に確認済みで、待つ数はワーカー数で限られるため、
+        待ち行列の上限・期限を設けずに枠が空くまで待つ。
+        """
+        await self._slots.acquire()
+        self._enter()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "clients": len(self._buckets),
+        }
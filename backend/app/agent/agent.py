@@ -1,17 +1,20 @@
 from google.adk.agents import Agent
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
 from google.genai import types
 
-import vertexai
-from vertexai import agent_engines
-
-import uuid
-from pydantic import Field
-
-import asyncio
+import logging
+from collections.abc import AsyncIterator, Callable
+from contextlib import aclosing
+from typing import Any
 
+from app.agent.policy import ModelCallPolicy, Route
+from app.agent.sessions import SessionManager
 from app.config import settings
+from app.metrics import AGENT_TOKENS
+
+logger = logging.getLogger(__name__)
 
 
 def search_photographer_on_instagram(
@@ -59,12 +62,19 @@ def analyze_image_style(image_url: str) -> str:
     return get_image_analysis_prompt(image_url)
 
 
-# Define the agent with the name "root_agent" (required by ADK)
-root_agent = Agent(
-    name="photographer_search_agent",
-    model="gemini-2.5-flash",
-    description="AI agent that helps find photographers for destination photography based on style preferences, location, and language requirements.",
-    instruction="""You are a helpful photography assistant that specializes in finding photographers for destination shoots.
+def _create_agent(model) -> Agent:
+    """指定したモデルで写真家検索のエージェントを生成する
+
+    ヘッジ・フォールバックの経路は、モデルだけを変えた同じエージェントを使う。
+    """
+    return Agent(
+        name="photographer_search_agent",
+        model=model,
+        description=(
+            "AI agent that helps find photographers for destination photography"
+            " based on style preferences, location, and language requirements."
+        ),
+        instruction="""You are a helpful photography assistant that specializes in finding photographers for destination shoots.
     
     Your capabilities include:
     1. Analyzing reference images to understand desired photography style
@@ -78,44 +88,270 @@ root_agent = Agent(
     3. Return results in JSON format with imageUrl and instagramUrl fields
     
     Always respond with helpful, accurate information and provide Instagram URLs for photographer discovery.""",
-    tools=[search_photographer_on_instagram, analyze_image_style],
-)
+        tools=[search_photographer_on_instagram, analyze_image_style],
+    )
 
-# Vertex AI Agent Engine
-# agent_engine = agent_engines.create()
-# app_name = agent_engine.name.split("/")[-1]
+
+# Define the agent with the name "root_agent" (required by ADK)
+root_agent = _create_agent(settings.AGENT_MODEL)
 
 # Session and Runner
-session_service = InMemorySessionService()
+# 初回の呼び出しまで生成しない (テスト・ベンチマークでは runner を差し替える)
+_RUNTIME = ("session_service", "runner", "session_manager")
 
-runner = Runner(
-    agent=root_agent, app_name="photographer-search", session_service=session_service
-)
 
+def _create_runtime() -> None:
+    global session_service, runner, session_manager
 
-async def setup_session(app_name, user_id, session_id):
-    session = await session_service.create_session(
-        app_name=app_name,
-        user_id=user_id,
-        session_id=session_id,
+    session_service = InMemorySessionService()
+    runner = Runner(
+        agent=root_agent,
+        app_name="photographer-search",
+        session_service=session_service,
+    )
+    # 呼び出しごとに新しいセッションを払い出す (同時実行の検索で履歴を共有しない)
+    session_manager = SessionManager(
+        session_service,
+        app_name="photographer-search",
+        stateless=settings.AGENT_SESSION_STATELESS,
+        ttl=settings.AGENT_SESSION_TTL,
+        max_sessions=settings.AGENT_MAX_SESSIONS,
     )
-    return session
+
+
+def _create_policy() -> None:
+    global policy
+
+    hedge = fallback = None
+    if settings.AGENT_HEDGE:
+        hedge = Route(
+            "hedge",
+            settings.AGENT_HEDGE_MODEL or settings.AGENT_MODEL,
+            settings.AGENT_HEDGE_LOCATION,
+        )
+    if settings.AGENT_FALLBACK_MODEL:
+        fallback = Route("fallback", settings.AGENT_FALLBACK_MODEL)
+    policy = ModelCallPolicy(
+        Route("primary", settings.AGENT_MODEL),
+        hedge=hedge,
+        fallback=fallback,
+        hedge_percentile=settings.AGENT_HEDGE_PERCENTILE,
+        hedge_min_delay=settings.AGENT_HEDGE_MIN_DELAY,
+        hedge_min_samples=settings.AGENT_HEDGE_MIN_SAMPLES,
+        hedge_max_rate=settings.AGENT_HEDGE_MAX_RATE,
+        fallback_in_flight=settings.AGENT_FALLBACK_IN_FLIGHT,
+    )
+
+
+def __getattr__(name: str):
+    # モジュール属性として参照された時点で session_service・runner・session_manager・
+    # policy を生成する
+    if name in _RUNTIME:
+        _create_runtime()
+        return globals()[name]
+    if name == "policy":
+        _create_policy()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _runtime():
+    """(runner, session_manager) を返す (未生成なら生成する)"""
+    if "session_manager" not in globals():
+        # 生成前に runner だけ差し替えられていれば、それを使う
+        replaced = globals().get("runner")
+        _create_runtime()
+        if replaced is not None:
+            globals()["runner"] = replaced
+    return globals()["runner"], globals()["session_manager"]
+
+
+def _policy() -> ModelCallPolicy:
+    """呼び出しのポリシーを返す (未生成なら生成する。テストでは policy を差し替える)"""
+    if "policy" not in globals():
+        _create_policy()
+    return globals()["policy"]
+
+
+def agent_policy_stats() -> dict[str, Any]:
+    """モデル呼び出しの種類ごとの件数・ヘッジ率・ヘッジの勝率・応答時間"""
+    return _policy().stats()
+
+
+# ヘッジ・フォールバックの経路ごとの Runner (既定のモデルは runner を使う)
+_route_runners: dict[Route, Runner] = {}
+# (モデル名, リージョン) から共有クライアントを持つモデルインスタンスを返す関数
+_llm_for: Callable[[str, str], Any] | None = None
+
+
+def bind_llm(llm, llm_for: Callable[[str, str], Any] | None = None) -> None:
+    """共有クライアントを持つモデルインスタンスをエージェントに設定する
+
+    モデル名の文字列のままだと ADK は呼び出しごとに GenAI クライアントを生成するため、
+    起動時に Resources から受け取ったインスタンスに差し替える。
+    llm_for があれば、ヘッジ・フォールバックの経路のモデルもそれで生成する。
+    """
+    global _llm_for
+
+    root_agent.model = llm
+    _llm_for = llm_for
+    _route_runners.clear()
+
+
+def _runner_for(route: Route):
+    """経路 (モデル・リージョン) に送る Runner"""
+    runner, _ = _runtime()
+    if (route.model == settings.AGENT_MODEL and not route.location) or not isinstance(
+        runner, Runner
+    ):
+        # 差し替えた runner (テスト・ベンチマーク) は全ての経路で使う
+        return runner
+
+    route_runner = _route_runners.get(route)
+    if route_runner is None:
+        model = _llm_for(route.model, route.location) if _llm_for else route.model
+        route_runner = _route_runners[route] = Runner(
+            agent=_create_agent(model),
+            app_name="photographer-search",
+            session_service=globals()["session_service"],
+        )
+    return route_runner
+
+
+def _record_usage(event) -> None:
+    """モデル応答のイベントに含まれるトークン数をメトリクスに加算する"""
+    usage = getattr(event, "usage_metadata", None)
+    if usage is None:
+        return
+    if usage.prompt_token_count:
+        AGENT_TOKENS.inc(usage.prompt_token_count, kind="prompt")
+    if usage.candidates_token_count:
+        AGENT_TOKENS.inc(usage.candidates_token_count, kind="candidates")
 
 
 # Agent Interaction
-async def call_agent(query):
-    # await でセッションを作成
-    await setup_session(
-        app_name="photographer-search", user_id="user", session_id="session"
+def _user_content(query, image: tuple[bytes, str] | None = None):
+    """クエリ (と添付する画像) からユーザーのメッセージを作る
+
+    Args:
+        query: エージェントへのクエリ
+        image: (画像データ, MIME タイプ)。モデルがテキストと一緒に画像そのものを受け取る
+    """
+    parts = [types.Part(text=query)]
+    if image is not None:
+        data, mime_type = image
+        parts.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+    return types.Content(role="user", parts=parts)
+
+
+async def _route_events(
+    query, route: Route, image: tuple[bytes, str] | None = None, **run_kwargs
+) -> AsyncIterator:
+    """経路 route にクエリを送り、エージェントのイベントを返す
+
+    runner.run() は同期ジェネレーターで、モデル呼び出しの間イベントループを
+    止めてしまう。非同期の runner.run_async() を使い、他のリクエストと並行に処理する。
+    """
+    content = _user_content(query, image)
+    runner = _runner_for(route)
+    _, session_manager = _runtime()
+
+    async with (
+        session_manager.session() as (user_id, session_id),
+        aclosing(
+            runner.run_async(
+                user_id=user_id,
+                session_id=session_id,
+                new_message=content,
+                **run_kwargs,
+            )
+        ) as events,
+    ):
+        async for event in events:
+            yield event
+
+
+async def _final_text(
+    query, route: Route, image: tuple[bytes, str] | None = None
+) -> str | None:
+    async with aclosing(_route_events(query, route, image)) as events:
+        async for event in events:
+            _record_usage(event)
+            if event.is_final_response():
+                final_response = event.content.parts[0].text
+                logger.debug("Agent response: %s", final_response)
+                return final_response
+    return None
+
+
+async def _stream_text(query, route: Route) -> AsyncIterator[str]:
+    streamed = False
+    async with aclosing(
+        _route_events(
+            query, route, run_config=RunConfig(streaming_mode=StreamingMode.SSE)
+        )
+    ) as events:
+        async for event in events:
+            if not event.partial:
+                # 部分応答のトークン数は最終応答にも含まれる
+                _record_usage(event)
+            parts = event.content.parts if event.content else None
+            text = "".join(p.text for p in parts or () if p.text)
+            if event.partial:
+                if text:
+                    streamed = True
+                    yield text
+            elif event.is_final_response():
+                # 部分応答を返した場合、最終応答はそれらをまとめたもの
+                if text and not streamed:
+                    yield text
+                return
+
+
+async def call_agent(
+    query,
+    timeout: float | None = None,
+    kind: str = "agent",
+    image: tuple[bytes, str] | None = None,
+):
+    """エージェントにクエリを送り、最終応答のテキストを返す
+
+    呼び出しには policy (期限・ヘッジ・フォールバック) を適用する。
+
+    Args:
+        query: エージェントへのクエリ
+        timeout: 応答を待つ最大秒数 (超えると TimeoutError、呼び出しはキャンセルされる)
+        kind: 呼び出しの種類 (応答時間とヘッジの集計の単位)
+        image: クエリに添付する (画像データ, MIME タイプ)
+
+    Returns:
+        str: 最終応答のテキスト (得られなかった場合は None)
+    """
+    return await _policy().call(
+        kind, lambda route: _final_text(query, route, image), timeout
     )
 
-    content = types.Content(role="user", parts=[types.Part(text=query)])
 
-    # runner.run() は同期関数なので OK
-    events = runner.run(user_id="user", session_id="session", new_message=content)
+async def stream_agent(
+    query, timeout: float | None = None, kind: str = "search"
+) -> AsyncIterator[str]:
+    """エージェントにクエリを送り、応答のテキストを生成された断片から順に返す
+
+    SSE のストリーミングで部分応答のイベントを受け取り、その断片を返す。
+    部分応答が届かなかった場合 (ストリーミングしないモデルなど) は、
+    最終応答を 1 つの断片として返す。
+    呼び出しには policy を適用し、最初の断片が届くまでの時間でヘッジを判断する。
 
-    for event in events:
-        if event.is_final_response():
-            final_response = event.content.parts[0].text
-            print("Agent Response: ", final_response)
-            return final_response
+    Args:
+        query: エージェントへのクエリ
+        timeout: 応答を待つ最大秒数 (超えると TimeoutError、呼び出しはキャンセルされる)
+        kind: 呼び出しの種類 (応答時間とヘッジの集計の単位)
+
+    Yields:
+        str: 応答のテキストの断片
+    """
+    async with aclosing(
+        _policy().stream(kind, lambda route: _stream_text(query, route), timeout)
+    ) as chunks:
+        async for chunk in chunks:
+            yield chunk
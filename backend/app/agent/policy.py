@@ -0,0 +1,351 @@
+"""
+モデル呼び出しのポリシー (期限・ヘッジ・フォールバック)
+
+モデルの応答時間の裾 (p99) を詰めるため、1 回の呼び出しを次のように扱う。
+
+- 期限: 呼び出し全体 (ヘッジを含む) を deadline 秒で打ち切る
+- ヘッジ: 最初の応答が、最近の応答時間の percentile を過ぎても届かなければ、
+  2 本目のリクエストを別の経路 (別のモデル・リージョン、または同じモデル) に送る。
+  先に応答した方を採用し、もう一方はキャンセルする。
+  1 本目がヘッジ前に失敗した場合は、すぐにヘッジの経路で再試行する
+- フォールバック: 実行中の呼び出しが上限を超えている間は、
+  安価なモデルに送り、ヘッジしない
+
+ストリーミングの呼び出しは最初の断片が届いた時点を「応答」とみなす。
+ヘッジした割合と、ヘッジが勝った割合は stats() とメトリクスで確認できる。
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import aclosing
+from typing import Any, NamedTuple, TypeVar
+
+from app.metrics import (
+    AGENT_CALL_SECONDS,
+    AGENT_FALLBACKS,
+    AGENT_HEDGE_WINS,
+    AGENT_HEDGES,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 断片の受け渡しに使う印
+_END = object()
+
+
+class Route(NamedTuple):
+    """モデル呼び出しの送り先"""
+
+    name: str  # "primary"・"hedge"・"fallback"
+    model: str
+    location: str = ""  # 空なら既定のリージョン
+
+
+class LatencyWindow:
+    """直近 size 件の応答時間"""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        """q (0〜1) 分位の応答時間 (サンプルが無ければ None)"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _KindStats:
+    def __init__(self, window: int):
+        self.latency = LatencyWindow(window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.failures = 0
+
+
+class ModelCallPolicy:
+    """モデル呼び出しに期限・ヘッジ・フォールバックを適用する"""
+
+    def __init__(
+        self,
+        primary: Route,
+        hedge: Route | None = None,
+        fallback: Route | None = None,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 1.0,
+        hedge_min_samples: int = 20,
+        hedge_max_rate: float = 0.1,
+        fallback_in_flight: int = 0,
+        window: int = 200,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            primary: 通常の送り先
+            hedge: ヘッジの送り先 (None ならヘッジしない)
+            fallback: 負荷が高いときの送り先 (None ならフォールバックしない)
+            hedge_percentile: この分位の応答時間を過ぎたらヘッジする
+            hedge_min_delay: ヘッジまで待つ最小の秒数
+            hedge_min_samples: 応答時間のサンプルがこの数に満たない間はヘッジしない
+            hedge_max_rate: ヘッジする呼び出しの割合の上限
+                (応答時間が急に悪化した場合の歯止め)
+            fallback_in_flight: 実行中の呼び出しがこの数以上ならフォールバックする
+                (0 なら無効)
+            window: 分位の計算に使う直近の応答時間の数
+            clock: 時刻関数 (テスト用)
+        """
+        self.primary = primary
+        self.hedge = hedge
+        self.fallback = fallback
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_rate = hedge_max_rate
+        self.fallback_in_flight = fallback_in_flight
+        self.window = window
+        self._clock = clock
+        self._kinds: dict[str, _KindStats] = {}
+        self.in_flight = 0
+
+    def _stats_for(self, kind: str) -> _KindStats:
+        stats = self._kinds.get(kind)
+        if stats is None:
+            stats = self._kinds[kind] = _KindStats(self.window)
+        return stats
+
+    def _overloaded(self) -> bool:
+        return (
+            self.fallback is not None
+            and self.fallback_in_flight > 0
+            and self.in_flight >= self.fallback_in_flight
+        )
+
+    def hedge_delay(self, kind: str) -> float | None:
+        """ヘッジするまで待つ秒数 (ヘッジしない場合は None)"""
+        stats = self._stats_for(kind)
+        if self.hedge is None or len(stats.latency) < self.hedge_min_samples:
+            return None
+        if stats.hedged >= self.hedge_max_rate * max(1, stats.calls):
+            return None
+        return max(
+            self.hedge_min_delay, stats.latency.percentile(self.hedge_percentile)
+        )
+
+    async def stream(
+        self,
+        kind: str,
+        attempt: Callable[[Route], AsyncIterator[T]],
+        deadline: float | None = None,
+    ) -> AsyncIterator[T]:
+        """attempt(route) の断片を、最初に断片を返した経路から順に返す
+
+        Args:
+            kind: 呼び出しの種類 (応答時間・ヘッジの集計の単位)
+            attempt: 送り先を受け取り、応答の断片を返す非同期ジェネレーター関数
+            deadline: 呼び出し全体の期限 (秒)。超えると TimeoutError
+
+        Raises:
+            TimeoutError: 期限を過ぎた場合
+            Exception: 全ての経路が失敗した場合は最後の例外
+        """
+        stats = self._stats_for(kind)
+        stats.calls += 1
+        loop = asyncio.get_running_loop()
+        expires_at = None if deadline is None else loop.time() + deadline
+
+        def remaining() -> float | None:
+            if expires_at is None:
+                return None
+            left = expires_at - loop.time()
+            if left <= 0:
+                raise TimeoutError(f"Model call exceeded {deadline}s")
+            return left
+
+        if self._overloaded():
+            route, hedge_route, delay = self.fallback, None, None
+            stats.fallbacks += 1
+            AGENT_FALLBACKS.inc(kind=kind)
+        else:
+            route, hedge_route, delay = self.primary, self.hedge, self.hedge_delay(kind)
+
+        attempts: list[_Attempt] = []
+        self.in_flight += 1
+        try:
+            attempts.append(_Attempt(route, attempt, self._clock))
+            winner = None
+            last_error: BaseException | None = None
+            while winner is None:
+                waiting = [a for a in attempts if not a.failed]
+                hedge_now = False
+                if not waiting:
+                    if hedge_route is None or len(attempts) > 1:
+                        raise last_error
+                    # ヘッジ前に失敗した場合は、すぐにヘッジの経路で再試行する
+                    hedge_now = True
+                else:
+                    timeout = remaining()
+                    if delay is not None and len(attempts) == 1:
+                        timeout = delay if timeout is None else min(timeout, delay)
+                    done, _ = await asyncio.wait(
+                        [a.first for a in waiting],
+                        timeout=timeout,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    for a in waiting:
+                        if a.first not in done:
+                            continue
+                        if a.first.exception() is not None:
+                            a.failed = True
+                            last_error = a.first.exception()
+                            logger.warning(
+                                "Model call via %s failed: %r", a.route.name, last_error
+                            )
+                        elif winner is None:
+                            winner = a
+                    if not done:
+                        remaining()
+                        hedge_now = len(attempts) == 1 and hedge_route is not None
+                if hedge_now and winner is None:
+                    reason = "error" if attempts[0].failed else "slow"
+                    stats.hedged += 1
+                    AGENT_HEDGES.inc(kind=kind, reason=reason)
+                    attempts.append(_Attempt(hedge_route, attempt, self._clock))
+
+            # 先に応答した経路を採用し、もう一方はキャンセルする
+            for a in attempts:
+                if a is not winner:
+                    await a.cancel()
+            latency = winner.first_at - winner.started
+            AGENT_CALL_SECONDS.observe(latency, kind=kind, route=winner.route.name)
+            if winner is attempts[0]:
+                if route is self.primary:
+                    stats.latency.add(latency)
+            else:
+                stats.hedge_wins += 1
+                AGENT_HEDGE_WINS.inc(kind=kind)
+                if not attempts[0].failed:
+                    # 負けた 1 本目の応答時間は少なくともここまでかかった
+                    stats.latency.add(self._clock() - attempts[0].started)
+
+            async for item in winner.items(remaining):
+                yield item
+        except Exception:
+            stats.failures += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            for a in attempts:
+                await a.cancel()
+
+    async def call(
+        self,
+        kind: str,
+        attempt: Callable[[Route], Awaitable[T]],
+        deadline: float | None = None,
+    ) -> T:
+        """attempt(route) の結果を、最初に応答した経路から返す (stream() と同じ規則)"""
+
+        async def once(route: Route) -> AsyncIterator[T]:
+            yield await attempt(route)
+
+        async with aclosing(self.stream(kind, once, deadline)) as results:
+            async for result in results:
+                return result
+        raise RuntimeError("Model call returned no result")
+
+    def stats(self) -> dict[str, Any]:
+        """呼び出しの種類ごとの件数・ヘッジ率・ヘッジの勝率・応答時間の分位"""
+        kinds = {}
+        for kind, s in self._kinds.items():
+            p50 = s.latency.percentile(0.5)
+            p95 = s.latency.percentile(0.95)
+            kinds[kind] = {
+                "calls": s.calls,
+                "failures": s.failures,
+                "fallbacks": s.fallbacks,
+                "hedged": s.hedged,
+                "hedge_wins": s.hedge_wins,
+                "hedge_rate": round(s.hedged / s.calls, 4) if s.calls else 0.0,
+                "hedge_win_rate": round(s.hedge_wins / s.hedged, 4)
+                if s.hedged
+                else 0.0,
+                "p50_ms": None if p50 is None else round(p50 * 1000, 1),
+                "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+                "hedge_delay_ms": None
+                if (delay := self.hedge_delay(kind)) is None
+                else round(delay * 1000, 1),
+            }
+        return {"in_flight": self.in_flight, "kinds": kinds}
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+
+class _Attempt:
+    """1 つの経路への呼び出し
+
+    応答の断片は専用のタスクで読み出してキューに入れる
+    (呼び出し側のタスクと独立にキャンセルできるようにするため)。
+    first は最初の断片 (または終わり) が届くと完了する。
+    """
+
+    def __init__(self, route: Route, attempt, clock: Callable[[], float]):
+        self.route = route
+        self.failed = False
+        self._clock = clock
+        self.started = clock()
+        self.first_at: float | None = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.first: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.first.add_done_callback(_consume_exception)
+        self._task = asyncio.create_task(self._pump(attempt))
+
+    async def _pump(self, attempt) -> None:
+        try:
+            async with aclosing(attempt(self.route)) as items:
+                async for item in items:
+                    self._put(item)
+            self._put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not self.first.done():
+                self.first.set_exception(e)
+            else:
+                self._queue.put_nowait(e)
+
+    def _put(self, item) -> None:
+        if not self.first.done():
+            self.first_at = self._clock()
+            self.first.set_result(None)
+        self._queue.put_nowait(item)
+
+    async def items(self, remaining: Callable[[], float | None]) -> AsyncIterator:
+        while True:
+            item = await asyncio.wait_for(self._queue.get(), remaining())
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def cancel(self) -> None:
+        if not self.first.done():
+            self.first.cancel()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
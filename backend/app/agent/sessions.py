@@ -0,0 +1,107 @@
+"""
+エージェント呼び出しごとのセッション管理
+
+呼び出しごとに新しいセッション ID を払い出し、同時に実行される検索どうしが
+同じ履歴を共有・上書きしないようにする。残したセッションは TTL と
+最大件数 (LRU) で破棄し、インスタンスの稼働中にメモリが増え続けないようにする。
+"""
+
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class SessionManager:
+    """セッションの払い出しと破棄を担う"""
+
+    def __init__(
+        self,
+        session_service,
+        app_name: str,
+        user_id: str = "user",
+        stateless: bool = True,
+        ttl: float = 600,
+        max_sessions: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            session_service: ADK の SessionService
+            app_name: Runner に設定したアプリ名
+            user_id: セッションのユーザー ID
+            stateless: True なら呼び出しが終わった時点でセッションを削除する
+            ttl: stateless でない場合に、最後の利用からセッションを残す秒数
+            max_sessions: stateless でない場合に残すセッションの最大数
+            clock: 時刻関数 (テスト用)
+        """
+        self.session_service = session_service
+        self.app_name = app_name
+        self.user_id = user_id
+        self.stateless = stateless
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._clock = clock
+        self._sessions: OrderedDict[str, float] = OrderedDict()
+        self._in_use: set[str] = set()
+        self.created = 0
+        self.evicted = 0
+
+    async def _delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+        try:
+            await self.session_service.delete_session(
+                app_name=self.app_name, user_id=self.user_id, session_id=session_id
+            )
+        except Exception as e:
+            logger.warning("Failed to delete session %s: %s", session_id, e)
+
+    async def _evict(self, reserve: int = 0) -> None:
+        """期限切れのセッションと、上限を超えた古いセッションを削除する"""
+        now = self._clock()
+        # 実行中の呼び出しが使っているセッションは削除しない
+        idle = [sid for sid in self._sessions if sid not in self._in_use]
+        expired = [sid for sid in idle if now - self._sessions[sid] > self.ttl]
+        overflow = len(self._sessions) - len(expired) + reserve - self.max_sessions
+        if overflow > 0:
+            live = [sid for sid in idle if sid not in expired]
+            expired += live[:overflow]
+
+        for session_id in expired:
+            await self._delete(session_id)
+            self.evicted += 1
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[tuple[str, str]]:
+        """新しいセッションを作り、(user_id, session_id) を渡す"""
+        if not self.stateless:
+            await self._evict(reserve=1)
+
+        session_id = uuid.uuid4().hex
+        await self.session_service.create_session(
+            app_name=self.app_name, user_id=self.user_id, session_id=session_id
+        )
+        self.created += 1
+        self._sessions[session_id] = self._clock()
+        self._in_use.add(session_id)
+
+        try:
+            yield self.user_id, session_id
+        finally:
+            self._in_use.discard(session_id)
+            if self.stateless:
+                await self._delete(session_id)
+            elif session_id in self._sessions:
+                self._sessions[session_id] = self._clock()
+                self._sessions.move_to_end(session_id)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._sessions),
+            "created": self.created,
+            "evicted": self.evicted,
+        }
@@ -1,24 +1,161 @@
+import json
 import logging
-from fastapi import FastAPI, HTTPException
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from google.adk.cli.fast_api import get_fast_api_app
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 
+from app.admission import RejectedError
 from app.config import settings
-from app.models import SearchRequest, SearchResponse
+from app.images import decode_data_url
+from app.ingest import ImageTooLargeError, read_reference_image
+from app.jobs import JobQueueFullError
+from app.logs import RequestLogMiddleware, configure_logging, log_payload
+from app.metrics import CONTENT_TYPE, SEARCH_RESULTS, STAGE_SECONDS, registry
+from app.models import JobResponse, SearchRequest, SearchResponse
+from app.resources import (
+    Resources,
+    ResourceUsageMiddleware,
+    agent_ready,
+    get_resources,
+)
 from app.services import PhotographerSearchService
+from app.startup import startup_timer
 
-# ログ設定
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+# ログ設定 (レベルと形式は LOG_LEVEL / LOG_FORMAT)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-logger.info("Initializing FastAPI app with ADK...")
-app = get_fast_api_app(
-    agents_dir=settings.AGENT_DIR,
-    allow_origins=settings.ALLOWED_ORIGINS,
-    web=True,
-)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """共有クライアントを起動時に準備し、終了時に解放する"""
+    resources = get_resources()
+    with startup_timer.phase("resources"):
+        await resources.startup()
+    startup_timer.finish()
+    try:
+        yield
+    finally:
+        await resources.aclose()
+
+
+def get_search_service(
+    resources: Resources = Depends(get_resources),
+) -> PhotographerSearchService:
+    """共有クライアントを注入した検索サービスを返す"""
+    return PhotographerSearchService(resources)
+
+
+def _client_id(request: Request) -> str:
+    """レート制限に使うクライアントの識別子
+
+    X-Forwarded-For の左側はクライアントが自由に書けるため、信頼できるプロキシ
+    (TRUSTED_PROXY_HOPS 段) が付け加えた右側から数えた位置を使う。
+    ヘッダーが無い・段数が足りない場合は接続元を使う。
+    """
+    hops = settings.TRUSTED_PROXY_HOPS
+    forwarded = [
+        hop.strip()
+        for hop in request.headers.get("x-forwarded-for", "").split(",")
+        if hop.strip()
+    ]
+    if hops > 0 and len(forwarded) >= hops:
+        return forwarded[-hops]
+    return request.client.host if request.client else "unknown"
+
+
+def _rejected(e: RejectedError) -> HTTPException:
+    """受付制限の拒否を Retry-After 付きの HTTPException にする"""
+    logger.warning("Search rejected: %s", e.reason)
+    return HTTPException(
+        status_code=e.status_code,
+        detail={
+            "error": "Too Many Requests"
+            if e.status_code == 429
+            else "Service Unavailable",
+            "message": e.reason,
+        },
+        headers={"Retry-After": e.retry_after_header},
+    )
+
+
+async def _acquire_slot(request: Request, resources: Resources):
+    """検索の実行枠を確保し、枠を返す関数を返す (2 回目以降の呼び出しは何もしない)
+
+    Raises:
+        HTTPException: 429 - クライアントのレート制限を超えた
+        HTTPException: 503 - 実行枠の待ち行列が満杯、または待ちきれなかった
+    """
+    admission = resources.admission
+    try:
+        await admission.acquire(_client_id(request))
+    except RejectedError as e:
+        raise _rejected(e) from e
+
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            admission.release()
+
+    return release
+
+
+async def admission_slot(
+    request: Request, resources: Resources = Depends(get_resources)
+):
+    """エンドポイントの処理中、検索の実行枠を確保する依存関係"""
+    release = await _acquire_slot(request, resources)
+    try:
+        yield
+    finally:
+        release()
+
+
+def stats_endpoints_enabled() -> None:
+    """STATS_ENDPOINTS が無効なら JSON の統計エンドポイントを 404 にする依存関係
+
+    Raises:
+        HTTPException: 404 - STATS_ENDPOINTS が無効
+    """
+    if not settings.STATS_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+def _create_app() -> FastAPI:
+    """アプリを生成する
+
+    APP_MODE=production では ADK の開発用 Web UI・API を組み込まない
+    (エージェントの読み込みを起動時に行わず、検索 API だけを提供する)。
+    """
+    if settings.APP_MODE == "production":
+        return FastAPI(
+            title=settings.API_TITLE,
+            description=settings.API_DESCRIPTION,
+            version=settings.API_VERSION,
+            lifespan=lifespan,
+        )
+
+    from google.adk.cli.fast_api import get_fast_api_app
+
+    return get_fast_api_app(
+        agents_dir=settings.AGENT_DIR,
+        allow_origins=settings.ALLOWED_ORIGINS,
+        web=True,
+        lifespan=lifespan,
+    )
+
+
+startup_timer.record("import", time.perf_counter() - startup_timer.started)
+logger.info("Initializing FastAPI app (mode=%s)...", settings.APP_MODE)
+with startup_timer.phase("create_app"):
+    app = _create_app()
 logger.info("FastAPI app initialized successfully")
 
 # CORS設定
@@ -29,6 +166,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# リクエストごとに 1 件の JSON ログ (所要時間・各段階の時間)
+app.add_middleware(RequestLogMiddleware, exclude_paths=["/", "/metrics"])
+# 共有クライアントの再利用をリクエスト単位で数える
+app.add_middleware(ResourceUsageMiddleware)
 
 # サービス初期化
 logger.info("PhotographerSearchService functions ready...")
@@ -37,15 +178,73 @@ logger.info("PhotographerSearchService functions ready...")
 @app.get("/")
 async def health_check():
     """ヘルスチェック用エンドポイント"""
-    logger.info("Health check endpoint called")
+    logger.debug("Health check endpoint called")
     return {"message": "Before the Honeymoon API is running"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 形式のメトリクス
+
+    各段階の処理時間・結果件数・ストレージ呼び出しなどを返す。
+    """
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/resource-stats", dependencies=[Depends(stats_endpoints_enabled)])
+async def resource_stats(resources: Resources = Depends(get_resources)):
+    """共有クライアントの生成回数と、生成済みのものを使ったリクエストの数"""
+    return resources.stats()
+
+
+@app.get("/cache-stats", dependencies=[Depends(stats_endpoints_enabled)])
+async def cache_stats(resources: Resources = Depends(get_resources)):
+    """検索結果キャッシュのヒット・ミス・追い出し回数"""
+    return resources.search_cache.stats()
+
+
+@app.get("/upload-stats", dependencies=[Depends(stats_endpoints_enabled)])
+async def upload_stats(resources: Resources = Depends(get_resources)):
+    """参考画像のアップロード数と重複により省いた件数・バイト数"""
+    return resources.reference_store.stats()
+
+
+@app.get("/admission-stats", dependencies=[Depends(stats_endpoints_enabled)])
+async def admission_stats(resources: Resources = Depends(get_resources)):
+    """実行中・待機中の検索数と、受け付けなかった件数"""
+    return resources.admission.stats()
+
+
+@app.get("/startup-stats", dependencies=[Depends(stats_endpoints_enabled)])
+async def startup_stats():
+    """起動の段階ごとの所要時間 (ミリ秒)"""
+    return {"mode": settings.APP_MODE, "phases": startup_timer.stats()}
+
+
+@app.get("/agent-stats", dependencies=[Depends(stats_endpoints_enabled)])
+async def agent_stats():
+    """モデル呼び出しの種類ごとの件数・ヘッジ率・ヘッジの勝率・応答時間"""
+    await agent_ready()
+    from app.agent.agent import agent_policy_stats
+
+    return agent_policy_stats()
+
+
+@app.get("/index-stats", dependencies=[Depends(stats_endpoints_enabled)])
+async def index_stats(resources: Resources = Depends(get_resources)):
+    """写真家インデックスとスタイル索引の件数・一致回数"""
+    return {
+        "photographers": resources.photographer_index.stats(),
+        "styles": resources.style_index.stats(),
+    }
+
+
 @app.get("/agent-info")
 async def agent_info():
     """エージェント情報の提供"""
     logger.info("Agent info endpoint called")
     try:
+        await agent_ready()
         from app.agent.agent import root_agent
 
         # エージェントの利用可能なメソッドを取得
@@ -59,12 +258,12 @@ async def agent_info():
             "available_methods": methods,
             "agent_type": type(root_agent).__name__,
         }
-        logger.info(f"Agent info: {info}")
+        logger.debug("Agent info: %s", info)
         return info
     except Exception as e:
         import traceback
 
-        logger.error(f"Error getting agent info: {e}", exc_info=True)
+        logger.error("Error getting agent info: %s", e, exc_info=True)
         return {"error": str(e), "traceback": traceback.format_exc()}
 
 
@@ -77,22 +276,45 @@ async def test_agent():
 
         # シンプルなテストプロンプト
         test_prompt = 'Hello, can you respond with a simple JSON like {"status": "ok", "message": "Agent is working"}?'
-        logger.info(f"Test prompt: {test_prompt}")
+        logger.debug("Test prompt: %s", test_prompt)
 
         response = await run_agent(test_prompt, "Tokyo", "ja")
-        logger.info(f"Test agent response type: {type(response)}")
-        logger.info(f"Test agent response: {response}")
+        logger.debug("Test agent response: %s", response)
 
         return {"status": "success", "agent_response": response, "prompt": test_prompt}
     except Exception as e:
         import traceback
 
-        logger.error(f"Error in test agent: {e}", exc_info=True)
+        logger.error("Error in test agent: %s", e, exc_info=True)
         return {"status": "error", "error": str(e), "traceback": traceback.format_exc()}
 
 
-@app.post("/searchPhotographers", response_model=SearchResponse)
-async def search_photographers(request: SearchRequest):
+def _validate_language(language: str) -> None:
+    """対応言語かを確認する
+
+    Raises:
+        HTTPException: 400 - 未対応の言語
+    """
+    if language not in settings.SUPPORTED_LANGUAGES:
+        logger.warning("Invalid language: %s", language)
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid language",
+                "message": f"Supported languages: {settings.SUPPORTED_LANGUAGES}",
+            },
+        )
+
+
+@app.post(
+    "/searchPhotographers",
+    response_model=SearchResponse,
+    dependencies=[Depends(admission_slot)],
+)
+async def search_photographers(
+    request: SearchRequest,
+    service: PhotographerSearchService = Depends(get_search_service),
+):
     """フォトグラファー検索エンドポイント
 
     Args:
@@ -103,45 +325,20 @@ async def search_photographers(request: SearchRequest):
 
     Raises:
         HTTPException: 400 - 不正なリクエストパラメータ
+        HTTPException: 429 / 503 - 受付制限 (Retry-After 付き)
         HTTPException: 500 - サーバー内部エラー
     """
-    logger.info("=== Search photographers endpoint called ===")
-    logger.info(f"Request destination: {request.destination}")
-    logger.info(f"Request language: {request.preferred_language}")
-    logger.info(f"Request image length: {len(request.reference_image)}")
-
     try:
         # リクエストバリデーション
-        logger.info("Validating request...")
-        if request.preferred_language not in settings.SUPPORTED_LANGUAGES:
-            logger.error(f"Invalid language: {request.preferred_language}")
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "error": "Invalid language",
-                    "message": f"Supported languages: {settings.SUPPORTED_LANGUAGES}",
-                },
-            )
-        logger.info("Request validation passed")
+        _validate_language(request.preferred_language)
 
         # 検索サービス呼び出し
-        logger.info("Calling search service...")
-        service = PhotographerSearchService()
         results = await service.search_photographers(request)
-        logger.info(f"Search service returned {len(results)} results")
-
+        SEARCH_RESULTS.inc(len(results), endpoint="search")
         response = SearchResponse(images=results)
-        logger.info(f"Returning response with {len(response.images)} images")
-
-        # レスポンス詳細をログに記録
-        logger.info(f"=== FINAL API RESPONSE ===")
-        logger.info(
-            f"Request: destination='{request.destination}', language='{request.preferred_language}'"
-        )
-        logger.info(f"Response contains {len(response.images)} photographer results")
-        logger.info(f"Full response data: {response.model_dump()}")
-        logger.info(f"=== END API RESPONSE ===")
 
+        # レスポンス全体は一部のリクエストだけ記録する
+        log_payload(logger, "Full response data: %s", response.model_dump)
         return response
 
     except HTTPException:
@@ -152,8 +349,7 @@ async def search_photographers(request: SearchRequest):
         # その他のエラーは500エラーとして処理
         import traceback
 
-        logger.error(f"Search error: {e}", exc_info=True)
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.error("Search error: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail={
@@ -164,6 +360,185 @@ async def search_photographers(request: SearchRequest):
         )
 
 
+@app.post(
+    "/searchPhotographers/upload",
+    response_model=SearchResponse,
+    dependencies=[Depends(admission_slot)],
+)
+async def search_photographers_upload(
+    request: Request,
+    destination: str = Query(...),
+    preferred_language: str = Query(..., alias="preferredLanguage"),
+    service: PhotographerSearchService = Depends(get_search_service),
+):
+    """参考画像をボディで直接受け取るフォトグラファー検索エンドポイント
+
+    ボディはチャンク単位で読み込み、Base64 の場合も逐次デコードするため、
+    JSON の referenceImage より少ないメモリで大きな画像を扱える。
+
+    Args:
+        request: Content-Type が image/* なら画像のバイナリ、
+            それ以外なら Base64 (data URL 可) のテキスト
+        destination: 撮影地
+        preferred_language: 対応言語
+
+    Returns:
+        SearchResponse: 最大9件のフォトグラファー画像と Instagram URL
+
+    Raises:
+        HTTPException: 400 - 不正なリクエストパラメータ
+        HTTPException: 413 - 参考画像が大きすぎる
+        HTTPException: 429 / 503 - 受付制限 (Retry-After 付き)
+    """
+    _validate_language(preferred_language)
+
+    content_type = request.headers.get("content-type", "")
+    try:
+        image_bytes = await read_reference_image(
+            request.stream(),
+            base64_encoded=not content_type.startswith("image/"),
+            max_bytes=settings.MAX_REFERENCE_IMAGE_BYTES,
+        )
+    except ImageTooLargeError as e:
+        raise HTTPException(
+            status_code=413,
+            detail={"error": "Reference image too large", "message": str(e)},
+        ) from e
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid reference image", "message": str(e)},
+        ) from e
+    logger.debug("Reference image received: %d bytes", len(image_bytes))
+
+    results = await service.search_with_image(
+        destination, preferred_language, image_bytes
+    )
+    SEARCH_RESULTS.inc(len(results), endpoint="upload")
+    return SearchResponse(images=results)
+
+
+@app.post("/searchPhotographers/jobs", response_model=JobResponse, status_code=202)
+async def submit_search_job(
+    request: SearchRequest,
+    http_request: Request,
+    response: Response,
+    resources: Resources = Depends(get_resources),
+):
+    """フォトグラファー検索をジョブとして受け付け、すぐにジョブ ID を返す
+
+    受付時にクライアントのレート制限を確認する。検索はプロセス内のワーカー
+    (JOB_WORKERS) が、同期の検索と同じ実行枠 (SEARCH_MAX_IN_FLIGHT) を確保して実行する。
+    結果は GET /searchPhotographers/jobs/{jobId} で取得する。
+
+    Raises:
+        HTTPException: 400 - 不正なリクエストパラメータ
+        HTTPException: 429 - クライアントのレート制限を超えた (Retry-After 付き)
+        HTTPException: 503 - 実行待ちのジョブが上限に達している (Retry-After 付き)
+    """
+    _validate_language(request.preferred_language)
+    try:
+        resources.admission.check_rate(_client_id(http_request))
+    except RejectedError as e:
+        raise _rejected(e) from e
+    try:
+        job = await resources.jobs.submit(request)
+    except JobQueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "Service Unavailable", "message": str(e)},
+            headers={"Retry-After": str(max(1, round(settings.JOB_MAX_WAIT)))},
+        ) from e
+    response.headers["Location"] = f"/searchPhotographers/jobs/{job['jobId']}"
+    return JobResponse.model_validate(job)
+
+
+@app.get("/searchPhotographers/jobs/{job_id}", response_model=JobResponse)
+async def get_search_job(
+    job_id: str,
+    wait: float = Query(0, ge=0),
+    resources: Resources = Depends(get_resources),
+):
+    """検索ジョブの状態と結果を返す
+
+    Args:
+        job_id: ジョブ ID
+        wait: 完了していなければ最大この秒数だけ待ってから返す
+            (ロングポーリング。JOB_MAX_WAIT 秒まで)
+
+    Raises:
+        HTTPException: 404 - ジョブが存在しない、または保持期間を過ぎた
+    """
+    job = await resources.jobs.get(job_id, wait=min(wait, settings.JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={"error": "Job not found", "message": job_id},
+        )
+    return JobResponse.model_validate(job)
+
+
+@app.post("/searchPhotographers/stream")
+async def search_photographers_stream(
+    request: SearchRequest,
+    http_request: Request,
+    service: PhotographerSearchService = Depends(get_search_service),
+):
+    """検索結果を見つかった順に NDJSON で返すフォトグラファー検索エンドポイント
+
+    1 行に 1 つの JSON を出力する。
+    - {"type": "image", "image": {"imageUrl": ..., "instagramUrl": ...}}
+    - {"type": "error", "message": ...} (途中で失敗した場合)
+    - {"type": "summary", "count": 件数, "elapsedMs": 所要ミリ秒} (最後に必ず 1 行)
+
+    実行枠はストリームを送り終えるまで確保する。
+
+    Raises:
+        HTTPException: 400 - 不正なリクエストパラメータ
+        HTTPException: 429 / 503 - 受付制限 (Retry-After 付き)
+    """
+    _validate_language(request.preferred_language)
+    try:
+        image_bytes = decode_data_url(request.reference_image)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid reference image", "message": str(e)},
+        ) from e
+    release = await _acquire_slot(http_request, service.resources)
+
+    async def events():
+        started = time.perf_counter()
+        count = 0
+        try:
+            async for result in service.stream_search(
+                request.destination, request.preferred_language, image_bytes
+            ):
+                count += 1
+                event = {
+                    "type": "image",
+                    "image": result.model_dump(mode="json", by_alias=True),
+                }
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            logger.error("Search stream error: %s", e, exc_info=True)
+            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+        finally:
+            release()
+
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage="stream")
+        SEARCH_RESULTS.inc(count, endpoint="stream")
+        elapsed_ms = round(elapsed * 1000)
+        summary = {"type": "summary", "count": count, "elapsedMs": elapsed_ms}
+        yield json.dumps(summary) + "\n"
+
+    # ボディの送信前に切断された場合も枠を返す
+    return StreamingResponse(
+        events(), media_type="application/x-ndjson", background=BackgroundTask(release)
+    )
+
+
 def main(request=None):
     import uvicorn
 
@@ -0,0 +1,241 @@
+"""
+TTL とサイズ上限 (LRU) を持つ非同期キャッシュ
+
+プロセス内の LRU に加えて、Redis 互換のバックエンドを 2 段目として使える。
+期限切れ直後のエントリは stale として返しつつ、裏で再計算して更新する
+(stale-while-revalidate)。
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryRedis:
+    """Redis 互換バックエンドのローカル代替 (get/set/delete のみ)
+
+    テストやローカル開発で redis.asyncio.Redis の代わりに使う。
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._data: dict[str, tuple[str, float | None]] = {}
+
+    async def get(self, key: str) -> str | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= self._clock():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ex: float | None = None) -> None:
+        expires_at = self._clock() + ex if ex else None
+        self._data[key] = (value, expires_at)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class TTLCache:
+    """TTL・LRU・stale-while-revalidate 付きキャッシュ
+
+    値は JSON にできるものに限る (バックエンドへ保存するため)。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int = 256,
+        ttl: float = 3600,
+        stale_ttl: float = 0,
+        backend=None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            name: キャッシュ名 (バックエンドのキー接頭辞にも使う)
+            max_size: プロセス内に保持する最大件数
+            ttl: 新鮮とみなす秒数
+            stale_ttl: ttl 経過後、stale として返してよい秒数
+            backend: Redis 互換の 2 段目 (get/set(ex=)/delete を持つ非同期クライアント)
+            clock: 時刻関数 (テスト用)
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.backend = backend
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.skipped_refreshes = 0
+
+    def _backend_key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def _put_local(self, key: str, value: Any, stored_at: float) -> None:
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _lookup(self, key: str) -> tuple[Any, float] | None:
+        """(値, 保存時刻) を返す。保持期間を過ぎたものは None"""
+        now = self._clock()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now - entry[1] < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                return entry
+            del self._entries[key]
+
+        if self.backend is None:
+            return None
+        try:
+            raw = await self.backend.get(self._backend_key(key))
+        except Exception as e:
+            logger.warning("Cache backend get failed for %s: %s", self.name, e)
+            return None
+        if raw is None:
+            return None
+        payload = json.loads(raw)
+        entry = (payload["v"], payload["t"])
+        if now - entry[1] >= self.ttl + self.stale_ttl:
+            return None
+        self._put_local(key, *entry)
+        return entry
+
+    async def get(self, key: str) -> Any | None:
+        """新鮮な値のみを返す (stale は None 扱い)"""
+        entry = await self._lookup(key)
+        if entry is None or self._clock() - entry[1] >= self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    async def set(self, key: str, value: Any) -> None:
+        stored_at = self._clock()
+        self._put_local(key, value, stored_at)
+        if self.backend is None:
+            return
+        try:
+            await self.backend.set(
+                self._backend_key(key),
+                json.dumps({"v": value, "t": stored_at}),
+                ex=self.ttl + self.stale_ttl,
+            )
+        except Exception as e:
+            logger.warning("Cache backend set failed for %s: %s", self.name, e)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] = lambda value: True,
+        admission=None,
+    ) -> Any:
+        """キャッシュがあれば返し、無ければ compute() の結果を保存して返す
+
+        stale なエントリは即座に返し、同じキーにつき 1 つだけ裏で再計算する。
+        admission (try_acquire()/release() を持つ) を渡すと、裏での再計算は
+        その実行枠に空きがある場合だけ行う。
+        """
+        entry = await self._lookup(key)
+        if entry is not None:
+            value, stored_at = entry
+            if self._clock() - stored_at < self.ttl:
+                self.hits += 1
+                return value
+            self.stale_hits += 1
+            self._schedule_refresh(key, compute, should_cache, admission)
+            return value
+
+        self.misses += 1
+        value = await compute()
+        if should_cache(value):
+            await self.set(key, value)
+        return value
+
+    def _schedule_refresh(self, key, compute, should_cache, admission) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                # 枠が埋まっていれば見送る (次の stale ヒットで再び試す)
+                if admission is not None and not await admission.try_acquire():
+                    self.skipped_refreshes += 1
+                    logger.debug("Skipped background refresh for %s", self.name)
+                    return
+                try:
+                    value = await compute()
+                    if should_cache(value):
+                        await self.set(key, value)
+                    self.refreshes += 1
+                finally:
+                    if admission is not None:
+                        admission.release()
+            except Exception as e:
+                logger.warning("Background refresh failed for %s: %s", self.name, e)
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "skipped_refreshes": self.skipped_refreshes,
+        }
+
+    async def aclose(self) -> None:
+        """実行中の再計算を止め、バックエンドを閉じる"""
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        self._refreshing.clear()
+        close = getattr(self.backend, "aclose", None)
+        if close is not None:
+            await close()
+
+
+def create_cache_backend(url: str):
+    """URL から Redis 互換バックエンドを生成する
+
+    "memory://" はプロセス内の InMemoryRedis、それ以外は redis パッケージを使う。
+    """
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return InMemoryRedis()
+
+    try:
+        import redis.asyncio as redis
+    except ImportError as e:
+        raise RuntimeError(
+            "redis package is required for SEARCH_CACHE_BACKEND_URL"
+        ) from e
+    return redis.Redis.from_url(url, decode_responses=True)
@@ -1,5 +1,4 @@
 import os
-from typing import List
 
 
 class Settings:
@@ -10,24 +9,172 @@ class Settings:
     API_DESCRIPTION: str = "海外でのフォトグラファー検索API"
     API_VERSION: str = "0.1.0"
 
+    # 起動モード
+    # "production" では ADK の開発用 Web UI・API を組み込まず、
+    # エージェント (ADK・GenAI) の読み込みを起動後に裏で行う
+    # (コールドスタートで最初のリクエストを待たせない)
+    APP_MODE: str = os.getenv("APP_MODE", "development")
+
     # エージェント設定
     AGENT_DIR: str = os.path.join(os.path.dirname(__file__), "agent")
+    AGENT_MODEL: str = os.getenv("AGENT_MODEL", "gemini-2.5-flash")
+    # エージェントの応答を待つ最大秒数
+    AGENT_TIMEOUT: float = float(os.getenv("AGENT_TIMEOUT", "60"))
+    # true なら呼び出しごとにセッションを削除し、履歴を残さない
+    AGENT_SESSION_STATELESS: bool = (
+        os.getenv("AGENT_SESSION_STATELESS", "true").lower() == "true"
+    )
+    # stateless でない場合に残すセッションの秒数と最大数
+    AGENT_SESSION_TTL: float = float(os.getenv("AGENT_SESSION_TTL", "600"))
+    AGENT_MAX_SESSIONS: int = int(os.getenv("AGENT_MAX_SESSIONS", "100"))
+    # true なら、最初の応答が直近の応答時間の AGENT_HEDGE_PERCENTILE 分位
+    # (最小 AGENT_HEDGE_MIN_DELAY 秒) を過ぎても届かない場合に 2 本目のリクエストを送る
+    # (先に応答した方を使う)。負けた側もキャンセルまでのトークンは課金されるため、
+    # 最大で呼び出しの AGENT_HEDGE_MAX_RATE 割分のモデル利用料が増える。既定は無効
+    AGENT_HEDGE: bool = os.getenv("AGENT_HEDGE", "false").lower() == "true"
+    # ヘッジの送り先 (空なら AGENT_MODEL・既定のリージョン)
+    AGENT_HEDGE_MODEL: str = os.getenv("AGENT_HEDGE_MODEL", "")
+    AGENT_HEDGE_LOCATION: str = os.getenv("AGENT_HEDGE_LOCATION", "")
+    AGENT_HEDGE_PERCENTILE: float = float(os.getenv("AGENT_HEDGE_PERCENTILE", "0.95"))
+    AGENT_HEDGE_MIN_DELAY: float = float(os.getenv("AGENT_HEDGE_MIN_DELAY", "1"))
+    # 応答時間のサンプルがこの数に満たない間はヘッジしない
+    AGENT_HEDGE_MIN_SAMPLES: int = int(os.getenv("AGENT_HEDGE_MIN_SAMPLES", "20"))
+    # ヘッジする呼び出しの割合の上限
+    AGENT_HEDGE_MAX_RATE: float = float(os.getenv("AGENT_HEDGE_MAX_RATE", "0.1"))
+    # 実行中の呼び出しが AGENT_FALLBACK_IN_FLIGHT 以上の間は、このモデルに送る
+    # (空なら無効)
+    AGENT_FALLBACK_MODEL: str = os.getenv("AGENT_FALLBACK_MODEL", "")
+    AGENT_FALLBACK_IN_FLIGHT: int = int(os.getenv("AGENT_FALLBACK_IN_FLIGHT", "16"))
 
     # CORS設定
-    ALLOWED_ORIGINS: List[str] = ["*"]  # 本番環境では適切に制限する
+    ALLOWED_ORIGINS: list[str] = ["*"]  # 本番環境では適切に制限する
 
     # Cloud Storage設定
     CLOUD_STORAGE_BUCKET: str = os.getenv("CLOUD_STORAGE_BUCKET", "")
+    # クライアントに返す画像 URL の起点
+    # (gs://{bucket}/{path} を {PUBLIC_STORAGE_URL}/{bucket}/{path} にして返す)
+    PUBLIC_STORAGE_URL: str = os.getenv(
+        "PUBLIC_STORAGE_URL", "https://storage.googleapis.com"
+    )
+    # "gcs" または "local" (ローカルディスク/メモリで代替)
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "gcs")
+    LOCAL_STORAGE_DIR: str = os.getenv("LOCAL_STORAGE_DIR", "")
+    STORAGE_MAX_CONCURRENCY: int = int(os.getenv("STORAGE_MAX_CONCURRENCY", "16"))
+
+    # HTTP クライアント設定
+    HTTP_TIMEOUT: float = float(os.getenv("HTTP_TIMEOUT", "10"))
+    HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+    # true なら HTTP/2 を使う (h2 パッケージが必要。既定は HTTP/1.1 の keep-alive)
+    HTTP2: bool = os.getenv("HTTP2", "false").lower() == "true"
+    # 1 ホストあたりの同時リクエスト数
+    HTTP_PER_HOST_LIMIT: int = int(os.getenv("HTTP_PER_HOST_LIMIT", "6"))
+    # 接続エラー・429/5xx の再試行回数と、バックオフの基準・上限秒数
+    HTTP_RETRIES: int = int(os.getenv("HTTP_RETRIES", "2"))
+    HTTP_RETRY_BACKOFF: float = float(os.getenv("HTTP_RETRY_BACKOFF", "0.2"))
+    HTTP_RETRY_BACKOFF_MAX: float = float(os.getenv("HTTP_RETRY_BACKOFF_MAX", "2"))
+    # 取得する画像の最大バイト数
+    MAX_FETCH_BYTES: int = int(os.getenv("MAX_FETCH_BYTES", str(10 * 1024 * 1024)))
 
     # 検索結果設定
     MAX_RESULTS: int = 9
 
+    # 検索結果キャッシュ設定
+    SEARCH_CACHE_MAX_SIZE: int = int(os.getenv("SEARCH_CACHE_MAX_SIZE", "512"))
+    SEARCH_CACHE_TTL: float = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+    # TTL 経過後も古い結果を返しつつ裏で更新する秒数
+    SEARCH_CACHE_STALE_TTL: float = float(os.getenv("SEARCH_CACHE_STALE_TTL", "86400"))
+    # "redis://..." または "memory://" (未指定時はプロセス内のみ)
+    SEARCH_CACHE_BACKEND_URL: str = os.getenv("SEARCH_CACHE_BACKEND_URL", "")
+
+    # 参考画像のスタイル説明のキャッシュ設定
+    # (バックエンドは SEARCH_CACHE_BACKEND_URL を共有)
+    STYLE_CACHE_MAX_SIZE: int = int(os.getenv("STYLE_CACHE_MAX_SIZE", "2048"))
+    STYLE_CACHE_TTL: float = float(os.getenv("STYLE_CACHE_TTL", str(7 * 24 * 3600)))
+
+    # 検索の受付制御
+    # 同時に実行する検索の最大数と、枠が空くのを待てる数・秒数 (超えると 503)
+    SEARCH_MAX_IN_FLIGHT: int = int(os.getenv("SEARCH_MAX_IN_FLIGHT", "32"))
+    SEARCH_QUEUE_SIZE: int = int(os.getenv("SEARCH_QUEUE_SIZE", "64"))
+    SEARCH_QUEUE_TIMEOUT: float = float(os.getenv("SEARCH_QUEUE_TIMEOUT", "2"))
+    # クライアントごとの 1 秒あたりの検索数と連続して受け付ける数
+    # (超えると 429、0 なら制限しない)
+    CLIENT_RATE_LIMIT: float = float(os.getenv("CLIENT_RATE_LIMIT", "1"))
+    CLIENT_RATE_BURST: float = float(os.getenv("CLIENT_RATE_BURST", "10"))
+    # 前段にある信頼できるプロキシの数 (X-Forwarded-For の右から数えてこの位置を
+    # クライアントとみなす。0 ならヘッダーを使わず接続元を使う)
+    TRUSTED_PROXY_HOPS: int = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+    # 非同期の検索ジョブ
+    # 同時に実行するジョブ数・実行待ちにできる数・ジョブを保持する秒数
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_MAX_PENDING: int = int(os.getenv("JOB_MAX_PENDING", "100"))
+    JOB_TTL: float = float(os.getenv("JOB_TTL", "3600"))
+    # ロングポーリングで待つ最大秒数
+    JOB_MAX_WAIT: float = float(os.getenv("JOB_MAX_WAIT", "25"))
+    # "redis://..." または "memory://" (未指定時はプロセス内のみ)
+    JOB_STORE_URL: str = os.getenv("JOB_STORE_URL", "")
+
+    # 検索結果に影響しない書き込み (参考画像のアップロード・スタイル索引) を裏で実行する
+    # 同時に実行する数とキューに入れられる数 (満杯なら書き込みを捨てる)
+    WRITE_BEHIND_WORKERS: int = int(os.getenv("WRITE_BEHIND_WORKERS", "2"))
+    WRITE_BEHIND_MAX_PENDING: int = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "256"))
+
+    # 写真家画像の取得設定
+    MAX_PHOTOGRAPHER_IMAGES: int = 6
+    FETCH_CONCURRENCY: int = int(os.getenv("FETCH_CONCURRENCY", "6"))
+    FETCH_ITEM_TIMEOUT: float = float(os.getenv("FETCH_ITEM_TIMEOUT", "10"))
+    FETCH_TOTAL_TIMEOUT: float = float(os.getenv("FETCH_TOTAL_TIMEOUT", "15"))
+
+    # 写真家インデックス設定
+    # SQLite のファイルパス (未指定時はプロセス内のみ)
+    PHOTOGRAPHER_INDEX_PATH: str = os.getenv("PHOTOGRAPHER_INDEX_PATH", "")
+    # 起動時に読み込む候補ファイル (.json / .csv)
+    PHOTOGRAPHER_INDEX_SEED: str = os.getenv("PHOTOGRAPHER_INDEX_SEED", "")
+    # 候補を有効とみなす日数
+    PHOTOGRAPHER_INDEX_MAX_AGE_DAYS: float = float(
+        os.getenv("PHOTOGRAPHER_INDEX_MAX_AGE_DAYS", "30")
+    )
+    # この件数以上の候補があればモデルを呼ばない
+    # (1 回の回答 (MAX_PHOTOGRAPHER_IMAGES 件) より多くし、複数の回答が揃ってから使う)
+    PHOTOGRAPHER_INDEX_MIN_CANDIDATES: int = int(
+        os.getenv("PHOTOGRAPHER_INDEX_MIN_CANDIDATES", "12")
+    )
+    # 候補が揃っていてもモデルに問い合わせ、インデックスを更新する割合
+    PHOTOGRAPHER_INDEX_EXPLORE_RATE: float = float(
+        os.getenv("PHOTOGRAPHER_INDEX_EXPLORE_RATE", "0.1")
+    )
+
+    # スタイル埋め込みの索引を保存するパス
+    # ({path}.vec / {path}.meta.jsonl、未指定時はメモリ上のみ)
+    STYLE_INDEX_PATH: str = os.getenv("STYLE_INDEX_PATH", "")
+
     # サポート言語
-    SUPPORTED_LANGUAGES: List[str] = ["japanese", "english"]
+    SUPPORTED_LANGUAGES: list[str] = ["japanese", "english"]
 
     # 画像設定
+    # /searchPhotographers/upload で受け付ける参考画像の最大サイズ (デコード後)
+    MAX_REFERENCE_IMAGE_BYTES: int = int(
+        os.getenv("MAX_REFERENCE_IMAGE_BYTES", str(20 * 1024 * 1024))
+    )
     IMAGE_SIZE: str = "400x400"
     IMAGE_FORMAT: str = "crop"
+    IMAGE_QUALITY: int = int(os.getenv("IMAGE_QUALITY", "85"))
+    # 画像の正規化に使うプロセス数 (0 ならスレッドで実行)
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "2"))
+
+    # ログ設定
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # "json" (1 行 1 レコード) または "text"
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    # レスポンス全体などのペイロードを DEBUG で出力するリクエストの割合
+    LOG_PAYLOAD_SAMPLE_RATE: float = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+    # true なら JSON の統計エンドポイント (/resource-stats・/cache-stats など) を
+    # 公開する (認証が無いため既定は無効。同じ値の多くは /metrics でも確認できる)
+    STATS_ENDPOINTS: bool = os.getenv("STATS_ENDPOINTS", "false").lower() == "true"
+
+    # true なら検索の各段階を OpenTelemetry のスパンとして記録する
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "false").lower() == "true"
 
     # 開発・デバッグ設定
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
@@ -0,0 +1,99 @@
+"""
+同時実行数と期限付きの並行処理ヘルパー
+"""
+
+import asyncio
+import logging
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable
+from contextlib import aclosing
+from typing import TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def iter_bounded_stream(
+    items: AsyncIterable[T],
+    fn: Callable[[T], Awaitable[R]],
+    limit: int,
+    item_timeout: float | None = None,
+    total_timeout: float | None = None,
+) -> AsyncIterator[tuple[int, R]]:
+    """items の各要素に fn を並行に適用し、完了したものから (添字, 結果) を返す
+
+    items から要素が届いた時点で fn の適用を始め、完了したものから
+    (届いた順の添字, 結果) を返す。items の読み出しは 1 つのタスクで行う。
+    items が失敗した場合は、それまでに届いた要素の結果を返してからその例外を送出する。
+    失敗・期限切れの要素は返さない。途中で反復をやめた場合、未完了の処理はキャンセルされる。
+
+    Args:
+        items: 処理対象 (非同期イテラブル)
+        fn: 各要素に適用する非同期関数
+        limit: 同時に実行する最大数
+        item_timeout: 1 件あたりの期限 (秒)。セマフォの待ち時間は含まない
+        total_timeout: items を読み終えてからの期限 (秒)。
+            超えた時点で未完了のものはキャンセルする
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+    finished: asyncio.Queue = asyncio.Queue()
+    tasks: list[asyncio.Task] = []
+    source_error: BaseException | None = None
+
+    async def run(index: int, item: T) -> None:
+        try:
+            async with semaphore:
+                result = await asyncio.wait_for(fn(item), timeout=item_timeout)
+        except Exception as e:
+            logger.warning("Item failed: %r", e)
+            finished.put_nowait(None)
+            return
+        finished.put_nowait((index, result))
+
+    async def produce() -> None:
+        nonlocal source_error
+        try:
+            async with aclosing(aiter(items)) as source:
+                async for item in source:
+                    tasks.append(asyncio.create_task(run(len(tasks), item)))
+        except Exception as e:
+            # 届いた要素を処理し終えてから、呼び出し側に送出する
+            source_error = e
+        finally:
+            # 読み終えたことを知らせる
+            finished.put_nowait(producer)
+
+    producer = asyncio.create_task(produce())
+    loop = asyncio.get_running_loop()
+    exhausted = False
+    deadline = None
+    received = 0
+    try:
+        while not exhausted or received < len(tasks):
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                entry = await asyncio.wait_for(finished.get(), remaining)
+            except TimeoutError:
+                break
+            if entry is producer:
+                exhausted = True
+                if total_timeout is not None:
+                    deadline = loop.time() + total_timeout
+                continue
+            received += 1
+            if entry is not None:
+                yield entry
+        if received < len(tasks):
+            logger.warning(
+                "%d/%d items exceeded total timeout", len(tasks) - received, len(tasks)
+            )
+        if source_error is not None:
+            raise source_error
+    finally:
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(producer, *tasks, return_exceptions=True)
@@ -0,0 +1,161 @@
+"""
+外部画像の取得
+
+共有の httpx.AsyncClient (コネクションプール・keep-alive、HTTP2 有効時は HTTP/2) で、
+ホストごとの同時接続数を制限しながら画像をストリーミングで取得する。
+接続エラー・タイムアウトと 429/5xx は、ジッター付きの指数バックオフで再試行する。
+本文はチャンクごとに 1 つのバッファへ書き込み、
+そのままストレージへのアップロードに渡す。
+"""
+
+import asyncio
+import io
+import logging
+import random
+from collections.abc import Callable
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 再試行するステータスコード
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class FetchTooLargeError(Exception):
+    """本文が上限サイズを超えた"""
+
+
+class ImageFetcher:
+    """ホストごとの同時接続数・再試行・サイズ上限付きのダウンローダー"""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        per_host_limit: int = 6,
+        retries: int = 2,
+        backoff: float = 0.2,
+        backoff_max: float = 2.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        chunk_size: int = 64 * 1024,
+        rng: random.Random | None = None,
+        sleep: Callable[[float], object] = asyncio.sleep,
+    ):
+        """
+        Args:
+            client: 共有の httpx.AsyncClient
+            per_host_limit: 1 ホストあたりの同時リクエスト数
+            retries: 再試行の回数 (最初の試行を含まない)
+            backoff: バックオフの基準秒数 (試行ごとに倍にする)
+            backoff_max: 1 回の待ち時間の上限 (Retry-After もこの秒数で打ち切る)
+            max_bytes: 受け付ける本文の最大バイト数
+            chunk_size: ストリーミングで読み出すチャンクのバイト数
+            rng: ジッター用の乱数 (テスト用)
+            sleep: 待機関数 (テスト用)
+        """
+        self.client = client
+        self.per_host_limit = per_host_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._random = rng or random.Random()
+        self._sleep = sleep
+        self._hosts: dict[str, asyncio.Semaphore] = {}
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self.bytes = 0
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).netloc.decode("ascii")
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.per_host_limit)
+        return semaphore
+
+    def _delay(self, attempt: int, response: httpx.Response | None) -> float:
+        """attempt 回目の再試行までの待ち時間 (full jitter、Retry-After を優先)"""
+        if response is not None:
+            retry_after = response.headers.get("retry-after", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        cap = min(self.backoff_max, self.backoff * (2**attempt))
+        return self._random.uniform(0, cap)
+
+    async def _download_once(self, url: str) -> io.BytesIO:
+        async with self.client.stream("GET", url) as response:
+            if response.status_code in RETRY_STATUSES:
+                # 再試行の判断に使うため、本文は読まずに返す
+                raise _RetryableError(response)
+            response.raise_for_status()
+
+            length = response.headers.get("content-length", "")
+            if length.isdigit() and int(length) > self.max_bytes:
+                raise FetchTooLargeError(f"{url}: {length} bytes")
+
+            body = io.BytesIO()
+            async for chunk in response.aiter_bytes(self.chunk_size):
+                if body.tell() + len(chunk) > self.max_bytes:
+                    raise FetchTooLargeError(f"{url}: more than {self.max_bytes} bytes")
+                body.write(chunk)
+            self.bytes += body.tell()
+            body.seek(0)
+            return body
+
+    async def download(self, url: str) -> io.BytesIO:
+        """URL の本文を取得する
+
+        Returns:
+            io.BytesIO: 先頭に位置づけた本文 (getvalue() はコピーせずに bytes を返す)
+
+        Raises:
+            httpx.HTTPStatusError:
+                再試行しないステータス、または再試行しても失敗した場合
+            httpx.TransportError: 再試行しても接続できなかった場合
+            FetchTooLargeError: 本文が max_bytes を超えた場合
+        """
+        async with self._host_slot(url):
+            attempt = 0
+            while True:
+                self.requests += 1
+                try:
+                    return await self._download_once(url)
+                except (_RetryableError, httpx.TransportError) as e:
+                    response = e.response if isinstance(e, _RetryableError) else None
+                    if attempt >= self.retries:
+                        self.failures += 1
+                        if response is not None:
+                            response.raise_for_status()
+                        raise
+                    delay = self._delay(attempt, response)
+                    logger.debug(
+                        "Retrying %s in %.2fs after %r",
+                        url,
+                        delay,
+                        response.status_code if response is not None else e,
+                    )
+                    attempt += 1
+                    self.retried += 1
+                    await self._sleep(delay)
+                except Exception:
+                    self.failures += 1
+                    raise
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "failures": self.failures,
+            "bytes": self.bytes,
+            "hosts": len(self._hosts),
+        }
+
+
+class _RetryableError(Exception):
+    """再試行できるステータスのレスポンス"""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(response.status_code)
+        self.response = response
@@ -0,0 +1,110 @@
+"""
+参考画像の処理
+"""
+
+import base64
+import hashlib
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def decode_data_url(image_data: str) -> bytes:
+    """Base64 (data URL 形式も可) の画像データをデコードする"""
+    if "," in image_data:
+        image_data = image_data.split(",", 1)[1]
+    return base64.b64decode(image_data)
+
+
+# 先頭のバイト列で判別する画像形式
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def image_mime_type(image_bytes: bytes, default: str = "image/jpeg") -> str:
+    """画像データの先頭から MIME タイプを判別する (判別できなければ default)"""
+    for signature, mime_type in _SIGNATURES:
+        if image_bytes.startswith(signature):
+            return mime_type
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return default
+
+
+def perceptual_hash(image_bytes: bytes, hash_size: int = 8) -> str:
+    """画像の知覚ハッシュ (dHash) を 16 進文字列で返す
+
+    再圧縮やリサイズ程度の違いでは同じ値になるため、キャッシュキーに使える。
+    画像としてデコードできない場合はバイト列の SHA-256 を返す。
+    """
+    try:
+        from PIL import Image
+
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # JPEG は縮小デコードして全画素の展開を避ける
+            image.draft("L", (hash_size * 8, hash_size * 8))
+            pixels = list(
+                image.convert("L")
+                .resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+                .getdata()
+            )
+    except Exception as e:
+        logger.warning("Failed to compute perceptual hash: %s", e)
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def parse_image_size(size: str) -> tuple[int, int]:
+    """ "400x400" 形式のサイズ指定を (幅, 高さ) にする"""
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def normalize_image(
+    image_bytes: bytes,
+    size: tuple[int, int] = (400, 400),
+    mode: str = "crop",
+    quality: int = 85,
+) -> bytes:
+    """画像をデコードし、EXIF の向きを反映して指定サイズに縮小した JPEG を返す
+
+    CPU を使う処理なのでプロセスプールから呼び出す想定。
+
+    Args:
+        image_bytes: 元の画像データ
+        size: 出力サイズ (幅, 高さ)
+        mode: "crop" なら中央を切り抜いて size ちょうどにし、
+            それ以外なら縦横比を保って size に収める
+        quality: JPEG の品質
+
+    Returns:
+        bytes: 正規化した JPEG データ
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        # JPEG は出力サイズに近い解像度で縮小デコードする (回転前なので長辺で指定)
+        edge = max(size) * 2
+        image.draft("RGB", (edge, edge))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+        if mode == "crop":
+            image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+        else:
+            image.thumbnail(size, Image.Resampling.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue()
@@ -0,0 +1,105 @@
+"""
+リクエストボディから参考画像をストリーミングで読み込む
+
+JSON の referenceImage は文字列全体・data URL を外したコピー・デコード結果と
+画像の数倍のメモリを使う。ここではボディをチャンク単位で受け取り、
+Base64 の場合も逐次デコードして、デコード後のバイト列 1 つ分だけを保持する。
+"""
+
+import base64
+import binascii
+from collections.abc import AsyncIterator
+
+_DATA_URL_PREFIX = b"data:"
+_MAX_HEADER_LENGTH = 256
+
+
+class ImageTooLargeError(ValueError):
+    """参考画像が上限サイズを超えている"""
+
+
+class Base64StreamDecoder:
+    """チャンク単位で Base64 をデコードする
+
+    先頭の data URL 接頭辞 (data:image/jpeg;base64,) と途中の空白・改行は無視する。
+    チャンクの境界が 4 文字の区切りと一致しなくてもよい。
+    """
+
+    def __init__(self):
+        self._head = b""
+        self._started = False
+        self._pending = b""
+
+    def _strip_header(self, chunk: bytes) -> bytes:
+        self._head += chunk
+        head = self._head.lstrip()
+        if head.startswith(_DATA_URL_PREFIX) or _DATA_URL_PREFIX.startswith(head):
+            if b"," not in head:
+                if len(head) > _MAX_HEADER_LENGTH:
+                    raise ValueError("Invalid data URL header")
+                # 接頭辞の途中なので続きを待つ
+                return b""
+            head = head.split(b",", 1)[1]
+        self._head = b""
+        self._started = True
+        return head
+
+    def feed(self, chunk: bytes) -> bytes:
+        """チャンクを受け取り、デコードできた分のバイト列を返す"""
+        if not self._started:
+            chunk = self._strip_header(chunk)
+            if not self._started:
+                return b""
+
+        data = self._pending + b"".join(chunk.split())
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        return base64.b64decode(data[:usable], validate=True)
+
+    def finish(self) -> bytes:
+        """残りをデコードする (末尾のパディング省略も許容する)"""
+        if not self._started:
+            head, self._head = self._head, b""
+            self._started = True
+            return self.feed(head) + self.finish()
+
+        pending, self._pending = self._pending, b""
+        if not pending:
+            return b""
+        if len(pending) % 4 == 1:
+            raise binascii.Error("Truncated base64 data")
+        return base64.b64decode(pending + b"=" * (-len(pending) % 4), validate=True)
+
+
+async def read_reference_image(
+    stream: AsyncIterator[bytes], base64_encoded: bool, max_bytes: int
+) -> bytearray:
+    """リクエストボディのストリームから参考画像を読み込む
+
+    Args:
+        stream: ボディのチャンク (starlette の Request.stream() など)
+        base64_encoded: True なら Base64 (data URL 可)、False なら画像のバイナリ
+        max_bytes: デコード後の最大バイト数
+
+    Returns:
+        bytearray: デコード済みの画像データ
+
+    Raises:
+        ImageTooLargeError: max_bytes を超えた場合
+        ValueError: Base64 として不正な場合
+    """
+    decoder = Base64StreamDecoder() if base64_encoded else None
+    image = bytearray()
+
+    async for chunk in stream:
+        image += decoder.feed(chunk) if decoder else chunk
+        if len(image) > max_bytes:
+            raise ImageTooLargeError(f"Reference image exceeds {max_bytes} bytes")
+
+    if decoder:
+        image += decoder.finish()
+    if len(image) > max_bytes:
+        raise ImageTooLargeError(f"Reference image exceeds {max_bytes} bytes")
+    if not image:
+        raise ValueError("Reference image is empty")
+    return image
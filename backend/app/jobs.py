@@ -0,0 +1,249 @@
+"""
+非同期の検索ジョブ
+
+検索を受け付けた時点でジョブ ID を返し、プロセス内の固定数のワーカーが検索を実行する。
+クライアントはジョブの状態と結果を (ロングポーリングで) 取得する。
+1 回の HTTP リクエストで数十秒の検索を待たずに済み、
+モバイル回線が切れても結果を失わない。
+ジョブの保存先は差し替えられ (プロセス内・Redis 互換)、ttl 秒を過ぎたジョブは削除する。
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from app.metrics import SEARCH_JOBS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueueFullError(Exception):
+    """実行待ちのジョブが上限に達している"""
+
+
+class InMemoryJobStore:
+    """プロセス内にジョブを保存するストア (テスト・単一インスタンス用)"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._jobs: dict[str, tuple] = {}
+
+    async def put(self, job: dict[str, Any], ttl: float) -> None:
+        self._jobs[job["jobId"]] = (dict(job), self._clock() + ttl)
+
+    async def get(self, job_id: str) -> dict[str, Any] | None:
+        item = self._jobs.get(job_id)
+        if item is None:
+            return None
+        job, expires_at = item
+        if expires_at <= self._clock():
+            del self._jobs[job_id]
+            return None
+        return job
+
+    async def purge(self) -> int:
+        """期限切れのジョブを削除する
+
+        Returns:
+            int: 削除した件数
+        """
+        now = self._clock()
+        expired = [k for k, (_, expires_at) in self._jobs.items() if expires_at <= now]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class RedisJobStore:
+    """Redis 互換バックエンド (get/set(ex=)) にジョブを保存するストア
+
+    複数インスタンスでジョブの状態を共有する場合に使う。期限切れは Redis が削除する。
+    """
+
+    def __init__(self, client, prefix: str = "job"):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}:{job_id}"
+
+    async def put(self, job: dict[str, Any], ttl: float) -> None:
+        await self.client.set(self._key(job["jobId"]), json.dumps(job), ex=ttl)
+
+    async def get(self, job_id: str) -> dict[str, Any] | None:
+        raw = await self.client.get(self._key(job_id))
+        return None if raw is None else json.loads(raw)
+
+    async def purge(self) -> int:
+        return 0
+
+    async def aclose(self) -> None:
+        close = getattr(self.client, "aclose", None)
+        if close is not None:
+            await close()
+
+
+def create_job_store(url: str):
+    """URL からジョブストアを生成する
+
+    未指定なら InMemoryJobStore、"memory://" なら InMemoryRedis を使う RedisJobStore、
+    それ以外は redis パッケージを使う RedisJobStore。
+    """
+    if not url:
+        return InMemoryJobStore()
+
+    from app.cache import create_cache_backend
+
+    return RedisJobStore(create_cache_backend(url))
+
+
+class JobManager:
+    """ジョブの受付・実行・状態の取得を担う"""
+
+    def __init__(
+        self,
+        store,
+        run: Callable[[Any], Awaitable[list[dict[str, Any]]]],
+        workers: int = 4,
+        max_pending: int = 100,
+        ttl: float = 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            store: ジョブストア (put/get/purge/aclose を持つ)
+            run: ジョブの入力から結果 (JSON にできる画像のリスト) を返す非同期関数
+            workers: 同時に実行するジョブの数
+            max_pending: 実行待ちにできるジョブの最大数 (超えると JobQueueFullError)
+            ttl: ジョブを保持する秒数 (受付・更新のたびに延長する)
+            clock: 時刻関数 (テスト用)
+        """
+        self.store = store
+        self.run = run
+        self.workers = workers
+        self.ttl = ttl
+        self._clock = clock
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._tasks: list[asyncio.Task] = []
+        # 完了待ちのジョブ (ロングポーリング用)
+        self._done: dict[str, asyncio.Event] = {}
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def _start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def _update(self, job: dict[str, Any], **fields: Any) -> None:
+        job.update(fields, updatedAt=self._clock())
+        await self.store.put(job, self.ttl)
+
+    async def submit(self, payload: Any) -> dict[str, Any]:
+        """ジョブを受け付ける
+
+        Raises:
+            JobQueueFullError: 実行待ちのジョブが上限に達している場合
+        """
+        self._start()
+        if self._queue.full():
+            SEARCH_JOBS.inc(status="rejected")
+            raise JobQueueFullError(f"{self._queue.qsize()} jobs pending")
+
+        now = self._clock()
+        job = {
+            "jobId": uuid.uuid4().hex,
+            "status": QUEUED,
+            "createdAt": now,
+            "updatedAt": now,
+            "images": None,
+            "error": None,
+        }
+        await self.store.put(job, self.ttl)
+        self._done[job["jobId"]] = asyncio.Event()
+        self._queue.put_nowait((dict(job), payload))
+        self.submitted += 1
+        SEARCH_JOBS.inc(status=QUEUED)
+        return job
+
+    async def _worker(self) -> None:
+        while True:
+            job, payload = await self._queue.get()
+            try:
+                await self._update(job, status=RUNNING)
+                images = await self.run(payload)
+                await self._update(job, status=SUCCEEDED, images=images)
+                self.succeeded += 1
+                SEARCH_JOBS.inc(status=SUCCEEDED)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Job %s failed: %s", job["jobId"], e, exc_info=True)
+                self.failed += 1
+                SEARCH_JOBS.inc(status=FAILED)
+                try:
+                    await self._update(job, status=FAILED, error=str(e))
+                except Exception as store_error:
+                    logger.error("Failed to save job %s: %s", job["jobId"], store_error)
+            finally:
+                done = self._done.pop(job["jobId"], None)
+                if done is not None:
+                    done.set()
+                self._queue.task_done()
+
+    async def _sweeper(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.ttl, 60))
+            try:
+                purged = await self.store.purge()
+                if purged:
+                    logger.debug("Purged %d expired jobs", purged)
+            except Exception as e:
+                logger.warning("Job purge failed: %s", e)
+
+    async def get(self, job_id: str, wait: float = 0) -> dict[str, Any] | None:
+        """ジョブの状態を返す
+
+        Args:
+            job_id: ジョブ ID
+            wait: 完了していなければ最大この秒数だけ完了を待つ (ロングポーリング)
+
+        Returns:
+            dict[str, Any] | None: ジョブ (存在しない・期限切れなら None)
+        """
+        done = self._done.get(job_id)
+        if wait > 0 and done is not None:
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(done.wait(), wait)
+        return await self.store.get(job_id)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "pending": self._queue.qsize(),
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+        }
+
+    async def aclose(self) -> None:
+        """ワーカーを止め、ストアを閉じる (実行中のジョブはキャンセルする)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.store.aclose()
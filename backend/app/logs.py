@@ -0,0 +1,165 @@
+"""
+構造化ログ
+
+ログの出力形式とレベルを Settings の LOG_LEVEL / LOG_FORMAT で一か所から設定する。
+リクエストごとの処理時間は RequestLogMiddleware が 1 件の JSON レコードにまとめ、
+各段階の所要時間は record_stage() (app.metrics.stage() 経由) で同じレコードに追加する。
+レスポンス全体などの大きなペイロードは log_payload() で一部のリクエストだけ出力する。
+"""
+
+import json
+import logging
+import random
+import sys
+import time
+from collections.abc import Callable
+from contextvars import ContextVar
+from typing import Any
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger("app.request")
+
+# 実行中のリクエストのログレコード (リクエスト外では None)
+_current: ContextVar[dict[str, Any] | None] = ContextVar("request_log", default=None)
+
+# LogRecord の標準属性 (extra で渡された項目と区別するため)
+_RESERVED = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """1 行 1 レコードの JSON で出力する
+
+    logger.info("...", extra={...}) で渡した項目はそのままトップレベルに含める。
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(
+    level: str | None = None, fmt: str | None = None, stream=None
+) -> None:
+    """ルートロガーを設定する (何度呼んでも handler は 1 つ)
+
+    Args:
+        level: ログレベル (未指定時は settings.LOG_LEVEL)
+        fmt: "json" または "text" (未指定時は settings.LOG_FORMAT)
+        stream: 出力先 (未指定時は標準エラー出力)
+    """
+    level = (level or settings.LOG_LEVEL).upper()
+    fmt = fmt or settings.LOG_FORMAT
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, "_app_handler", False):
+            root.removeHandler(existing)
+    handler._app_handler = True
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def add_fields(**fields: Any) -> None:
+    """実行中のリクエストのログレコードに項目を追加する"""
+    record = _current.get()
+    if record is not None:
+        record.update(fields)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """段階の所要時間を、リクエストのログレコードに "{name}Ms" として記録する
+
+    計測には app.metrics.stage() を使う。
+    """
+    record = _current.get()
+    if record is not None:
+        stages = record.setdefault("stages", {})
+        stages[f"{name}Ms"] = round(seconds * 1000, 1)
+
+
+def log_payload(
+    log: logging.Logger,
+    message: str,
+    payload: Callable[[], Any],
+    sample_rate: float | None = None,
+) -> None:
+    """大きなペイロードを DEBUG で、一部のリクエストだけ出力する
+
+    payload はサンプリングに当たった場合にだけ呼び出すため、
+    出力しないリクエストではシリアライズのコストがかからない。
+
+    Args:
+        log: 出力先のロガー
+        message: "%s" を 1 つ含むメッセージ
+        payload: 出力する値を返す関数
+        sample_rate: 出力する割合 (未指定時は settings.LOG_PAYLOAD_SAMPLE_RATE)
+    """
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    rate = settings.LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return
+    log.debug(message, payload())
+
+
+class RequestLogMiddleware:
+    """リクエストごとに 1 件、所要時間などをまとめたログを出力する ASGI ミドルウェア
+
+    ストリーミングレスポンスはボディを送り終えた時点までを所要時間とする。
+    """
+
+    def __init__(self, app, exclude_paths=()):
+        self.app = app
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        record: dict[str, Any] = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": 500,
+        }
+        token = _current.set(record)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                record["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            record["durationMs"] = round((time.perf_counter() - started) * 1000, 1)
+            if request_logger.isEnabledFor(logging.INFO):
+                request_logger.info(
+                    "%s %s %s",
+                    record["method"],
+                    record["path"],
+                    record["status"],
+                    extra=record,
+                )
@@ -0,0 +1,334 @@
+"""
+処理時間・件数のメトリクス
+
+検索の各段階の所要時間をヒストグラムに、結果件数・ストレージ呼び出し・
+エージェントのトークン数をカウンターに、実行中・待機中の検索数をゲージに記録し、
+/metrics で Prometheus のテキスト形式 (text/plain; version=0.0.4) として公開する。
+TRACING_ENABLED=true の場合は各段階を OpenTelemetry のスパンとしても記録する。
+"""
+
+import bisect
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager, nullcontext
+
+from app.config import settings
+from app.logs import record_stage
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒単位のバケット (エージェント呼び出しの数十秒まで)
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values, strict=True))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """増減する値 (実行中の件数・待ち行列の長さなど)"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """累積バケットのヒストグラム"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [各バケットの件数..., 合計値]
+        self._values: dict[LabelValues, list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels: str) -> int:
+        counts = self._values.get(self._key(labels))
+        return 0 if counts is None else int(sum(counts[:-1]))
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, n in zip(
+                self.buckets + (float("inf"),), counts[:-1], strict=True
+            ):
+                cumulative += n
+                labels = _format_labels(
+                    self.labelnames + ("le",), key + (_format_value(float(bound)),)
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """メトリクスの登録と Prometheus テキスト形式への変換"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "bth_stage_duration_seconds",
+    "Duration of each photographer search stage.",
+    ("stage",),
+)
+SEARCH_RESULTS = registry.counter(
+    "bth_search_results_total",
+    "Photographer results returned to clients.",
+    ("endpoint",),
+)
+SEARCH_CACHE = registry.counter(
+    "bth_search_cache_requests_total",
+    "Search cache lookups by result.",
+    ("result",),
+)
+STORAGE_SECONDS = registry.histogram(
+    "bth_storage_duration_seconds",
+    "Duration of Cloud Storage calls by operation.",
+    ("operation",),
+)
+STORAGE_CALLS = registry.counter(
+    "bth_storage_calls_total",
+    "Cloud Storage calls by operation and outcome.",
+    ("operation", "outcome"),
+)
+PHOTOGRAPHER_INDEX = registry.counter(
+    "bth_photographer_index_lookups_total",
+    "Photographer index lookups by result (hit skips the model,"
+    " explore asks it despite enough candidates).",
+    ("result",),
+)
+STYLE_CACHE = registry.counter(
+    "bth_style_cache_requests_total",
+    "Reference image style description cache lookups by result.",
+    ("result",),
+)
+SINGLE_FLIGHT = registry.counter(
+    "bth_single_flight_calls_total",
+    "Calls through single-flight groups by role"
+    " (coalesced calls shared an in-flight computation).",
+    ("group", "role"),
+)
+ADMISSION_IN_FLIGHT = registry.gauge(
+    "bth_admission_in_flight",
+    "Searches currently admitted and running.",
+)
+ADMISSION_QUEUED = registry.gauge(
+    "bth_admission_queue_depth",
+    "Searches waiting for an admission slot.",
+)
+ADMISSION_REJECTED = registry.counter(
+    "bth_admission_rejected_total",
+    "Searches rejected before starting work, by reason.",
+    ("reason",),
+)
+SHARED_CLIENTS = registry.counter(
+    "bth_shared_client_uses_total",
+    "Requests that used a shared client, by whether the request created it"
+    " or reused an existing one.",
+    ("client", "result"),
+)
+SEARCH_JOBS = registry.counter(
+    "bth_search_jobs_total",
+    "Asynchronous search jobs by status (queued, rejected, succeeded, failed).",
+    ("status",),
+)
+WRITE_BEHIND = registry.counter(
+    "bth_write_behind_total",
+    "Background writes by name and outcome (ok, error, dropped).",
+    ("name", "outcome"),
+)
+WRITE_BEHIND_PENDING = registry.gauge(
+    "bth_write_behind_pending",
+    "Background writes waiting in the write-behind queue.",
+)
+STARTUP_SECONDS = registry.gauge(
+    "bth_startup_duration_seconds",
+    "Duration of each startup phase of this process.",
+    ("phase",),
+)
+AGENT_CALL_SECONDS = registry.histogram(
+    "bth_agent_call_duration_seconds",
+    "Time to the first response of model calls, by kind and winning route.",
+    ("kind", "route"),
+)
+AGENT_HEDGES = registry.counter(
+    "bth_agent_hedges_total",
+    "Hedged model requests by kind and reason (slow, error).",
+    ("kind", "reason"),
+)
+AGENT_HEDGE_WINS = registry.counter(
+    "bth_agent_hedge_wins_total",
+    "Hedged model requests that answered before the original request.",
+    ("kind",),
+)
+AGENT_FALLBACKS = registry.counter(
+    "bth_agent_fallbacks_total",
+    "Model calls sent to the fallback model because of load.",
+    ("kind",),
+)
+AGENT_TOKENS = registry.counter(
+    "bth_agent_tokens_total",
+    "Model tokens used by agent calls.",
+    ("kind",),
+)
+
+
+def _span(name: str):
+    """TRACING_ENABLED の場合だけ OpenTelemetry のスパンを開始する"""
+    if not settings.TRACING_ENABLED:
+        return nullcontext()
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return nullcontext()
+    return trace.get_tracer("app").start_as_current_span(f"search.{name}")
+
+
+@contextmanager
+def stage(name: str, log: bool = True) -> Iterator[None]:
+    """ブロックの所要時間を記録する
+
+    bth_stage_duration_seconds{stage=name} に記録し、log が True なら
+    リクエストのログレコードにも "{name}Ms" として追加する
+    (1 リクエストで何度も実行される段階は False にする)。
+    TRACING_ENABLED ならスパンも作る。
+    """
+    started = time.perf_counter()
+    with _span(name):
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            STAGE_SECONDS.observe(elapsed, stage=name)
+            if log:
+                record_stage(name, elapsed)
@@ -1,6 +1,6 @@
-from typing import List
+from pydantic import BaseModel, ConfigDict, Field, HttpUrl, field_validator
 
-from pydantic import BaseModel, HttpUrl, ConfigDict, Field
+from app.storage import public_url
 
 
 class SearchRequest(BaseModel):
@@ -19,8 +19,27 @@ class ImageResult(BaseModel):
     image_url: HttpUrl = Field(alias="imageUrl")
     instagram_url: HttpUrl = Field(alias="instagramUrl")
 
+    @field_validator("image_url", mode="before")
+    @classmethod
+    def _public_image_url(cls, value):
+        # Cloud Storage に保存した画像 (gs://) はクライアントが読み込めないため、
+        # https の URL にして返す
+        return public_url(value) if isinstance(value, str) else value
+
 
 class SearchResponse(BaseModel):
     """フォトグラファー検索レスポンスモデル"""
 
-    images: List[ImageResult]
+    images: list[ImageResult]
+
+
+class JobResponse(BaseModel):
+    """非同期の検索ジョブの状態"""
+
+    model_config = ConfigDict(populate_by_name=True)
+    job_id: str = Field(alias="jobId")
+    # queued / running / succeeded / failed
+    status: str
+    # status が succeeded の場合の検索結果
+    images: list[ImageResult] | None = None
+    error: str | None = None
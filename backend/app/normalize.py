@@ -0,0 +1,15 @@
+"""
+検索条件の正規化
+"""
+
+import unicodedata
+
+
+def normalize_destination(destination: str) -> str:
+    """目的地を比較用に正規化する
+
+    全角・半角、大文字・小文字、前後および連続する空白の違いを吸収する。
+    例: "  Ｂａｌｉ " -> "bali"
+    """
+    text = unicodedata.normalize("NFKC", destination).casefold()
+    return " ".join(text.split())
@@ -0,0 +1,234 @@
+"""
+目的地・言語ごとの写真家インデックス
+
+エージェントが見つけた Instagram ユーザー名を SQLite に蓄積し、
+よく検索される目的地ではモデルを呼ばずに候補を返せるようにする。
+目的地は normalize_destination() で正規化し、表記ゆれ ("Bali " / "Balli") は
+既知の目的地との類似度 (difflib) で吸収する。古くなった候補は max_age で除外する。
+候補はモデルの回答に含まれた回数 (hits) の多い順に返す。
+
+メソッドは SQLite を同期的に読み書きするため、イベントループからは
+asyncio.to_thread() で呼ぶ。
+"""
+
+import csv
+import difflib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+
+from app.normalize import normalize_destination
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS photographers (
+    destination TEXT NOT NULL,
+    language TEXT NOT NULL,
+    username TEXT NOT NULL,
+    source TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (destination, language, username)
+);
+CREATE INDEX IF NOT EXISTS photographers_fresh
+    ON photographers (destination, language, updated_at);
+"""
+
+
+class PhotographerIndex:
+    """SQLite に保存する写真家インデックス"""
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        max_age: float = 30 * 24 * 3600,
+        fuzzy_cutoff: float = 0.85,
+        max_aliases: int = 4096,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            path: SQLite のファイルパス (":memory:" ならプロセス内のみ)
+            max_age: 候補を有効とみなす秒数 (最後に追加・確認されてから)
+            fuzzy_cutoff: 目的地の表記ゆれとみなす類似度の下限 (0〜1)
+            max_aliases: 類似検索の結果を覚えておく目的地の数
+            clock: 時刻関数 (テスト用)
+        """
+        self.path = path
+        self.max_age = max_age
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.max_aliases = max_aliases
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # 候補の追加で fsync を待たないようにする
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._load_destinations()
+        self.lookups = 0
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def _load_destinations(self) -> None:
+        # 類似検索に使う既知の目的地 (正規化済み) と、類似検索の結果のキャッシュ
+        self._destinations = {
+            row[0]
+            for row in self._db.execute(
+                "SELECT DISTINCT destination FROM photographers"
+            )
+        }
+        self._aliases: OrderedDict[str, str | None] = OrderedDict()
+
+    def _resolve(self, key: str) -> str | None:
+        """正規化済みの目的地を既知の目的地に対応付ける"""
+        if key in self._destinations:
+            return key
+        if key in self._aliases:
+            self._aliases.move_to_end(key)
+            return self._aliases[key]
+
+        matches = difflib.get_close_matches(
+            key, self._destinations, n=1, cutoff=self.fuzzy_cutoff
+        )
+        self._aliases[key] = matches[0] if matches else None
+        # 目的地は利用者の入力なので、覚えておく数を制限する
+        while len(self._aliases) > self.max_aliases:
+            self._aliases.popitem(last=False)
+        return self._aliases[key]
+
+    def lookup(self, destination: str, language: str, limit: int) -> list[str]:
+        """有効な候補をモデルの回答に含まれた回数の多い順に返す (読み取りのみ)
+
+        Args:
+            destination: 目的地 (正規化前でよい)
+            language: 対応言語
+            limit: 最大件数
+
+        Returns:
+            list[str]: Instagram ユーザー名 (候補が無ければ空)
+        """
+        key = normalize_destination(destination)
+        with self._lock:
+            self.lookups += 1
+            resolved = self._resolve(key)
+            if resolved is None:
+                self.misses += 1
+                return []
+
+            rows = self._db.execute(
+                "SELECT username FROM photographers"
+                " WHERE destination = ? AND language = ? AND updated_at >= ?"
+                " ORDER BY hits DESC, updated_at DESC, username LIMIT ?",
+                (resolved, language, self._clock() - self.max_age, limit),
+            ).fetchall()
+            usernames = [row[0] for row in rows]
+            if not usernames:
+                self.misses += 1
+            elif resolved == key:
+                self.exact_hits += 1
+            else:
+                self.fuzzy_hits += 1
+            return usernames
+
+    def add(
+        self,
+        destination: str,
+        language: str,
+        usernames: Iterable[str],
+        source: str = "agent",
+    ) -> int:
+        """候補を追加する (既存の候補は有効期限を更新する)
+
+        source が "agent" の場合は、モデルの回答に含まれた回数 (hits) にも数える。
+
+        Returns:
+            int: 追加・更新した件数
+        """
+        key = normalize_destination(destination)
+        now = self._clock()
+        hits = 1 if source == "agent" else 0
+        rows = [(key, language, u, source, hits, now) for u in dict.fromkeys(usernames)]
+        if not rows:
+            return 0
+
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO photographers"
+                " (destination, language, username, source, hits, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (destination, language, username) DO UPDATE SET"
+                " updated_at = excluded.updated_at, source = excluded.source,"
+                " hits = hits + excluded.hits",
+                rows,
+            )
+            self._db.commit()
+            if key not in self._destinations:
+                self._destinations.add(key)
+                self._aliases.clear()
+        return len(rows)
+
+    def bulk_load(self, path: str, source: str = "bulk") -> int:
+        """ファイルから候補をまとめて読み込む
+
+        - .json: [{"destination": ..., "language": ..., "usernames": [...]}, ...]
+        - .csv: destination,language,username の見出し付き CSV
+
+        Returns:
+            int: 読み込んだ件数
+        """
+        grouped: dict[tuple, list[str]] = {}
+        if path.endswith(".csv"):
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    key = (row["destination"], row["language"])
+                    grouped.setdefault(key, []).append(row["username"].strip())
+        else:
+            with open(path, encoding="utf-8") as f:
+                for entry in json.load(f):
+                    key = (entry["destination"], entry["language"])
+                    grouped.setdefault(key, []).extend(entry["usernames"])
+
+        loaded = sum(
+            self.add(destination, language, usernames, source=source)
+            for (destination, language), usernames in grouped.items()
+        )
+        logger.info("Loaded %d photographers from %s", loaded, path)
+        return loaded
+
+    def prune(self) -> int:
+        """有効期限を過ぎた候補を削除する
+
+        Returns:
+            int: 削除した件数
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM photographers WHERE updated_at < ?",
+                (self._clock() - self.max_age,),
+            )
+            self._db.commit()
+            self._load_destinations()
+            return cursor.rowcount
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            (size,) = self._db.execute("SELECT COUNT(*) FROM photographers").fetchone()
+        return {
+            "size": size,
+            "destinations": len(self._destinations),
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,221 @@
+"""
+検索処理の段階グラフと書き込みの後回し (write-behind)
+
+検索の各段階を依存関係つきで登録し、依存する段階が終わったものから並行に実行する。
+各段階の所要時間は app.metrics.stage() で記録する。
+結果に影響しない書き込み (参考画像のアップロード、スタイル索引への追加など) は
+WriteBehind のキューに入れ、検索の応答を待たせずに裏で実行する。
+"""
+
+import asyncio
+import contextvars
+import inspect
+import logging
+from collections.abc import Awaitable, Callable, Sequence
+from typing import Any
+
+from app.metrics import WRITE_BEHIND, WRITE_BEHIND_PENDING, stage
+
+logger = logging.getLogger(__name__)
+
+
+class Pipeline:
+    """依存関係のある段階を、依存が揃ったものから並行に実行する"""
+
+    def __init__(self):
+        self._stages: dict[str, tuple[Callable[..., Any], Sequence[str]]] = {}
+
+    def add(self, name: str, fn: Callable[..., Any], *deps: str) -> "Pipeline":
+        """段階を追加する
+
+        Args:
+            name: 段階名 (メトリクスとリクエストのログに "{name}Ms" として記録する)
+            fn: 依存する段階の結果を deps の順に受け取る関数
+                (同期・非同期どちらでもよい)
+            deps: 依存する段階名 (先に追加しておく)
+        """
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"Unknown dependency of {name}: {dep}")
+        self._stages[name] = (fn, deps)
+        return self
+
+    async def _run_stage(self, name: str, tasks: dict[str, "asyncio.Task[Any]"]) -> Any:
+        fn, deps = self._stages[name]
+        args = [await tasks[dep] for dep in deps]
+        with stage(name):
+            result = fn(*args)
+            if inspect.isawaitable(result):
+                result = await result
+        return result
+
+    async def run(self) -> dict[str, Any]:
+        """全ての段階を実行し、段階名ごとの結果を返す
+
+        いずれかの段階が失敗した場合は残りの段階をキャンセルし、その例外を送出する。
+        """
+        tasks: dict[str, asyncio.Task] = {}
+        # 追加順は依存関係の順になっているので、そのままタスクを作れる
+        for name in self._stages:
+            tasks[name] = asyncio.create_task(self._run_stage(name, tasks))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            # 依存先の失敗で終わったタスクの例外を回収する
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return {name: task.result() for name, task in tasks.items()}
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+
+class WriteBehind:
+    """結果に影響しない書き込みを裏で実行するキュー
+
+    キューが満杯の場合は書き込みを捨てる (検索を待たせない)。
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 256):
+        """
+        Args:
+            workers: 同時に実行する書き込みの数
+            max_pending: キューに入れられる書き込みの最大数
+        """
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._tasks: list[asyncio.Task] = []
+        # run_now() で始めた書き込み (完了まで参照を保持する)
+        self._running: set[asyncio.Task] = set()
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _start(self) -> None:
+        if self._tasks:
+            return
+        # リクエストのログレコードを引き継がないよう、空のコンテキストで実行する
+        self._tasks = [
+            asyncio.create_task(self._worker(), context=contextvars.Context())
+            for _ in range(self.workers)
+        ]
+
+    def submit(
+        self, name: str, fn: Callable[[], Awaitable[Any]]
+    ) -> "asyncio.Future | None":
+        """書き込みをキューに入れる
+
+        Args:
+            name: 書き込みの種類 (所要時間を "{name}" 段階として記録する)
+            fn: 書き込みを行う非同期関数
+
+        Returns:
+            asyncio.Future | None: 書き込みの結果 (完了を待つ必要がある場合に使う)。
+                キューが満杯で捨てた場合は None
+        """
+        self._start()
+        done = asyncio.get_running_loop().create_future()
+        # 待たれずに失敗した書き込みで "exception was never retrieved" を出さない
+        done.add_done_callback(_consume_exception)
+        try:
+            self._queue.put_nowait((name, fn, done))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            WRITE_BEHIND.inc(name=name, outcome="dropped")
+            logger.warning("Write-behind queue full, dropping %s", name)
+            done.cancel()
+            return None
+        WRITE_BEHIND_PENDING.inc()
+        return done
+
+    def run_now(self, name: str, fn: Callable[[], Awaitable[Any]]) -> "asyncio.Future":
+        """キューを通さずに書き込みを直ちに始める
+
+        キューが満杯でも捨てられない書き込み用。タスクは完了まで保持し
+        (flush()・aclose() でも待つ)、失敗は submit() と同じく記録する。
+
+        Returns:
+            asyncio.Future: 書き込みの結果
+        """
+        done = asyncio.get_running_loop().create_future()
+        done.add_done_callback(_consume_exception)
+        task = asyncio.create_task(
+            self._run(name, fn, done), context=contextvars.Context()
+        )
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return done
+
+    async def _run(
+        self, name: str, fn: Callable[[], Awaitable[Any]], done: asyncio.Future
+    ) -> None:
+        try:
+            with stage(name, log=False):
+                result = await fn()
+            self.completed += 1
+            WRITE_BEHIND.inc(name=name, outcome="ok")
+            if not done.done():
+                done.set_result(result)
+        except asyncio.CancelledError:
+            done.cancel()
+            raise
+        except Exception as e:
+            if not done.done():
+                done.set_exception(e)
+            self.failed += 1
+            WRITE_BEHIND.inc(name=name, outcome="error")
+            logger.warning("Write-behind %s failed: %s", name, e)
+
+    async def _worker(self) -> None:
+        while True:
+            name, fn, done = await self._queue.get()
+            WRITE_BEHIND_PENDING.dec()
+            try:
+                await self._run(name, fn, done)
+            finally:
+                self._queue.task_done()
+
+    async def flush(self, timeout: float | None = None) -> bool:
+        """キューの書き込みが全て終わるまで待つ
+
+        Returns:
+            bool: 期限内に終わったか
+        """
+
+        async def join() -> None:
+            await self._queue.join()
+            if self._running:
+                await asyncio.wait(set(self._running))
+
+        try:
+            await asyncio.wait_for(join(), timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "pending": self._queue.qsize(),
+            "running": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    async def aclose(self, timeout: float = 5.0) -> None:
+        """残りの書き込みを timeout 秒まで待ってから止める"""
+        if (self._tasks or self._running) and not await self.flush(timeout):
+            logger.warning(
+                "Write-behind closed with %d pending writes",
+                self._queue.qsize() + len(self._running),
+            )
+        tasks = self._tasks + list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
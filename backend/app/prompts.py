@@ -43,18 +43,19 @@ def get_photographer_search_prompt(
     return base_prompt.strip()
 
 
-def get_image_analysis_prompt(image_url: str) -> str:
+def get_image_analysis_prompt(image_url: str | None = None) -> str:
     """画像分析用プロンプトを生成する
 
     Args:
-        image_url: 分析対象の画像URL
+        image_url: 分析対象の画像URL (None なら、メッセージに添付した画像を分析させる)
 
     Returns:
         str: 画像分析用プロンプト
     """
 
+    image = "the attached image" if image_url is None else f"the image at: {image_url}"
     prompt = f"""
-    Please analyze the photography style of the image at: {image_url}
+    Please analyze the photography style of {image}
 
     Look at the following aspects:
     1. Composition and framing
@@ -0,0 +1,534 @@
+"""
+プロセス全体で共有する外部クライアントの管理
+
+Cloud Storage・HTTP・GenAI のクライアントと検索結果・スタイル説明のキャッシュ、
+実行中の検索と受付制御、検索ジョブ、写真家インデックス・スタイル索引を
+初回利用時に 1 度だけ生成し、FastAPI の起動・終了に合わせて準備・解放する。
+各クライアントが何回生成され、何件のリクエストで再利用されたかを記録する。
+"""
+
+import asyncio
+import importlib
+import logging
+import os
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.config import settings
+from app.metrics import SHARED_CLIENTS
+
+logger = logging.getLogger(__name__)
+
+# 処理中のリクエストで使った共有クライアントの名前 (リクエストの外では None)
+_request_clients: ContextVar[set[str] | None] = ContextVar(
+    "request_clients", default=None
+)
+
+
+@contextmanager
+def request_scope() -> Iterator[None]:
+    """この中で使った共有クライアントを、クライアントごとに 1 回だけ数える"""
+    token = _request_clients.set(set())
+    try:
+        yield
+    finally:
+        _request_clients.reset(token)
+
+
+class ResourceUsageMiddleware:
+    """リクエストで使った共有クライアントの生成・再利用を数える ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with request_scope():
+            await self.app(scope, receive, send)
+
+
+_AGENT_MODULE = "app.agent.agent"
+# _import_agent() で読み込みを終えたか
+_agent_imported = False
+
+
+async def _import_agent() -> None:
+    """エージェントのモジュールをスレッドで読み込む
+
+    ADK・GenAI の読み込みは数秒かかり、その間 import のロックも保持される。
+    イベントループ上で import すると、他のリクエストも全て止まる。
+    """
+    global _agent_imported
+    if not _agent_imported:
+        await asyncio.to_thread(importlib.import_module, _AGENT_MODULE)
+        _agent_imported = True
+
+
+def _http2_available() -> bool:
+    if not settings.HTTP2:
+        return False
+    import importlib.util
+
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2 is enabled but h2 is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def _create_http_client():
+    import httpx
+
+    return httpx.AsyncClient(
+        timeout=settings.HTTP_TIMEOUT,
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_CONNECTIONS,
+        ),
+    )
+
+
+def _create_search_cache():
+    from app.cache import TTLCache, create_cache_backend
+
+    return TTLCache(
+        "search",
+        max_size=settings.SEARCH_CACHE_MAX_SIZE,
+        ttl=settings.SEARCH_CACHE_TTL,
+        stale_ttl=settings.SEARCH_CACHE_STALE_TTL,
+        backend=create_cache_backend(settings.SEARCH_CACHE_BACKEND_URL),
+    )
+
+
+def _create_style_cache():
+    from app.cache import TTLCache, create_cache_backend
+
+    return TTLCache(
+        "style",
+        max_size=settings.STYLE_CACHE_MAX_SIZE,
+        ttl=settings.STYLE_CACHE_TTL,
+        backend=create_cache_backend(settings.SEARCH_CACHE_BACKEND_URL),
+    )
+
+
+def _create_search_flights():
+    from app.singleflight import SingleFlight
+
+    return SingleFlight("search")
+
+
+def _create_admission():
+    from app.admission import AdmissionController
+
+    return AdmissionController(
+        max_in_flight=settings.SEARCH_MAX_IN_FLIGHT,
+        max_queue=settings.SEARCH_QUEUE_SIZE,
+        queue_timeout=settings.SEARCH_QUEUE_TIMEOUT,
+        rate=settings.CLIENT_RATE_LIMIT,
+        burst=settings.CLIENT_RATE_BURST,
+    )
+
+
+def _create_write_behind():
+    from app.pipeline import WriteBehind
+
+    return WriteBehind(
+        workers=settings.WRITE_BEHIND_WORKERS,
+        max_pending=settings.WRITE_BEHIND_MAX_PENDING,
+    )
+
+
+def _create_image_pool():
+    """画像の正規化に使うプロセスプール (IMAGE_WORKERS=0 ならスレッドで実行)"""
+    if settings.IMAGE_WORKERS <= 0:
+        return None
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+
+
+def _create_photographer_index():
+    from app.photographer_index import PhotographerIndex
+
+    index = PhotographerIndex(
+        settings.PHOTOGRAPHER_INDEX_PATH or ":memory:",
+        max_age=settings.PHOTOGRAPHER_INDEX_MAX_AGE_DAYS * 24 * 3600,
+    )
+    index.prune()
+    if settings.PHOTOGRAPHER_INDEX_SEED:
+        index.bulk_load(settings.PHOTOGRAPHER_INDEX_SEED)
+    return index
+
+
+def _create_style_index():
+    from app.style_index import StyleIndex
+
+    return StyleIndex(settings.STYLE_INDEX_PATH or None)
+
+
+def _create_genai_client(location: str = ""):
+    from google import genai
+
+    if location:
+        return genai.Client(vertexai=True, location=location)
+    return genai.Client()
+
+
+class Resources:
+    """長寿命クライアントの生成・再利用・解放を担う"""
+
+    def __init__(
+        self,
+        storage_factory: Callable | None = None,
+        http_factory: Callable | None = None,
+        genai_factory: Callable | None = None,
+        search_cache_factory: Callable | None = None,
+        style_cache_factory: Callable | None = None,
+        image_pool_factory: Callable | None = None,
+        admission_factory: Callable | None = None,
+        jobs_factory: Callable | None = None,
+        photographer_index_factory: Callable | None = None,
+        style_index_factory: Callable | None = None,
+    ):
+        from app.storage import create_storage_gateway
+
+        self._factories: dict[str, Callable] = {
+            "storage": storage_factory or create_storage_gateway,
+            "http": http_factory or _create_http_client,
+            "fetcher": self._create_fetcher,
+            "genai": genai_factory or _create_genai_client,
+            "llm": self._create_llm,
+            "search_cache": search_cache_factory or _create_search_cache,
+            "style_cache": style_cache_factory or _create_style_cache,
+            "search_flights": _create_search_flights,
+            "admission": admission_factory or _create_admission,
+            "jobs": jobs_factory or self._create_jobs,
+            "write_behind": _create_write_behind,
+            "reference_store": self._create_reference_store,
+            "image_pool": image_pool_factory or _create_image_pool,
+            "photographer_index": photographer_index_factory
+            or _create_photographer_index,
+            "style_index": style_index_factory or _create_style_index,
+        }
+        self._clients: dict[str, object] = {}
+        # ヘッジ・フォールバックの経路ごとの GenAI クライアントとモデル
+        self._route_clients: dict[str, object] = {}
+        self._agent_warmup: asyncio.Task | None = None
+        self._created: dict[str, int] = dict.fromkeys(self._factories, 0)
+        self._reused: dict[str, int] = dict.fromkeys(self._factories, 0)
+
+    def _get(self, name: str):
+        # 他のファクトリーや同じリクエスト内の 2 回目以降の参照は数えない
+        used = _request_clients.get()
+        first_use = used is not None and name not in used
+        if first_use:
+            used.add(name)
+
+        if name in self._clients:
+            if first_use:
+                self._reused[name] += 1
+                SHARED_CLIENTS.inc(client=name, result="reused")
+            return self._clients[name]
+
+        logger.info("Creating shared client: %s", name)
+        client = self._factories[name]()
+        self._clients[name] = client
+        self._created[name] += 1
+        if first_use:
+            SHARED_CLIENTS.inc(client=name, result="created")
+        return client
+
+    def _create_llm(self):
+        """共有 GenAI クライアントを使う ADK のモデルインスタンスを生成する"""
+        from google.adk.models import Gemini
+
+        llm = Gemini(model=settings.AGENT_MODEL)
+        # Gemini.api_client は cached_property なので、先に共有クライアントを入れておく
+        llm.__dict__["api_client"] = self.genai
+        return llm
+
+    def llm_for(self, model: str, location: str = ""):
+        """model・location に送る ADK のモデルインスタンス (経路ごとに 1 つを再利用する)
+
+        location が空なら共有 GenAI クライアント、それ以外はリージョンごとの
+        クライアントを使う。
+        """
+        key = f"llm:{model}@{location}"
+        llm = self._route_clients.get(key)
+        if llm is not None:
+            return llm
+
+        from google.adk.models import Gemini
+
+        if location:
+            client_key = f"genai@{location}"
+            client = self._route_clients.get(client_key)
+            if client is None:
+                logger.info("Creating GenAI client for %s", location)
+                client = self._route_clients[client_key] = _create_genai_client(
+                    location
+                )
+        else:
+            client = self.genai
+        llm = Gemini(model=model)
+        llm.__dict__["api_client"] = client
+        self._route_clients[key] = llm
+        return llm
+
+    def _create_fetcher(self):
+        """共有 HTTP クライアントで外部画像を取得するダウンローダーを生成する"""
+        from app.fetcher import ImageFetcher
+
+        return ImageFetcher(
+            self.http,
+            per_host_limit=settings.HTTP_PER_HOST_LIMIT,
+            retries=settings.HTTP_RETRIES,
+            backoff=settings.HTTP_RETRY_BACKOFF,
+            backoff_max=settings.HTTP_RETRY_BACKOFF_MAX,
+            max_bytes=settings.MAX_FETCH_BYTES,
+        )
+
+    def _create_jobs(self):
+        """検索ジョブをワーカーで実行する JobManager を生成する"""
+        from app.jobs import JobManager, create_job_store
+
+        async def run(request):
+            from app.services import PhotographerSearchService
+
+            # 同期の検索と同じ実行枠を使い、失敗はジョブの "failed" として残す
+            async with self.admission.slot():
+                results = await PhotographerSearchService(self).search_photographers(
+                    request, raise_errors=True
+                )
+            return [result.model_dump(mode="json", by_alias=True) for result in results]
+
+        return JobManager(
+            create_job_store(settings.JOB_STORE_URL),
+            run,
+            workers=settings.JOB_WORKERS,
+            max_pending=settings.JOB_MAX_PENDING,
+            ttl=settings.JOB_TTL,
+        )
+
+    def _create_reference_store(self):
+        """参考画像を内容のハッシュで保存するストアを生成する"""
+        from app.storage import ContentAddressedStore
+
+        return ContentAddressedStore(self.storage, prefix="reference_images")
+
+    @property
+    def storage(self):
+        """StorageGateway"""
+        return self._get("storage")
+
+    @property
+    def http(self):
+        """httpx.AsyncClient"""
+        return self._get("http")
+
+    @property
+    def fetcher(self):
+        """外部画像用の ImageFetcher"""
+        return self._get("fetcher")
+
+    @property
+    def genai(self):
+        """google.genai.Client"""
+        return self._get("genai")
+
+    @property
+    def llm(self):
+        """共有 GenAI クライアントを持つ google.adk.models.Gemini"""
+        return self._get("llm")
+
+    @property
+    def reference_store(self):
+        """参考画像用の ContentAddressedStore"""
+        return self._get("reference_store")
+
+    @property
+    def search_cache(self):
+        """検索結果の TTLCache"""
+        return self._get("search_cache")
+
+    @property
+    def admission(self):
+        """検索の同時実行数・レートを制限する AdmissionController"""
+        return self._get("admission")
+
+    @property
+    def jobs(self):
+        """非同期の検索ジョブの JobManager"""
+        return self._get("jobs")
+
+    @property
+    def write_behind(self):
+        """結果に影響しない書き込みを裏で実行する WriteBehind"""
+        return self._get("write_behind")
+
+    @property
+    def search_flights(self):
+        """実行中の検索をまとめる SingleFlight"""
+        return self._get("search_flights")
+
+    @property
+    def style_cache(self):
+        """参考画像のスタイル説明の TTLCache"""
+        return self._get("style_cache")
+
+    @property
+    def image_pool(self):
+        """concurrent.futures.ProcessPoolExecutor (無効時は None)"""
+        return self._get("image_pool")
+
+    @property
+    def photographer_index(self):
+        """目的地・言語ごとの PhotographerIndex"""
+        return self._get("photographer_index")
+
+    @property
+    def style_index(self):
+        """写真家の画像のスタイル埋め込みを持つ StyleIndex"""
+        return self._get("style_index")
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """クライアントごとの生成回数と、生成済みのものを使ったリクエストの数"""
+        return {
+            name: {"created": self._created[name], "reused": self._reused[name]}
+            for name in self._factories
+        }
+
+    async def startup(self) -> None:
+        """ホットパスで使うクライアントを事前に生成する
+
+        APP_MODE=production では、エージェント (ADK・GenAI の読み込み) の準備を
+        起動後に裏で行う。キャッシュや写真家インデックスで答えられる検索は
+        準備を待たずに処理でき、モデルを呼ぶ検索は読み込みの完了を待つ。
+        """
+        from app.startup import startup_timer
+
+        with startup_timer.phase("storage"):
+            _ = self.storage
+        with startup_timer.phase("http"):
+            _ = self.http
+
+        # ワーカープロセスの起動を初回リクエストより前に済ませておく
+        with startup_timer.phase("image_pool"):
+            image_pool = self.image_pool
+            if image_pool is not None:
+                for _ in range(settings.IMAGE_WORKERS):
+                    image_pool.submit(os.getpid)
+
+        if settings.APP_MODE == "production":
+            self._agent_warmup = asyncio.create_task(self._warm_agent())
+        else:
+            await self._warm_agent()
+
+    async def _warm_agent(self) -> None:
+        """エージェントのモジュールを読み込み、共有クライアントのモデルを設定する"""
+        from app.startup import startup_timer
+
+        try:
+            with startup_timer.phase("agent"):
+                await _import_agent()
+                from app.agent.agent import bind_llm
+
+                bind_llm(self.llm, self.llm_for)
+            logger.info("Agent ready in %.0f ms", startup_timer.phases["agent"] * 1000)
+        except Exception as e:
+            # 認証情報が無い環境では初回のエージェント呼び出しまで遅延させる
+            logger.warning("GenAI client not initialized at startup: %s", e)
+
+    async def agent_ready(self) -> None:
+        """エージェントを使えるようになるまで待つ
+
+        起動時の準備 (APP_MODE=production では裏で実行中) を待ち、モジュールが
+        まだ読み込まれていなければスレッドで読み込む。
+        """
+        warmup = self._agent_warmup
+        if warmup is not None:
+            # 他のリクエストも待つタスクなので、キャンセルを伝えない
+            await asyncio.shield(warmup)
+        await _import_agent()
+
+    async def aclose(self) -> None:
+        """生成済みのクライアントを解放する"""
+        clients, self._clients = self._clients, {}
+        route_clients, self._route_clients = self._route_clients, {}
+
+        agent_warmup, self._agent_warmup = self._agent_warmup, None
+        if agent_warmup is not None:
+            agent_warmup.cancel()
+            await asyncio.gather(agent_warmup, return_exceptions=True)
+
+        # 実行中のジョブは共有クライアントを使うため、先に止める
+        jobs = clients.get("jobs")
+        if jobs is not None:
+            await jobs.aclose()
+
+        search_flights = clients.get("search_flights")
+        if search_flights is not None:
+            await search_flights.aclose()
+
+        # 残りの書き込みはストレージ・索引を閉じる前に済ませる
+        write_behind = clients.get("write_behind")
+        if write_behind is not None:
+            await write_behind.aclose()
+
+        http = clients.get("http")
+        if http is not None:
+            await http.aclose()
+
+        for name in ("search_cache", "style_cache"):
+            cache = clients.get(name)
+            if cache is not None:
+                await cache.aclose()
+
+        storage = clients.get("storage")
+        if storage is not None:
+            storage.close()
+
+        image_pool = clients.get("image_pool")
+        if image_pool is not None:
+            image_pool.shutdown(wait=False, cancel_futures=True)
+
+        photographer_index = clients.get("photographer_index")
+        if photographer_index is not None:
+            photographer_index.close()
+
+        style_index = clients.get("style_index")
+        if style_index is not None:
+            style_index.close()
+
+        genai_clients = [clients.get("genai")] + [
+            client for key, client in route_clients.items() if key.startswith("genai@")
+        ]
+        for genai in genai_clients:
+            close = getattr(genai, "close", None)
+            if close is not None:
+                close()
+
+        logger.info("Shared clients closed: %s", self.stats())
+
+
+_resources: Resources | None = None
+
+
+def get_resources() -> Resources:
+    """プロセス全体で共有する Resources を返す (FastAPI の依存性としても使う)"""
+    global _resources
+    if _resources is None:
+        _resources = Resources()
+    return _resources
+
+
+async def agent_ready() -> None:
+    """プロセス共通の Resources でエージェントを使えるようになるまで待つ
+
+    リクエストの処理中に app.agent.agent を import する前に呼ぶ。
+    """
+    await get_resources().agent_ready()
@@ -1,169 +1,469 @@
-import base64
-import uuid
-from typing import List
+import asyncio
+import functools
+from collections.abc import AsyncIterator
+from contextlib import aclosing
 import logging
-import requests
-import datetime
 import json
 
-from google.cloud import storage
 from app.models import ImageResult, SearchRequest
 from app.config import settings
-
-# ログ設定を詳細に
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+from app.images import (
+    decode_data_url,
+    normalize_image,
+    parse_image_size,
+    perceptual_hash,
 )
+from app.logs import add_fields, log_payload
+from app.metrics import SEARCH_CACHE, SINGLE_FLIGHT, STYLE_CACHE, stage
+from app.normalize import normalize_destination
+from app.pipeline import Pipeline
+from app.resources import Resources, get_resources
+from app.storage import StorageNotFoundError
+
 logger = logging.getLogger(__name__)
 
 
 class PhotographerSearchService:
     """フォトグラファー検索サービス"""
 
-    def __init__(self):
-        """サービス初期化"""
-        logger.info("PhotographerSearchService initialized")
-        logger.info(f"CLOUD_STORAGE_BUCKET: {settings.CLOUD_STORAGE_BUCKET}")
-        logger.info(f"DEBUG mode: {settings.DEBUG}")
+    def __init__(self, resources: Resources | None = None):
+        """サービス初期化
+
+        Args:
+            resources: 共有クライアント (未指定時はプロセス共通のものを使う)
+        """
+        self.resources = resources or get_resources()
 
-    async def search_photographers(self, request: SearchRequest) -> List[ImageResult]:
+    async def search_photographers(
+        self, request: SearchRequest, raise_errors: bool = False
+    ) -> list[ImageResult]:
         """フォトグラファーを検索する
 
         Args:
             request: 検索リクエスト
+            raise_errors: True なら失敗を空のリストにせず例外として送出する
 
         Returns:
-            List[ImageResult]: 最大9件の検索結果
+            list[ImageResult]: 最大9件の検索結果
+
+        Raises:
+            ValueError: raise_errors が True で、参考画像をデコードできない場合
         """
-        logger.info(
-            f"Starting search_photographers with request: destination={request.destination}, language={request.preferred_language}"
+        try:
+            image_bytes = decode_data_url(request.reference_image)
+        except Exception as e:
+            if raise_errors:
+                raise ValueError(f"Invalid reference image: {e}") from e
+            logger.error("Error decoding reference image: %s", e, exc_info=True)
+            # エラー時は空のリストを返す
+            return []
+
+        return await self.search_with_image(
+            request.destination,
+            request.preferred_language,
+            image_bytes,
+            raise_errors=raise_errors,
         )
-        logger.info(f"Reference image length: {len(request.reference_image)}")
 
+    async def search_with_image(
+        self,
+        destination: str,
+        language: str,
+        image_bytes: bytes,
+        raise_errors: bool = False,
+    ) -> list[ImageResult]:
+        """デコード済みの参考画像でフォトグラファーを検索する
+
+        同じ目的地・言語・参考画像の検索結果はキャッシュから返す。
+        キャッシュに無い同じ検索が同時に届いた場合は 1 回だけ実行し、結果を共有する。
+
+        Args:
+            destination: 撮影地
+            language: 対応言語
+            image_bytes: 参考画像のバイト列
+            raise_errors: True なら失敗を空のリストにせず例外として送出する
+
+        Returns:
+            list[ImageResult]: 最大9件の検索結果
+        """
         try:
-            # 1. 参考画像をCloud Storageにアップロード
-            logger.info("Step 1: Uploading reference image to Cloud Storage")
-            uploaded_image_url = await self._upload_reference_image(
-                request.reference_image
+            image_hash = await self._image_hash(image_bytes)
+        except Exception as e:
+            logger.warning("Search cache key unavailable, skipping cache: %s", e)
+            return await self._search(
+                destination, language, image_bytes, raise_errors=raise_errors
             )
-            logger.info(f"Image uploaded successfully: {uploaded_image_url}")
 
-            # 2. AI Agentを利用した画像分析と検索
-            logger.info("Step 2: Creating search prompt")
-            search_prompt = self._create_search_prompt(
-                request.destination, request.preferred_language, uploaded_image_url
+        cache_key = self._cache_key(destination, language, image_hash)
+        missed = coalesced = False
+
+        async def compute():
+            # 同じ検索を待つ他の呼び出し元にも失敗を伝え、それぞれが扱いを決める
+            results = await self._search(
+                destination, language, image_bytes, image_hash, raise_errors=True
             )
-            logger.info(f"Search prompt created: {search_prompt[:200]}...")
+            return [result.model_dump(mode="json") for result in results]
 
-            # AI Agentに検索を依頼
-            logger.info("Step 3: Calling AI agent")
-            agent_response = await self._prompt_agent(
-                search_prompt, request.destination, request.preferred_language
+        async def load():
+            nonlocal missed, coalesced
+            missed = True
+            value, coalesced = await self.resources.search_flights.do(
+                cache_key, compute
             )
-            logger.info(
-                f"Agent response received: {agent_response[:200] if agent_response else 'None'}..."
+            SINGLE_FLIGHT.inc(
+                group="search", role="coalesced" if coalesced else "leader"
             )
+            return value
+
+        try:
+            with stage("search"):
+                cached = await self.resources.search_cache.get_or_compute(
+                    cache_key,
+                    load,
+                    should_cache=bool,
+                    admission=self.resources.admission,
+                )
+        except Exception as e:
+            if raise_errors:
+                raise
+            logger.error("Error in search_photographers: %s", e, exc_info=True)
+            return []
+        SEARCH_CACHE.inc(result="miss" if missed else "hit")
+        add_fields(cacheHit=not missed, coalesced=coalesced, results=len(cached))
+        return [ImageResult.model_validate(item) for item in cached]
+
+    async def stream_search(
+        self, destination: str, language: str, image_bytes: bytes
+    ) -> AsyncIterator[ImageResult]:
+        """検索結果を 1 件ずつ、画像と Instagram URL が揃ったものから返す
 
-            # 3. 結果をパースして返す
-            logger.info("Step 4: Parsing agent response")
-            results = self._parse_agent_response(
-                agent_response, request.destination, request.preferred_language
+        キャッシュにあればその内容を返し、同じ検索が実行中ならその結果を待って返す。
+        どちらでも無ければ検索しながら返して、最後にまとめてキャッシュへ保存する。
+
+        Args:
+            destination: 撮影地
+            language: 対応言語
+            image_bytes: 参考画像のバイト列
+
+        Yields:
+            ImageResult: 検索結果 (最大9件)
+        """
+        cache = self.resources.search_cache
+        try:
+            image_hash = await self._image_hash(image_bytes)
+            cache_key = self._cache_key(destination, language, image_hash)
+        except Exception as e:
+            logger.warning("Search cache key unavailable, skipping cache: %s", e)
+            image_hash = cache_key = None
+
+        if cache_key is not None:
+            cached = await cache.get(cache_key)
+            SEARCH_CACHE.inc(result="miss" if cached is None else "hit")
+            add_fields(cacheHit=cached is not None)
+            if cached is None:
+                joined = await self.resources.search_flights.join(cache_key)
+                if joined is not None:
+                    SINGLE_FLIGHT.inc(group="search", role="coalesced")
+                    add_fields(coalesced=True)
+                    cached = joined[0]
+            if cached is not None:
+                for item in cached:
+                    yield ImageResult.model_validate(item)
+                return
+
+        prepared = await self._prepare_pipeline(
+            destination, language, image_bytes
+        ).run()
+
+        from app.utils import iter_photographer_images
+
+        results = []
+        async with aclosing(
+            iter_photographer_images(
+                prepared["prompt"],
+                destination,
+                language,
+                resources=self.resources,
+                timeout=settings.AGENT_TIMEOUT,
+                style_vector=prepared["style"],
+                describe_style=self._style_describer(prepared["normalize"], image_hash),
             )
-            logger.info(f"Parsed {len(results)} results")
+        ) as items:
+            async for item in items:
+                if "imageUrl" not in item or "instagramUrl" not in item:
+                    continue
+                instagram_url = await self._get_instagram_url_from_storage(
+                    item["instagramUrl"]
+                )
+                result = ImageResult(
+                    image_url=item["imageUrl"], instagram_url=instagram_url
+                )
+                results.append(result)
+                yield result
+                if len(results) >= settings.MAX_RESULTS:
+                    break
+
+        if cache_key is not None and results:
+            await cache.set(
+                cache_key, [result.model_dump(mode="json") for result in results]
+            )
+
+    async def _image_hash(self, image_bytes: bytes) -> str:
+        """参考画像の知覚ハッシュ (再エンコードされた同じ写真は同じ値になる)"""
+        with stage("hash"):
+            return await asyncio.to_thread(perceptual_hash, image_bytes)
+
+    def _cache_key(self, destination: str, language: str, image_hash: str) -> str:
+        """正規化した目的地・言語・参考画像の知覚ハッシュから検索キーを作る"""
+        return "|".join([normalize_destination(destination), language, image_hash])
+
+    async def _search(
+        self,
+        destination: str,
+        language: str,
+        image_bytes: bytes,
+        image_hash: str | None = None,
+        raise_errors: bool = False,
+    ) -> list[ImageResult]:
+        """キャッシュを介さずに検索する
+
+        image_hash (参考画像の知覚ハッシュ) があれば、スタイル説明をキャッシュから使う。
+        失敗した場合は空のリストを返す (raise_errors が True なら例外を送出する)。
+        """
+        logger.debug(
+            "Starting search: destination=%s, language=%s", destination, language
+        )
+
+        try:
+            pipeline = self._prepare_pipeline(destination, language, image_bytes)
+            # AI Agentに検索を依頼し、結果をパースする
+            pipeline.add(
+                "agent",
+                lambda prompt, style_vector, normalized: self._prompt_agent(
+                    prompt,
+                    destination,
+                    language,
+                    style_vector,
+                    self._style_describer(normalized, image_hash),
+                ),
+                "prompt",
+                "style",
+                "normalize",
+            )
+            pipeline.add(
+                "parse",
+                lambda response: self._parse_agent_response(
+                    response, destination, language
+                ),
+                "agent",
+            )
+            results = (await pipeline.run())["parse"]
 
             # 最大9件に制限
-            final_results = results[: settings.MAX_RESULTS]
-            logger.info(f"Returning {len(final_results)} final results")
-            return final_results
+            return results[: settings.MAX_RESULTS]
 
         except Exception as e:
-            logger.error(f"Error in search_photographers: {e}", exc_info=True)
+            if raise_errors:
+                raise
+            logger.error("Error in search_photographers: %s", e, exc_info=True)
             # エラー時は空のリストを返す
             return []
 
-    async def _upload_reference_image(self, image_data: str) -> str:
+    def _prepare_pipeline(
+        self, destination: str, language: str, image_bytes: bytes
+    ) -> Pipeline:
+        """エージェントを呼ぶまでの段階 (正規化・参考画像・スタイル埋め込み・プロンプト)
+
+        参考画像の URL は内容のハッシュから決まるため、アップロードは書き込みキューに
+        入れて待たない。プロンプトの作成・エージェントの呼び出しはアップロードと並行に進み、
+        スタイル埋め込みの計算も参考画像の準備と並行に行う。
+
+        段階の結果:
+            normalize: 正規化した参考画像
+            reference: 参考画像の URL
+            style: スタイル埋め込み (失敗した場合は None)
+            prompt: 検索プロンプト
+        """
+        return (
+            Pipeline()
+            .add("normalize", lambda: self._normalize_reference_image(image_bytes))
+            .add("reference", self._reference_image, "normalize")
+            .add("style", self._style_embedding, "normalize")
+            .add(
+                "prompt",
+                lambda reference: self._create_search_prompt(
+                    destination, language, reference
+                ),
+                "reference",
+            )
+        )
+
+    async def _normalize_reference_image(self, image_bytes: bytes) -> bytes:
+        """参考画像を設定サイズの JPEG に正規化する
+
+        デコード・縮小は CPU を使うため、プロセスプールで実行する。
+        画像として扱えない場合は元のデータをそのまま返す。
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            normalized = await loop.run_in_executor(
+                self.resources.image_pool,
+                functools.partial(
+                    normalize_image,
+                    image_bytes,
+                    size=parse_image_size(settings.IMAGE_SIZE),
+                    mode=settings.IMAGE_FORMAT,
+                    quality=settings.IMAGE_QUALITY,
+                ),
+            )
+        except Exception as e:
+            logger.warning("Image normalization failed, using original: %s", e)
+            return image_bytes
+
+        logger.debug(
+            "Image normalized: %d -> %d bytes", len(image_bytes), len(normalized)
+        )
+        return normalized
+
+    async def _style_embedding(self, image_bytes: bytes):
+        """参考画像のスタイル埋め込みを計算する (失敗した場合は None)"""
+        from app.style_index import style_embedding
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self.resources.image_pool, style_embedding, image_bytes
+            )
+        except Exception as e:
+            logger.warning("Style embedding failed, skipping style ranking: %s", e)
+            return None
+
+    def _style_describer(self, image_bytes: bytes, image_hash: str | None):
+        """参考画像のスタイル説明を返す関数を作る
+
+        説明はモデルを呼ぶ場合にだけ必要なので、写真家インデックスで候補が
+        揃ったときは呼ばれない。画像の分析 (モデル呼び出し 1 回分) で検索を
+        待たせないよう、style_cache にある説明だけを使う。無ければ空文字を返し
+        (検索プロンプトで代用する)、分析を書き込みキューに入れて、同じ画像
+        (知覚ハッシュ) の次の検索 (目的地や言語を変えた再検索など) から使う。
+        """
+        from app.utils import describe_image_style
+
+        cache = self.resources.style_cache
+
+        async def analyze() -> str:
+            return await describe_image_style(
+                image_bytes, timeout=settings.AGENT_TIMEOUT
+            )
+
+        async def describe() -> str:
+            if image_hash is None:
+                return ""
+            # 画像を添付する前の説明 (画像を見ずに作られたもの) とはキーを分ける
+            key = f"{settings.AGENT_MODEL}|image|{image_hash}"
+            try:
+                description = await cache.get(key)
+            except Exception as e:
+                STYLE_CACHE.inc(result="error")
+                logger.warning("Style cache unavailable, using search prompt: %s", e)
+                return ""
+
+            STYLE_CACHE.inc(result="miss" if description is None else "hit")
+            add_fields(styleCacheHit=description is not None)
+            if description is None:
+                self.resources.write_behind.submit(
+                    "analyze",
+                    lambda: cache.get_or_compute(
+                        key,
+                        analyze,
+                        should_cache=bool,
+                        admission=self.resources.admission,
+                    ),
+                )
+            return description or ""
+
+        return describe
+
+    async def _reference_image(self, image_bytes: bytes) -> str:
+        """参考画像の URL を求め、アップロードを書き込みキューに入れる
+
+        Returns:
+            str: 参考画像の URL (アップロードの完了は待たない)
+        """
+        url = self.resources.reference_store.url_for(image_bytes)
+        write_behind = self.resources.write_behind
+
+        def upload():
+            return self._upload_reference_image(image_bytes)
+
+        if write_behind.submit("upload", upload) is None:
+            # キューが満杯でも捨てず (URL の画像が無くなる)、すぐにアップロードを始める
+            write_behind.run_now("upload", upload)
+        return url
+
+    async def _upload_reference_image(self, image_bytes: bytes) -> str:
         """参考画像をCloud Storageにアップロードする
 
         Args:
-            image_data: Base64エンコードされた画像データ
+            image_bytes: デコード済みの画像データ
 
         Returns:
             str: アップロード後の画像URL
         """
-        logger.info("Starting image upload process")
         try:
-            # Base64データから画像をデコード
-            if "," in image_data:
-                image_data = image_data.split(",")[1]
-                logger.info("Removed data URL prefix from image data")
-
-            logger.info(f"Decoding base64 image data, length: {len(image_data)}")
-            image_bytes = base64.b64decode(image_data)
-            logger.info(f"Image decoded successfully, size: {len(image_bytes)} bytes")
-
-            # ユニークなファイル名を生成
-            file_name = f"reference_images/{uuid.uuid4()}.jpg"
-            logger.info(f"Generated file name: {file_name}")
-
-            # Cloud Storageクライアントを初期化
-            logger.info("Initializing Cloud Storage client")
-            client = storage.Client()
-            bucket = client.bucket(settings.CLOUD_STORAGE_BUCKET)
-            logger.info(f"Using bucket: {settings.CLOUD_STORAGE_BUCKET}")
-
-            blob = bucket.blob(file_name)
-            logger.info(f"Created blob: {file_name}")
-
-            # 画像をアップロード
-            logger.info("Uploading image to Cloud Storage")
-            blob.upload_from_string(image_bytes, content_type="image/jpeg")
-            logger.info("Image uploaded successfully")
-
-            # 公開URLを返す
-            result_url = f"gs://{settings.CLOUD_STORAGE_BUCKET}/{file_name}"
-            logger.info(f"Returning image URL: {result_url}")
+            # 内容のハッシュをファイル名にし、同じ画像の再アップロードを省く
+            result_url = await self.resources.reference_store.put(
+                image_bytes, content_type="image/jpeg"
+            )
+            logger.debug("Reference image uploaded: %s", result_url)
             return result_url
 
         except Exception as e:
-            logger.error(f"Error uploading image: {e}", exc_info=True)
+            logger.error("Error uploading image: %s", e, exc_info=True)
             raise Exception(f"Failed to upload image: {e}")
 
-    async def _prompt_agent(self, prompt: str, destination: str, language: str) -> str:
+    async def _prompt_agent(
+        self,
+        prompt: str,
+        destination: str,
+        language: str,
+        style_vector=None,
+        describe_style=None,
+    ) -> str:
         """AI Agentにプロンプトを送信して結果を取得する
 
         Args:
             prompt: プロンプト
+            style_vector: 参考画像のスタイル埋め込み (候補の並べ替えに使う)
+            describe_style: 参考画像のスタイル説明を返す非同期関数
 
         Returns:
             str: 結果
         """
-        logger.info("Starting agent prompt")
-        logger.info(f"Prompt: {prompt[:200]}...")
-
         try:
             # エージェントラッパーを使用
             from app.utils import run_agent
 
-            logger.info("Calling run_agent function")
-            response = await run_agent(prompt, destination, language)
-            logger.info(
-                f"Agent response received: {response[:200] if response else 'None'}..."
+            response = await run_agent(
+                prompt,
+                destination,
+                language,
+                resources=self.resources,
+                timeout=settings.AGENT_TIMEOUT,
+                style_vector=style_vector,
+                describe_style=describe_style,
             )
-
+            log_payload(logger, "Agent response: %s", lambda: response)
             return response
 
         except Exception as e:
-            logger.error(f"Error calling agent: {e}", exc_info=True)
+            logger.error("Error calling agent: %s", e, exc_info=True)
             raise Exception(f"Failed to call agent: {e}")
 
     def _create_search_prompt(
         self, destination: str, language: str, image_url: str
     ) -> str:
         """検索用のプロンプトを作成する"""
-        logger.info(
-            f"Creating search prompt for destination: {destination}, language: {language}"
-        )
-
         prompt = f"""
         Please help me find photographers in {destination} who can communicate in {language}.
         I have uploaded a reference image at {image_url} that shows the style I'm looking for.
@@ -177,18 +477,12 @@ class PhotographerSearchService:
         Format the response as a JSON array of objects with 'imageUrl' and 'instagramUrl' fields.
         """
 
-        logger.info(f"Created prompt: {prompt[:200]}...")
         return prompt
 
-    def _parse_agent_response(
+    async def _parse_agent_response(
         self, response: str, destination: str = "", language: str = ""
-    ) -> List[ImageResult]:
+    ) -> list[ImageResult]:
         """エージェントのレスポンスをパースする"""
-        logger.info("Starting to parse agent response")
-        logger.info(f"Response type: {type(response)}")
-        logger.info(f"Response length: {len(response) if response else 0}")
-        logger.info(f"Response content: {repr(response)}")
-
         try:
             import json
 
@@ -197,105 +491,90 @@ class PhotographerSearchService:
                 return []
 
             # JSONパースを試行
-            logger.info("Attempting to parse JSON response")
             data = json.loads(response)
-            logger.info(f"JSON parsed successfully: {type(data)}")
-            logger.info(f"Parsed data: {data}")
 
             results = []
             # フロントエンド期待形式に対応
             images = data.get("images", data if isinstance(data, list) else [])
-            logger.info(f"Found {len(images)} images in response")
 
+            valid_items = []
             for i, item in enumerate(images):
-                logger.info(f"Processing image {i + 1}: {item}")
                 if "imageUrl" in item and "instagramUrl" in item:
-                    # Cloud StorageのInstagram URLファイルから実際のURLを取得
-                    actual_instagram_url = self._get_instagram_url_from_storage(
-                        item["instagramUrl"]
-                    )
-                    logger.info(f"Instagram URL resolved: {actual_instagram_url}")
-
-                    results.append(
-                        ImageResult(
-                            image_url=item["imageUrl"],
-                            instagram_url=actual_instagram_url,
-                        )
-                    )
-                    logger.info(f"Added result {i + 1}: {item['imageUrl']}")
+                    valid_items.append(item)
                 else:
-                    logger.warning(f"Image {i + 1} missing required fields: {item}")
+                    logger.warning("Image %d missing required fields: %s", i + 1, item)
 
-            logger.info(f"Successfully parsed {len(results)} results")
-
-            # 詳細な結果をログに出力
-            logger.info(f"=== PHOTOGRAPHER SEARCH RESULTS ===")
-            logger.info(
-                f"Search request: destination='{destination}', language='{language}'"
+            # Cloud StorageのInstagram URLファイルから実際のURLをまとめて取得
+            instagram_urls = await self._resolve_instagram_urls(
+                [item["instagramUrl"] for item in valid_items]
             )
-            logger.info(f"Total results found: {len(results)}")
-            for i, result in enumerate(results):
-                logger.info(f"Result {i + 1}:")
-                logger.info(f"  - Image URL: {result.image_url}")
-                logger.info(f"  - Instagram URL: {result.instagram_url}")
-            logger.info(f"=== END SEARCH RESULTS ===")
 
+            for item, instagram_url in zip(valid_items, instagram_urls, strict=True):
+                results.append(
+                    ImageResult(
+                        image_url=item["imageUrl"],
+                        instagram_url=instagram_url,
+                    )
+                )
+
+            logger.debug(
+                "Parsed %d results: destination=%s, language=%s",
+                len(results),
+                destination,
+                language,
+            )
             return results
 
         except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-            logger.error(f"Response content: {repr(response)}")
+            logger.error("JSON decode error: %s", e)
+            log_payload(logger, "Response content: %r", lambda: response, 1.0)
             return []
         except Exception as e:
-            logger.error(f"Error parsing agent response: {e}", exc_info=True)
-            logger.error(f"Response content: {repr(response)}")
+            logger.error("Error parsing agent response: %s", e, exc_info=True)
+            log_payload(logger, "Response content: %r", lambda: response, 1.0)
             return []
 
-    def _get_instagram_url_from_storage(self, storage_path: str) -> str:
-        """Cloud Storageからの実際のInstagram URLを取得"""
-        logger.info(f"Getting Instagram URL from storage path: {storage_path}")
+    async def _resolve_instagram_urls(self, storage_paths: list[str]) -> list[str]:
+        """Instagram URL の参照 (gs://.../instagram_urls/*.json) を並行に解決する
+
+        Args:
+            storage_paths: エージェントが返した instagramUrl のリスト
 
+        Returns:
+            list[str]: storage_paths と同じ順序の Instagram URL
+        """
+        return list(
+            await asyncio.gather(
+                *(self._get_instagram_url_from_storage(p) for p in storage_paths)
+            )
+        )
+
+    async def _get_instagram_url_from_storage(self, storage_path: str) -> str:
+        """Cloud Storageからの実際のInstagram URLを取得"""
         try:
             if not storage_path.startswith("gs://"):
-                logger.info(f"Not a storage path, returning as-is: {storage_path}")
                 return storage_path  # 既に実際のURLの場合はそのまま返す
 
             # gs://bth-dev-storage/instagram_urls/photographer1.json -> instagram_urls/photographer1.json
-            file_path = storage_path.replace(
-                f"gs://{settings.CLOUD_STORAGE_BUCKET}/", ""
-            )
-            logger.info(f"Extracted file path: {file_path}")
-
-            client = storage.Client()
-            bucket = client.bucket(settings.CLOUD_STORAGE_BUCKET)
-            blob = bucket.blob(file_path)
-
-            if blob.exists():
-                logger.info(f"Storage file exists: {file_path}")
-                import json
-
-                data = json.loads(blob.download_as_text())
-                instagram_url = data.get("instagram_url", storage_path)
-                logger.info(f"Retrieved Instagram URL: {instagram_url}")
-                return instagram_url
-            else:
-                logger.warning(f"Storage file does not exist: {file_path}")
+            gateway = self.resources.storage
+            file_path = gateway.path_from_url(storage_path)
+
+            # 存在確認はせずに取得し、無ければフォールバックする (往復 1 回)
+            try:
+                data = json.loads(await gateway.download_text(file_path))
+                return data.get("instagram_url", storage_path)
+            except StorageNotFoundError:
+                logger.debug("Storage file does not exist: %s", file_path)
                 # ファイルが存在しない場合はパスからInstagram URLを生成
                 username = file_path.split("/")[-1].replace(".json", "")
-                instagram_url = f"https://instagram.com/{username}"
-                logger.info(f"Generated Instagram URL: {instagram_url}")
-                return instagram_url
+                return f"https://instagram.com/{username}"
 
         except Exception as e:
             logger.error(
-                f"Error getting Instagram URL from storage: {e}", exc_info=True
+                "Error getting Instagram URL from storage: %s", e, exc_info=True
             )
             # エラー時はパスからURLを推測
             if "photographer" in storage_path:
                 username = storage_path.split("/")[-1].replace(".json", "")
-                instagram_url = f"https://instagram.com/{username}"
-                logger.info(f"Fallback Instagram URL: {instagram_url}")
-                return instagram_url
-            fallback_url = "https://instagram.com/photographer"
-            logger.info(f"Using default Instagram URL: {fallback_url}")
-            return fallback_url
+                return f"https://instagram.com/{username}"
+            return "https://instagram.com/photographer"
@@ -0,0 +1,97 @@
+"""
+同じキーの同時実行をまとめる (single-flight)
+
+同じ検索が同時に複数届いた場合 (アプリの二重送信、クライアントのタイムアウト後の再試行、
+同じ目的地を一緒に探すパートナーなど)、最初の呼び出しだけが処理を実行し、
+後から来た呼び出しは実行中の処理の結果を共有する。
+処理は呼び出し元とは別のタスクで実行するため、待っている側がキャンセルされても
+共有の処理は止まらない。
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """キーごとに実行中の処理を 1 つに保つ"""
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: グループ名 (ログ・メトリクス用)
+        """
+        self.name = name
+        self._tasks: dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _start(self, key: str, fn: Callable[[], Awaitable[T]]) -> asyncio.Task:
+        task = asyncio.create_task(fn())
+        self._tasks[key] = task
+        self.leaders += 1
+
+        def done(task: asyncio.Task) -> None:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+            # 待っている呼び出しが全てキャンセルされた場合も例外を回収する
+            if not task.cancelled() and task.exception() is not None:
+                logger.debug(
+                    "Single-flight %s for %s failed: %r",
+                    self.name,
+                    key,
+                    task.exception(),
+                )
+
+        task.add_done_callback(done)
+        return task
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """key の処理が実行中なら結果を待ち、無ければ fn() を実行する
+
+        Args:
+            key: 同じ処理とみなすキー
+            fn: 実行する非同期関数 (呼び出し元のコンテキストを引き継ぐ)
+
+        Returns:
+            tuple[T, bool]: (結果, 実行中の処理に相乗りしたか)
+        """
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = self._start(key, fn)
+        # 呼び出し元のキャンセルを共有の処理に伝えない
+        return await asyncio.shield(task), shared
+
+    async def join(self, key: str) -> tuple[T] | None:
+        """key の処理が実行中なら結果を待って (結果,) を返し、無ければ None を返す
+
+        自分では処理を始めない呼び出し (ストリーミングなど) 用。
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            return None
+        self.coalesced += 1
+        return (await asyncio.shield(task),)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+    async def aclose(self) -> None:
+        """実行中の処理をキャンセルする"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
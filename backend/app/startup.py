@@ -0,0 +1,59 @@
+"""
+起動時間の内訳
+
+モジュールの読み込み・アプリの生成・共有クライアントの準備など、起動の各段階の
+所要時間を記録する。コールドスタートが遅くなった変更を見つけられるよう、
+内訳は bth_startup_duration_seconds{phase} と起動完了時の 1 件のログ、
+GET /startup-stats で確認できる。
+"""
+
+import logging
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from app.metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """起動の段階ごとの所要時間"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def record(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = seconds
+        STARTUP_SECONDS.set(seconds, phase=phase)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """ブロックの所要時間を name の段階として記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def finish(self) -> None:
+        """この時点までの合計を記録し、内訳をログに出力する"""
+        self.record("total", time.perf_counter() - self.started)
+        logger.info(
+            "Startup finished in %.0f ms: %s",
+            self.phases["total"] * 1000,
+            ", ".join(
+                f"{phase}={seconds * 1000:.0f}ms"
+                for phase, seconds in self.phases.items()
+                if phase != "total"
+            ),
+        )
+
+    def stats(self) -> dict[str, float]:
+        """段階ごとのミリ秒"""
+        return {phase: round(s * 1000, 1) for phase, s in self.phases.items()}
+
+
+# app.app が最初に読み込むため、started はアプリのモジュール読み込み開始時点になる
+startup_timer = StartupTimer()
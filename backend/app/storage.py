@@ -0,0 +1,359 @@
+"""
+Cloud Storage 入出力ゲートウェイ
+
+ブロッキングな google.cloud.storage の呼び出しをスレッドプールで実行し、
+イベントループを止めずにアップロード・ダウンロードを行う。
+クライアントと HTTP コネクションプールはプロセス全体で 1 つを再利用する。
+"""
+
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO
+
+from app.config import settings
+from app.metrics import STORAGE_CALLS, STORAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def public_url(url: str) -> str:
+    """gs:// URL をクライアントが読み込める https の URL にする
+
+    gs://{bucket}/{path} は PUBLIC_STORAGE_URL/{bucket}/{path} になる。
+    それ以外の URL はそのまま返す。
+    """
+    if not url.startswith("gs://"):
+        return url
+    return f"{settings.PUBLIC_STORAGE_URL.rstrip('/')}/{url[len('gs://') :]}"
+
+
+class StorageNotFoundError(Exception):
+    """指定したオブジェクトが存在しない"""
+
+
+class GCSBackend:
+    """google.cloud.storage を使う同期バックエンド"""
+
+    def __init__(self, bucket_name: str, pool_size: int = 16, client=None):
+        self.bucket_name = bucket_name
+        self._pool_size = pool_size
+        self._client = client
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def _get_bucket(self):
+        """クライアントとバケットを初回アクセス時に 1 度だけ生成する"""
+        if self._bucket is not None:
+            return self._bucket
+
+        with self._lock:
+            if self._bucket is None:
+                if self._client is None:
+                    from google.cloud import storage
+                    from requests.adapters import HTTPAdapter
+
+                    logger.info("Initializing Cloud Storage client")
+                    client = storage.Client()
+                    # 同時実行数に合わせてコネクションプールを広げる
+                    adapter = HTTPAdapter(
+                        pool_connections=self._pool_size,
+                        pool_maxsize=self._pool_size,
+                    )
+                    client._http.mount("https://", adapter)
+                    self._client = client
+                self._bucket = self._client.bucket(self.bucket_name)
+        return self._bucket
+
+    def upload_bytes(self, path: str, data: bytes, content_type: str) -> None:
+        blob = self._get_bucket().blob(path)
+        blob.upload_from_string(data, content_type=content_type)
+
+    def upload_file(self, path: str, file: BinaryIO, content_type: str) -> None:
+        blob = self._get_bucket().blob(path)
+        # サイズを渡すと、ストリームを読み直さずに 1 回のリクエストで送る
+        size = file.seek(0, os.SEEK_END) - file.seek(0)
+        blob.upload_from_file(file, size=size, content_type=content_type)
+
+    def download_text(self, path: str) -> str:
+        from google.api_core.exceptions import NotFound
+
+        blob = self._get_bucket().blob(path)
+        try:
+            return blob.download_as_text()
+        except NotFound as e:
+            raise StorageNotFoundError(path) from e
+
+    def exists(self, path: str) -> bool:
+        return self._get_bucket().blob(path).exists()
+
+
+class LocalBackend:
+    """GCS の代わりにローカルディスクまたはメモリへ保存するバックエンド
+
+    負荷試験やテストで GCS を使わずにゲートウェイを動かすためのもの。
+    latency を指定すると 1 回の I/O ごとにその秒数だけ (スレッド上で) 待つ。
+    """
+
+    def __init__(
+        self,
+        bucket_name: str = "local-bucket",
+        root: str | None = None,
+        latency: float = 0.0,
+    ):
+        self.bucket_name = bucket_name
+        self._root = root
+        self._latency = latency
+        self._objects: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _wait(self) -> None:
+        if self._latency > 0:
+            time.sleep(self._latency)
+
+    def _file_path(self, path: str) -> str:
+        return os.path.join(self._root, path)
+
+    def upload_bytes(self, path: str, data: bytes, content_type: str) -> None:
+        self._wait()
+        if self._root is None:
+            with self._lock:
+                self._objects[path] = bytes(data)
+            return
+
+        file_path = self._file_path(path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(data)
+
+    def upload_file(self, path: str, file: BinaryIO, content_type: str) -> None:
+        if self._root is None:
+            self.upload_bytes(path, file.read(), content_type)
+            return
+
+        self._wait()
+        file_path = self._file_path(path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            shutil.copyfileobj(file, f)
+
+    def download_text(self, path: str) -> str:
+        self._wait()
+        if self._root is None:
+            with self._lock:
+                if path not in self._objects:
+                    raise StorageNotFoundError(path)
+                return self._objects[path].decode("utf-8")
+
+        try:
+            with open(self._file_path(path), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError as e:
+            raise StorageNotFoundError(path) from e
+
+    def exists(self, path: str) -> bool:
+        self._wait()
+        if self._root is None:
+            with self._lock:
+                return path in self._objects
+        return os.path.exists(self._file_path(path))
+
+
+class StorageGateway:
+    """ストレージ I/O をイベントループ外で実行する非同期ゲートウェイ
+
+    同時に実行される I/O の数はスレッドプールのサイズ (max_concurrency) で制限され、
+    それを超えた呼び出しはイベントループをブロックせずに順番を待つ。
+    """
+
+    def __init__(self, backend, max_concurrency: int = 16):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="storage"
+        )
+
+    @property
+    def bucket_name(self) -> str:
+        return self.backend.bucket_name
+
+    def url_for(self, path: str) -> str:
+        """オブジェクトパスから gs:// URL を生成する"""
+        return f"gs://{self.bucket_name}/{path}"
+
+    def path_from_url(self, url: str) -> str:
+        """gs:// URL からバケット内のオブジェクトパスを取り出す"""
+        return url.replace(f"gs://{self.bucket_name}/", "")
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        operation = fn.__name__
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await loop.run_in_executor(
+                self._executor, functools.partial(fn, *args, **kwargs)
+            )
+            outcome = "ok"
+            return result
+        except StorageNotFoundError:
+            outcome = "not_found"
+            raise
+        finally:
+            STORAGE_SECONDS.observe(time.perf_counter() - started, operation=operation)
+            STORAGE_CALLS.inc(operation=operation, outcome=outcome)
+
+    async def upload_bytes(
+        self, path: str, data: bytes, content_type: str = "image/jpeg"
+    ) -> str:
+        """バイト列をアップロードして gs:// URL を返す"""
+        await self._run(self.backend.upload_bytes, path, data, content_type)
+        return self.url_for(path)
+
+    async def upload_file(
+        self, path: str, file: BinaryIO, content_type: str = "image/jpeg"
+    ) -> str:
+        """ファイルオブジェクトの内容をアップロードして gs:// URL を返す
+
+        ダウンロードした本文のバッファをコピーせずにそのまま渡すために使う。
+        """
+        await self._run(self.backend.upload_file, path, file, content_type)
+        return self.url_for(path)
+
+    async def download_text(self, path: str) -> str:
+        """オブジェクトをテキストとして取得する
+
+        Raises:
+            StorageNotFoundError: オブジェクトが存在しない場合
+        """
+        return await self._run(self.backend.download_text, path)
+
+    async def exists(self, path: str) -> bool:
+        return await self._run(self.backend.exists, path)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class ContentAddressedStore:
+    """内容のハッシュをオブジェクト名にして重複アップロードを省くストア
+
+    同じバイト列は常に同じ URL になる。アップロード済みのハッシュは
+    プロセス内の LRU に記録し、未知のハッシュはストレージ上の存在確認で判定する。
+    同じバイト列の put() が同時に届いた場合は、後の呼び出しが最初の呼び出しの
+    アップロードを待つ。
+    """
+
+    def __init__(
+        self,
+        gateway: StorageGateway,
+        prefix: str = "reference_images",
+        extension: str = ".jpg",
+        max_known: int = 4096,
+    ):
+        self.gateway = gateway
+        self.prefix = prefix
+        self.extension = extension
+        self.max_known = max_known
+        self._known: OrderedDict[str, None] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.skipped_uploads = 0
+        self.saved_bytes = 0
+
+    def path_for(self, data: bytes) -> str:
+        """バイト列から決まるオブジェクトパス"""
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{self.prefix}/{digest}{self.extension}"
+
+    def url_for(self, data: bytes) -> str:
+        """put() が返す URL (アップロードを待たずに求められる)"""
+        return self.gateway.url_for(self.path_for(data))
+
+    def _remember(self, path: str) -> None:
+        self._known[path] = None
+        self._known.move_to_end(path)
+        while len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+
+    def _skip(self, path: str, size: int) -> str:
+        self._remember(path)
+        self.skipped_uploads += 1
+        self.saved_bytes += size
+        logger.debug("Skipped duplicate upload: %s", path)
+        return self.gateway.url_for(path)
+
+    async def put(self, data: bytes, content_type: str = "image/jpeg") -> str:
+        """未保存の場合のみアップロードし、gs:// URL を返す"""
+        path = self.path_for(data)
+
+        while True:
+            if path in self._known:
+                return self._skip(path, len(data))
+            pending = self._in_flight.get(path)
+            if pending is None:
+                break
+            try:
+                # 待っている側のキャンセルを最初の呼び出しに伝えない
+                await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # 最初の呼び出しがキャンセルされた場合は、やり直す
+                if pending.cancelled():
+                    continue
+                raise
+            return self._skip(path, len(data))
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[path] = future
+        try:
+            if await self.gateway.exists(path):
+                url = self._skip(path, len(data))
+            else:
+                url = await self.gateway.upload_bytes(path, data, content_type)
+                self._remember(path)
+                self.uploads += 1
+                self.uploaded_bytes += len(data)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 待っている呼び出しが無い場合も例外を回収する
+            future.exception()
+            raise
+        else:
+            future.set_result(url)
+        finally:
+            del self._in_flight[path]
+        return url
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "uploads": self.uploads,
+            "uploaded_bytes": self.uploaded_bytes,
+            "skipped_uploads": self.skipped_uploads,
+            "saved_bytes": self.saved_bytes,
+        }
+
+
+def create_storage_gateway() -> StorageGateway:
+    """設定に従ってゲートウェイを生成する"""
+    if settings.STORAGE_BACKEND == "local":
+        backend = LocalBackend(
+            bucket_name=settings.CLOUD_STORAGE_BUCKET or "local-bucket",
+            root=settings.LOCAL_STORAGE_DIR or None,
+        )
+    else:
+        backend = GCSBackend(
+            settings.CLOUD_STORAGE_BUCKET, pool_size=settings.STORAGE_MAX_CONCURRENCY
+        )
+    logger.info("Storage gateway backend: %s", type(backend).__name__)
+    return StorageGateway(backend, max_concurrency=settings.STORAGE_MAX_CONCURRENCY)
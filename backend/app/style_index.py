@@ -0,0 +1,280 @@
+"""
+写真のスタイル埋め込みと近傍検索
+
+色 (HSV ヒストグラム)・明るさ・コントラスト・質感 (勾配の強さと向き) から
+小さな特徴ベクトルを作り、保存済みの写真家の画像と参考画像を
+内積 (コサイン類似度) で比べる。
+ベクトルはメモリマップしたファイルに追記し、メタデータは JSON Lines に保存する。
+写真家 (目的地・言語・ユーザー名) ごとに 1 行で、画像を取得し直すたびに上書きする。
+モデルを呼ばずに、目的地・言語で絞り込んだ候補をミリ秒で並べ替えられる。
+"""
+
+import io
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from app.normalize import normalize_destination
+
+logger = logging.getLogger(__name__)
+
+# 特徴量を計算する解像度 (長辺)
+_FEATURE_SIZE = 128
+_HUE_BINS, _SAT_BINS, _VAL_BINS = 8, 3, 3
+_GRADIENT_BINS = 8
+
+EMBEDDING_DIM = _HUE_BINS * _SAT_BINS * _VAL_BINS + 5 + 2 * _GRADIENT_BINS
+
+
+def style_embedding(image_bytes: bytes) -> np.ndarray:
+    """画像のスタイル埋め込み (L2 正規化した float32 ベクトル) を返す
+
+    CPU を使う処理なのでプロセスプールから呼び出す想定。
+
+    Raises:
+        PIL.UnidentifiedImageError: 画像としてデコードできない場合
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.draft("RGB", (_FEATURE_SIZE, _FEATURE_SIZE))
+        image = image.convert("RGB")
+        image.thumbnail((_FEATURE_SIZE, _FEATURE_SIZE))
+        hsv = np.asarray(image.convert("HSV"), dtype=np.float32) / 255.0
+        rgb = np.asarray(image, dtype=np.float32) / 255.0
+
+    h, s, v = hsv[..., 0].ravel(), hsv[..., 1].ravel(), hsv[..., 2].ravel()
+
+    # 色: HSV の同時ヒストグラム (平方根で大きな面積の色を抑える)
+    color, _ = np.histogramdd(
+        np.stack([h, s, v], axis=1),
+        bins=(_HUE_BINS, _SAT_BINS, _VAL_BINS),
+        range=((0, 1), (0, 1), (0, 1)),
+    )
+    color = np.sqrt(color.ravel() / h.size)
+
+    # 明るさ・コントラスト・彩度・色の鮮やかさ (Hasler–Süsstrunk)
+    rg = rgb[..., 0] - rgb[..., 1]
+    yb = 0.5 * (rgb[..., 0] + rgb[..., 1]) - rgb[..., 2]
+    colorfulness = np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean())
+    tone = np.array(
+        [
+            v.mean(),
+            v.std(),
+            np.percentile(v, 90) - np.percentile(v, 10),
+            s.mean(),
+            colorfulness,
+        ],
+        dtype=np.float32,
+    )
+
+    # 質感: 輝度の勾配の強さと向きのヒストグラム
+    gy, gx = np.gradient(hsv[..., 2])
+    magnitude = np.hypot(gx, gy).ravel()
+    strength, _ = np.histogram(magnitude, bins=_GRADIENT_BINS, range=(0, 0.25))
+    orientation, _ = np.histogram(
+        np.arctan2(gy, gx).ravel() % np.pi,
+        bins=_GRADIENT_BINS,
+        range=(0, np.pi),
+        weights=magnitude,
+    )
+    strength = np.sqrt(strength / magnitude.size)
+    orientation = np.sqrt(orientation / max(orientation.sum(), 1e-6))
+
+    vector = np.concatenate([color, tone, 0.5 * strength, 0.5 * orientation])
+    vector = vector.astype(np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-6)
+
+
+class StyleIndex:
+    """写真家の画像のスタイル埋め込みを保持し、近いものを返す索引
+
+    path を指定すると {path}.vec (float32 の memmap) と {path}.meta.jsonl に保存し、
+    次回起動時に読み込む。追加は 1 件ずつでき、容量が足りなければ倍に広げる。
+    メタデータは追記していき、上書きした行が溜まったら書き直す。
+    追加・検索はロックで直列化する (ファイルへの書き込みを伴うため、
+    イベントループの外のスレッドから呼び出す想定)。
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        dim: int = EMBEDDING_DIM,
+        initial_capacity: int = 1024,
+    ):
+        self.path = path
+        self.dim = dim
+        self._meta: list[dict] = []
+        # (目的地, 言語, ユーザー名) -> 行番号 (同じ写真家は上書きする)
+        self._rows: dict[tuple[str, str, str], int] = {}
+        # (目的地, 言語) -> 行番号のリスト
+        self._groups: dict[tuple[str, str], list[int]] = {}
+        self._meta_path = f"{path}.meta.jsonl" if path else None
+        # メタデータのファイルの行数 (上書きした分だけ len(self._meta) より多い)
+        self._meta_lines = 0
+        self._lock = threading.Lock()
+
+        if path:
+            self._load(path, initial_capacity)
+        else:
+            self._vectors = np.zeros((initial_capacity, dim), dtype=np.float32)
+
+    @property
+    def _vector_path(self) -> str:
+        return f"{self.path}.vec"
+
+    def _open_memmap(self, capacity: int, mode: str) -> np.memmap:
+        return np.memmap(
+            self._vector_path, dtype=np.float32, mode=mode, shape=(capacity, self.dim)
+        )
+
+    def _load(self, path: str, initial_capacity: int) -> None:
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._meta_lines += 1
+                        self._index_meta(json.loads(line))
+
+        row_bytes = self.dim * np.dtype(np.float32).itemsize
+        stored = (
+            os.path.getsize(self._vector_path) // row_bytes
+            if os.path.exists(self._vector_path)
+            else 0
+        )
+        if stored < len(self._meta):
+            # ベクトルの書き込み前に終了した行は読み込まない
+            logger.warning("Style index %s is truncated, dropping rows", path)
+            self._meta = self._meta[:stored]
+            self._reindex()
+
+        capacity = max(stored, initial_capacity)
+        mode = "r+" if stored == capacity else "w+"
+        if mode == "w+" and stored:
+            existing = np.array(self._open_memmap(stored, "r"))
+            self._vectors = self._open_memmap(capacity, "w+")
+            self._vectors[:stored] = existing
+        else:
+            self._vectors = self._open_memmap(capacity, mode)
+
+    def _index_meta(self, meta: dict) -> None:
+        row = meta["row"]
+        if row == len(self._meta):
+            self._meta.append(meta)
+        else:
+            self._meta[row] = meta
+        rows = self._groups.setdefault((meta["destination"], meta["language"]), [])
+        previous = self._rows.get(
+            (meta["destination"], meta["language"], meta["username"])
+        )
+        if previous is not None and previous != row:
+            # 画像 URL ごとに行を分けていた古いファイルは、写真家ごとに最後の行だけ使う
+            rows.remove(previous)
+        self._rows[(meta["destination"], meta["language"], meta["username"])] = row
+        if row not in rows:
+            rows.append(row)
+
+    def _reindex(self) -> None:
+        meta, self._meta = self._meta, []
+        self._rows.clear()
+        self._groups.clear()
+        for item in meta:
+            self._index_meta(item)
+
+    def _grow(self) -> None:
+        capacity = len(self._vectors) * 2
+        if self.path:
+            self._vectors.flush()
+            existing = np.array(self._vectors)
+            del self._vectors
+            self._vectors = self._open_memmap(capacity, "w+")
+            self._vectors[: len(existing)] = existing
+        else:
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[: len(self._vectors)] = self._vectors
+            self._vectors = grown
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def _write_meta(self, meta: dict) -> None:
+        if self._meta_path is None:
+            return
+        if self._meta_lines >= 2 * len(self._meta) + 64:
+            # 上書きした古い行が溜まったら、現在の行だけで書き直す
+            tmp_path = f"{self._meta_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for item in self._meta:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self._meta_path)
+            self._meta_lines = len(self._meta)
+            return
+        with open(self._meta_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+        self._meta_lines += 1
+
+    def add(
+        self,
+        destination: str,
+        language: str,
+        username: str,
+        image_url: str,
+        vector: np.ndarray,
+    ) -> None:
+        """写真家の画像の埋め込みを追加する
+
+        同じ目的地・言語・ユーザー名の写真家は、画像 URL が変わっても
+        行を増やさずに上書きする。
+        """
+        key = normalize_destination(destination)
+        with self._lock:
+            row = self._rows.get((key, language, username))
+            if row is None:
+                row = len(self._meta)
+                if row >= len(self._vectors):
+                    self._grow()
+
+            self._vectors[row] = vector
+            meta = {
+                "row": row,
+                "destination": key,
+                "language": language,
+                "username": username,
+                "image_url": image_url,
+            }
+            self._index_meta(meta)
+            self._write_meta(meta)
+
+    def search(
+        self, vector: np.ndarray, destination: str, language: str, k: int
+    ) -> list[tuple[str, float]]:
+        """目的地・言語が一致する写真家を、スタイルが近い順に返す
+
+        Returns:
+            list[tuple[str, float]]: (ユーザー名, コサイン類似度) のリスト (最大 k 件)
+        """
+        key = normalize_destination(destination)
+        with self._lock:
+            rows = list(self._groups.get((key, language), ()))
+            if not rows or k <= 0:
+                return []
+
+            scores = self._vectors[rows] @ vector
+            order = np.argsort(-scores)[:k]
+            return [(self._meta[rows[i]]["username"], float(scores[i])) for i in order]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "vectors": len(self._meta),
+                "capacity": len(self._vectors),
+                "groups": len(self._groups),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if isinstance(self._vectors, np.memmap):
+                self._vectors.flush()
@@ -0,0 +1,63 @@
+"""
+エージェントの応答から Instagram のユーザー名を取り出すパーサー
+
+応答は 1 行 1 件 (カンマ区切りも可) のユーザー名の一覧で、モデルの生成途中の
+断片を順に与えると、行が確定した時点でユーザー名を返す。
+最初の写真家の画像取得を、モデルが残りを生成している間に始められる。
+"""
+
+import re
+
+# 区切り (改行・カンマ) で分けた 1 件。箇条書きの記号・番号と @ は許容する
+_USERNAME = re.compile(
+    r"(?:[-*•]\s*|\d+[.)]\s+)?@?(?P<username>[A-Za-z0-9_.]{3,30})",
+)
+_SEPARATORS = re.compile(r"[\n,]")
+
+
+def parse_username(token: str) -> str:
+    """区切りで分けた 1 件をユーザー名にする
+
+    Returns:
+        str: ユーザー名 (ユーザー名として扱えない場合は空文字)
+    """
+    match = _USERNAME.fullmatch(token.strip())
+    return match.group("username") if match else ""
+
+
+class UsernameParser:
+    """応答の断片からユーザー名を重複なく、最大 limit 件取り出す"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.usernames: list[str] = []
+        self._seen: set[str] = set()
+        self._buffer = ""
+
+    @property
+    def done(self) -> bool:
+        """limit 件に達したか (以降の断片は読まなくてよい)"""
+        return len(self.usernames) >= self.limit
+
+    def _accept(self, token: str) -> list[str]:
+        username = parse_username(token)
+        # Instagram のユーザー名は大文字・小文字を区別しない
+        key = username.lower()
+        if not username or key in self._seen or self.done:
+            return []
+        self._seen.add(key)
+        self.usernames.append(username)
+        return [username]
+
+    def feed(self, chunk: str) -> list[str]:
+        """断片を追加し、新しく確定したユーザー名を返す"""
+        *tokens, self._buffer = _SEPARATORS.split(self._buffer + chunk)
+        found: list[str] = []
+        for token in tokens:
+            found.extend(self._accept(token))
+        return found
+
+    def close(self) -> list[str]:
+        """応答の終わり。区切りの無い最後の 1 件を確定して返す"""
+        token, self._buffer = self._buffer, ""
+        return self._accept(token)
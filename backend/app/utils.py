@@ -1,20 +1,62 @@
-import logging
+import asyncio
+import functools
 import json
-import re
-from google.adk.runners import Runner
+import logging
+import random
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import aclosing
+
+from app.config import settings
+from app.fanout import iter_bounded_stream
+from app.images import image_mime_type
+from app.logs import add_fields, log_payload
+from app.metrics import PHOTOGRAPHER_INDEX, stage
+from app.resources import agent_ready
+from app.usernames import UsernameParser
 
 # ログ設定
 logger = logging.getLogger(__name__)
 
 
-async def _fetch_and_store_instagram_image(username: str) -> str:
-    """Instagram画像を取得してCloud Storageに保存"""
+async def _index_style(
+    resources,
+    destination: str,
+    language: str,
+    username: str,
+    image_url: str,
+    image_bytes: bytes,
+) -> None:
+    """保存した写真家の画像のスタイル埋め込みを索引に追加する"""
+    from app.style_index import style_embedding
+
+    try:
+        loop = asyncio.get_running_loop()
+        vector = await loop.run_in_executor(
+            resources.image_pool, style_embedding, image_bytes
+        )
+        # メタデータの追記・書き直しと容量の拡張はファイル操作なので、ループの外で行う
+        await asyncio.to_thread(
+            resources.style_index.add,
+            destination,
+            language,
+            username,
+            image_url,
+            vector,
+        )
+    except Exception as e:
+        logger.warning("Failed to index style for %s: %s", username, e)
+
+
+async def _fetch_and_store_instagram_image(
+    username: str, resources, destination: str = "", language: str = ""
+) -> str:
+    """Instagram画像を取得してCloud Storageに保存
+
+    destination を指定した場合は、画像のスタイル埋め込みも索引に追加する。
+    """
     import datetime
-    import requests
-    from google.cloud import storage
-    from app.config import settings
 
-    logger.info(f"Fetching Instagram image for {username}")
+    logger.debug("Fetching Instagram image for %s", username)
 
     try:
         # 現在の日付時刻（秒まで）でフォルダを作成
@@ -26,127 +68,325 @@ async def _fetch_and_store_instagram_image(username: str) -> str:
         # TODO: 実装できてない
         placeholder_url = f"https://via.placeholder.com/400x400/0066cc/ffffff?text={username[:3].upper()}"
 
-        response = requests.get(placeholder_url, timeout=10)
-        response.raise_for_status()
-
-        # Cloud Storageにアップロード
-        client = storage.Client()
-        bucket = client.bucket(settings.CLOUD_STORAGE_BUCKET)
-        blob = bucket.blob(file_path)
-
-        blob.upload_from_string(response.content, content_type="image/jpeg")
-
-        # 公開URLを返す
-        result_url = f"gs://{settings.CLOUD_STORAGE_BUCKET}/{file_path}"
-        logger.info(f"Uploaded Instagram image: {result_url}")
+        # ストリーミングで取得したバッファをそのままCloud Storageにアップロード
+        body = await resources.fetcher.download(placeholder_url)
+        result_url = await resources.storage.upload_file(
+            file_path, body, content_type="image/jpeg"
+        )
+        logger.debug("Uploaded Instagram image: %s", result_url)
+
+        if destination:
+            # 索引への追加は結果に影響しないため、応答を待たせずに裏で行う
+            resources.write_behind.submit(
+                "style_index",
+                functools.partial(
+                    _index_style,
+                    resources,
+                    destination,
+                    language,
+                    username,
+                    result_url,
+                    body.getvalue(),
+                ),
+            )
 
         return result_url
 
     except Exception as e:
-        logger.error(f"Error fetching Instagram image for {username}: {e}")
+        logger.error("Error fetching Instagram image for %s: %s", username, e)
         # フォールバック: デフォルト画像
         return f"gs://{settings.CLOUD_STORAGE_BUCKET}/images/default/photographer_placeholder.jpg"
 
 
-async def run_agent(prompt: str, destination: str, language: str) -> str:
-    logger.info("=== Starting run_agent ===")
-    logger.info(f"Input prompt: {prompt[:200]}...")
-
+async def _timed_fetch(
+    username: str, resources, destination: str, language: str
+) -> str:
+    # 写真家ごとに実行されるため、リクエストのログには fetch 全体の時間だけを残す
+    with stage("fetch_image", log=False):
+        return await _fetch_and_store_instagram_image(
+            username, resources, destination, language
+        )
+
+
+async def describe_image_style(image_bytes: bytes, timeout: float | None = None) -> str:
+    """エージェントに参考画像のスタイルを短い説明にしてもらう
+
+    画像そのものをメッセージに添付する (URL を文字列で渡してもモデルは画像を読めない)。
+
+    Args:
+        image_bytes: 参考画像のデータ
+        timeout: 応答を待つ最大秒数
+
+    Returns:
+        str: スタイルの説明 (得られなかった場合は空文字)
+    """
+    await agent_ready()
+    from app.agent.agent import call_agent
+    from app.prompts import get_image_analysis_prompt
+
+    response = await call_agent(
+        get_image_analysis_prompt(),
+        timeout=timeout,
+        kind="analyze",
+        image=(image_bytes, image_mime_type(image_bytes)),
+    )
+    return (response or "").strip()
+
+
+async def _iter_agent_usernames(
+    prompt: str,
+    destination: str,
+    language: str,
+    timeout: float | None = None,
+    describe_style: Callable[[], Awaitable[str]] | None = None,
+) -> AsyncIterator[str]:
+    """エージェントに問い合わせ、写真家の Instagram ユーザー名を確定した順に返す
+
+    モデルの応答をストリーミングで受け取り、1 行 (1 件) が揃うたびに返すため、
+    呼び出し側はモデルが残りを生成している間に最初の写真家の処理を始められる。
+    describe_style があれば、その結果 (キャッシュ済みのスタイル説明) を
+    style_description として渡し、画像の分析をモデルに繰り返させない。
+    """
+    await agent_ready()
+    from app.agent.agent import search_photographer_on_instagram, stream_agent
+
+    style_description = await describe_style() if describe_style else ""
+
+    # ツールを直接呼び出し (スタイル説明が無ければ検索プロンプト全体を渡す)
+    tool_result = search_photographer_on_instagram(
+        destination, language, style_description or prompt
+    )
+
+    if not (
+        isinstance(tool_result, dict) and tool_result.get("status") == "search_needed"
+    ):
+        logger.warning("Unexpected tool result: %s", tool_result)
+        raise ValueError("Tool result is not in expected format")
+
+    parser = UsernameParser(settings.MAX_PHOTOGRAPHER_IMAGES)
+    with stage("model"):
+        async with aclosing(stream_agent(tool_result["prompt"], timeout)) as chunks:
+            async for chunk in chunks:
+                for username in parser.feed(chunk):
+                    yield username
+                if parser.done:
+                    # 上限に達したら残りの生成は待たない
+                    break
+            else:
+                for username in parser.close():
+                    yield username
+
+    logger.debug("Found photographer usernames: %s", parser.usernames)
+
+
+async def _iter_candidate_usernames(
+    prompt: str,
+    destination: str,
+    language: str,
+    resources,
+    timeout: float | None = None,
+    style_vector=None,
+    describe_style: Callable[[], Awaitable[str]] | None = None,
+) -> AsyncIterator[str]:
+    """写真家インデックスとエージェントから候補のユーザー名を集め、確定した順に返す
+
+    インデックスに PHOTOGRAPHER_INDEX_MIN_CANDIDATES 件以上の候補があれば、
+    モデルを呼ばずに返す (この場合 describe_style も呼ばない)。ただし
+    PHOTOGRAPHER_INDEX_EXPLORE_RATE の割合でモデルにも問い合わせ、候補を更新する。
+    参考画像のスタイル埋め込み (style_vector) があれば、保存済みの画像が
+    参考画像に近い写真家を先頭にする。
+    モデルに問い合わせる場合はインデックスの候補を先に返してから、不足分をモデルの
+    生成中に 1 件ずつ返す。モデルが返した候補は全てインデックスに追加する。
+    """
+    limit = settings.MAX_PHOTOGRAPHER_IMAGES
+    min_candidates = settings.PHOTOGRAPHER_INDEX_MIN_CANDIDATES
+    index = resources.photographer_index
+    # SQLite の読み書きはブロッキングなので、イベントループの外で行う
+    indexed = await asyncio.to_thread(
+        index.lookup, destination, language, max(limit, min_candidates)
+    )
+
+    if style_vector is not None:
+        with stage("style_rank"):
+            ranked = [
+                username
+                for username, _ in await asyncio.to_thread(
+                    resources.style_index.search,
+                    style_vector,
+                    destination,
+                    language,
+                    limit,
+                )
+            ]
+        add_fields(styleRanked=len(ranked))
+        indexed = list(dict.fromkeys(ranked + indexed))
+    add_fields(indexCandidates=len(indexed))
+
+    if len(indexed) >= min_candidates:
+        if random.random() >= settings.PHOTOGRAPHER_INDEX_EXPLORE_RATE:
+            PHOTOGRAPHER_INDEX.inc(result="hit")
+            for username in indexed[:limit]:
+                yield username
+            return
+        PHOTOGRAPHER_INDEX.inc(result="explore")
+    else:
+        PHOTOGRAPHER_INDEX.inc(result="partial" if indexed else "miss")
+
+    # インデックスの候補を優先し、重複を除いてエージェントの候補で埋める
+    indexed = indexed[:limit]
+    for username in indexed:
+        yield username
+    seen = set(indexed)
+    found: list[str] = []
     try:
-        logger.info("Trying direct tool call first...")
-        from app.agent.agent import search_photographer_on_instagram
-
-        try:
-            logger.info(
-                f"Extracted parameters: destination={destination}, language={language}"
+        async with aclosing(
+            _iter_agent_usernames(
+                prompt, destination, language, timeout, describe_style
             )
-
-            # ツールを直接呼び出し
-            logger.info("Calling search_photographer_on_instagram directly...")
-            tool_result = search_photographer_on_instagram(
-                destination, language, prompt
+        ) as usernames:
+            async for username in usernames:
+                # 返しきった後も回答の最後まで読み、全ての候補をインデックスに追加する
+                found.append(username)
+                if username in seen or len(seen) >= limit:
+                    continue
+                seen.add(username)
+                yield username
+    finally:
+        if found:
+            await asyncio.to_thread(
+                index.add, destination, language, found, source="agent"
             )
 
-            if (
-                isinstance(tool_result, dict)
-                and tool_result.get("status") == "search_needed"
-            ):
-                logger.info("Tool returned search prompt, calling AI agent...")
-
-                ai_prompt = tool_result["prompt"]
-                ai_response = ""
-
-                try:
-                    from app.agent.agent import call_agent
-
-                    ai_response = await call_agent(ai_prompt)
-
-                    print("=============================")
-                    print(ai_response)
-                    print("=============================")
-                except ImportError as adk_error:
-                    logger.error(f"ADK import error: {adk_error}")
-                    raise adk_error
-
-                photographer_usernames = []
-                try:
-                    if hasattr(ai_response, "__aiter__"):
-                        async for chunk in ai_response:
-                            if hasattr(chunk, "content"):
-                                content = chunk.content
-                                lines = content.replace(",", "\n").split("\n")
-                                for line in lines:
-                                    username = line.strip().replace("@", "")
-                                    if re.match(
-                                        r"^[a-zA-Z0-9_.]{3,}$", username
-                                    ):  # ← username のみ
-                                        photographer_usernames.append(username)
-
-                    logger.info(
-                        f"Found photographer usernames: {photographer_usernames}"
-                    )
-
-                    # 各写真家のInstagram画像を取得してCloud Storageに保存
-                    results = []
-                    for username in photographer_usernames[:6]:  # 最大6件
-                        try:
-                            image_url = await _fetch_and_store_instagram_image(username)
-                            results.append(
-                                {
-                                    "imageUrl": image_url,
-                                    "instagramUrl": f"https://instagram.com/{username}",
-                                }
-                            )
-                        except Exception as e:
-                            logger.warning(f"Failed to fetch image for {username}: {e}")
-
-                    result_json = json.dumps({"images": results})
-
-                    logger.info(f"=== AI AGENT RESPONSE ===")
-                    logger.info(f"AI found {len(photographer_usernames)} photographers")
-                    logger.info(
-                        f"Successfully processed {len(results)} photographers with images"
-                    )
-                    logger.info(f"Final JSON response: {result_json}")
-                    logger.info(f"=== END AI RESPONSE ===")
-
-                    return result_json
-
-                except Exception as e:
-                    logger.error(f"Error calling AI agent: {e}", exc_info=True)
-                    raise e
 
-            else:
-                logger.warning(
-                    "Tool result is not in expected format, returning empty result"
+def _image_item(username: str, image_url: str) -> dict:
+    return {
+        "imageUrl": image_url,
+        "instagramUrl": f"https://instagram.com/{username}",
+    }
+
+
+async def _iter_fetched_images(
+    prompt: str,
+    destination: str,
+    language: str,
+    resources,
+    timeout: float | None = None,
+    style_vector=None,
+    describe_style: Callable[[], Awaitable[str]] | None = None,
+) -> AsyncIterator[tuple[int, str, str]]:
+    """候補が確定したものから画像の取得・保存を始め、終わったものから返す
+
+    モデルが残りの候補を生成している間に、最初の写真家の画像の取得を始める。
+
+    Yields:
+        tuple[int, str, str]: (候補の順位, ユーザー名, 保存した画像の URL) (完了した順)
+    """
+    usernames: list[str] = []
+
+    async def candidates():
+        async with aclosing(
+            _iter_candidate_usernames(
+                prompt,
+                destination,
+                language,
+                resources,
+                timeout,
+                style_vector,
+                describe_style,
+            )
+        ) as found:
+            async for username in found:
+                usernames.append(username)
+                yield username
+
+    async for index, image_url in iter_bounded_stream(
+        candidates(),
+        lambda username: _timed_fetch(username, resources, destination, language),
+        limit=settings.FETCH_CONCURRENCY,
+        item_timeout=settings.FETCH_ITEM_TIMEOUT,
+        total_timeout=settings.FETCH_TOTAL_TIMEOUT,
+    ):
+        yield index, usernames[index], image_url
+    add_fields(photographers=len(usernames))
+
+
+async def run_agent(
+    prompt: str,
+    destination: str,
+    language: str,
+    resources=None,
+    timeout: float | None = None,
+    style_vector=None,
+    describe_style: Callable[[], Awaitable[str]] | None = None,
+) -> str:
+    """写真家を検索し、画像を取得・保存した結果を JSON 文字列で返す"""
+    if resources is None:
+        from app.resources import get_resources
+
+        resources = get_resources()
+
+    try:
+        # 候補の検索と各写真家のInstagram画像の取得・保存を重ねて行う
+        with stage("fetch"):
+            async with aclosing(
+                _iter_fetched_images(
+                    prompt,
+                    destination,
+                    language,
+                    resources,
+                    timeout,
+                    style_vector,
+                    describe_style,
                 )
-                logger.warning(f"Unexpected tool result: {tool_result}")
-                raise e_direct
+            ) as images:
+                fetched = sorted([item async for item in images])
+
+        # 期限内に取得できたものだけを候補の順序で返す
+        results = [
+            _image_item(username, image_url) for _, username, image_url in fetched
+        ]
+
+        result_json = json.dumps({"images": results})
 
-        except Exception as e_direct:
-            logger.error(f"Direct tool call failed: {e_direct}", exc_info=True)
-            raise e_direct
+        add_fields(fetched=len(results))
+        log_payload(logger, "Final JSON response: %s", lambda: result_json)
+
+        return result_json
 
     except Exception as e:
-        logger.error(f"Error in run_agent: {e}", exc_info=True)
+        logger.error("Error in run_agent: %s", e, exc_info=True)
         raise e
+
+
+async def iter_photographer_images(
+    prompt: str,
+    destination: str,
+    language: str,
+    resources=None,
+    timeout: float | None = None,
+    style_vector=None,
+    describe_style: Callable[[], Awaitable[str]] | None = None,
+) -> AsyncIterator[dict]:
+    """写真家を検索し、画像の取得・保存が終わったものから順に返す
+
+    Yields:
+        dict: imageUrl と instagramUrl を持つ結果 (完了した順)
+    """
+    if resources is None:
+        from app.resources import get_resources
+
+        resources = get_resources()
+
+    async with aclosing(
+        _iter_fetched_images(
+            prompt,
+            destination,
+            language,
+            resources,
+            timeout,
+            style_vector,
+            describe_style,
+        )
+    ) as images:
+        async for _, username, image_url in images:
+            yield _image_item(username, image_url)
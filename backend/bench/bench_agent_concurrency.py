@@ -0,0 +1,55 @@
+"""
+エージェント呼び出しの並行性ベンチマーク
+
+Gemini の代わりに一定時間待つ FakeRunner を使い、N 件の call_agent() を
+同時に実行したときの所要時間を、同期の runner.run() をループで回す
+変更前の方法と比較する。非同期版は N 件でも 1 件分の時間で終わる。
+
+    uv run python -m bench.bench_agent_concurrency --latency 0.5 --parallel 8
+"""
+
+import argparse
+import asyncio
+import time
+
+from google.genai import types
+
+from app.agent import agent
+from bench.fakes import FakeRunner
+
+
+async def _call_agent_blocking(query: str) -> str:
+    """変更前の call_agent: 同期ジェネレーターをイベントループ上で回す"""
+    content = types.Content(role="user", parts=[types.Part(text=query)])
+    for event in agent.runner.run(
+        user_id="user", session_id="session", new_message=content
+    ):
+        if event.is_final_response():
+            return event.content.parts[0].text
+
+
+async def _measure(call, parallel: int) -> float:
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(call(f"query {i}") for i in range(parallel)))
+    assert all(responses)
+    return time.perf_counter() - started
+
+
+async def main(latency: float, parallel: int) -> None:
+    agent.runner = FakeRunner(latency=latency)
+
+    blocking = await _measure(_call_agent_blocking, parallel)
+    non_blocking = await _measure(agent.call_agent, parallel)
+
+    print(f"parallel={parallel} agent latency={latency * 1000:.0f}ms")
+    print(f"  blocking runner.run      : {blocking * 1000:8.1f} ms")
+    print(f"  async runner.run_async   : {non_blocking * 1000:8.1f} ms")
+    print(f"  ratio to a single call   : {non_blocking / latency:8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--parallel", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.parallel))
@@ -0,0 +1,77 @@
+"""
+参考画像の正規化パイプラインのベンチマーク
+
+スマートフォンのカメラ画像に近いサンプル (EXIF の回転情報付き JPEG) を生成し、
+normalize_image() をプロセスプールで処理したときのスループットと
+保存・送信するバイト数の削減量を表示する。
+
+    uv run python -m bench.bench_images --count 24 --workers 2
+"""
+
+import argparse
+import io
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from app.config import settings
+from app.images import normalize_image, parse_image_size
+
+
+def _sample_image(seed: int, width: int, height: int) -> bytes:
+    """ノイズとグラデーションを含む、カメラ画像程度の圧縮率の JPEG"""
+    rng = random.Random(seed)
+    base = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), rng.uniform(20, 60))
+    image = Image.merge(
+        "RGB", (base, noise, base.rotate(rng.choice([90, 180, 270])).resize(base.size))
+    )
+    exif = Image.Exif()
+    exif[0x0112] = rng.choice([1, 6, 8])  # Orientation
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=92, exif=exif)
+    return output.getvalue()
+
+
+def main(count: int, workers: int, width: int, height: int) -> None:
+    samples = [_sample_image(i, width, height) for i in range(count)]
+    size = parse_image_size(settings.IMAGE_SIZE)
+
+    def run(executor_map):
+        started = time.perf_counter()
+        outputs = list(
+            executor_map(
+                normalize_image,
+                samples,
+                [size] * count,
+                [settings.IMAGE_FORMAT] * count,
+            )
+        )
+        return outputs, time.perf_counter() - started
+
+    outputs, serial = run(map)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # ワーカー起動時間を除くため 1 度温めてから測る
+        list(pool.map(normalize_image, samples[:workers]))
+        _, pooled = run(pool.map)
+
+    input_bytes = sum(len(s) for s in samples)
+    output_bytes = sum(len(o) for o in outputs)
+    print(f"samples={count} input={width}x{height} output={settings.IMAGE_SIZE}")
+    print(f"  serial      : {count / serial:7.1f} images/s")
+    print(f"  {workers} workers   : {count / pooled:7.1f} images/s")
+    print(f"  input bytes : {input_bytes / count / 1024:9.1f} KiB/image")
+    print(f"  output bytes: {output_bytes / count / 1024:9.1f} KiB/image")
+    print(f"  saved       : {100 * (1 - output_bytes / input_bytes):7.1f} %")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=24)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    args = parser.parse_args()
+    main(args.count, args.workers, args.width, args.height)
@@ -0,0 +1,232 @@
+"""
+/searchPhotographers の負荷試験
+
+app.app の FastAPI アプリをプロセス内で起動し (httpx.ASGITransport)、
+Gemini の代わりに FakeRunner、Cloud Storage の代わりに LocalBackend、
+写真家画像の取得先の代わりに固定の画像を返す httpx.MockTransport を使う。
+Vertex AI や GCS の利用枠を使わずに、指定した同時実行数でリクエストを送り、
+スループット・レイテンシ (p50/p95/p99)・ピーク RSS を表示する。
+
+参考画像・遅延の揺らぎは --seed から決まるため、同じ引数なら同じ負荷になる。
+既定ではリクエストごとに目的地を変え、写真家インデックスに当たらずにモデルを呼ぶ経路を
+測る (--destinations 1 なら全リクエストが同じ目的地で、インデックスに当たる経路を測る)。
+
+    uv run python -m bench.bench_load --requests 200 --concurrency 16
+    uv run python -m bench.bench_load --json > before.json   # 回帰比較用
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import time
+
+# Settings はインポート時に環境変数を読むため、app より先に設定する
+os.environ.setdefault("STORAGE_BACKEND", "local")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# 全リクエストが同じクライアントから届くため、クライアントごとのレート制限は外す
+os.environ.setdefault("CLIENT_RATE_LIMIT", "0")
+
+import httpx
+from PIL import Image
+
+import app.resources
+from app.agent import agent
+from app.resources import Resources
+from app.storage import LocalBackend, StorageGateway
+from bench.fakes import FakeRunner
+
+
+def _reference_image(seed: int, width: int, height: int) -> str:
+    """seed ごとに内容の異なる参考画像 (data URL)"""
+    rng = random.Random(seed)
+    image = Image.effect_noise((width, height), rng.uniform(20, 80)).convert("RGB")
+    image.paste(
+        tuple(rng.randrange(256) for _ in range(3)),
+        (0, 0, width // 2, height // 2),
+    )
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return "data:image/jpeg;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def _photographer_image() -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (400, 400), (0, 102, 204)).save(output, format="JPEG")
+    return output.getvalue()
+
+
+def _resources(storage_latency: float, fetch_latency: float) -> Resources:
+    image = _photographer_image()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(fetch_latency)
+        return httpx.Response(
+            200, content=image, headers={"content-type": "image/jpeg"}
+        )
+
+    return Resources(
+        storage_factory=lambda: StorageGateway(
+            LocalBackend("bench-bucket", latency=storage_latency)
+        ),
+        http_factory=lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        # FakeRunner はモデルを呼ばないので GenAI クライアントは使わない
+        genai_factory=object,
+    )
+
+
+def _percentile(latencies, q: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[q - 1]
+
+
+async def run(args) -> dict:
+    from app.app import app as fastapi_app
+
+    app.resources._resources = _resources(args.storage_latency, args.fetch_latency)
+    runner = agent.runner = FakeRunner(
+        latency=args.agent_latency, jitter=args.agent_jitter, seed=args.seed
+    )
+
+    width, height = (int(v) for v in args.image_size.split("x"))
+    distinct = args.distinct or args.requests
+    destinations = args.destinations or args.requests
+    images = [_reference_image(args.seed + i, width, height) for i in range(distinct)]
+
+    def destination(key) -> str:
+        # 連番だと表記ゆれとして既知の目的地に対応付けられるため、ハッシュを付ける
+        suffix = hashlib.sha1(f"{args.seed}:{key}".encode()).hexdigest()
+        return f"{args.destination} {suffix[:10]}"
+
+    bodies = [
+        {
+            "destination": args.destination
+            if destinations == 1
+            else destination(i % destinations),
+            "preferredLanguage": "japanese",
+            "referenceImage": images[i % distinct],
+        }
+        for i in range(args.requests)
+    ]
+
+    latencies = []
+    statuses = {}
+    results = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for body in bodies:
+        queue.put_nowait(body)
+
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with (
+        fastapi_app.router.lifespan_context(fastapi_app),
+        httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as client,
+    ):
+
+        async def worker():
+            nonlocal results
+            while not queue.empty():
+                body = queue.get_nowait()
+                started = time.perf_counter()
+                response = await client.post("/searchPhotographers", json=body)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = (
+                    statuses.get(response.status_code, 0) + 1
+                )
+                if response.status_code == 200:
+                    results += len(response.json()["images"])
+
+        # ワーカープロセスや初回インポートの時間を計測から除く
+        # (計測する目的地のインデックスに候補を残さないよう、別の目的地を使う)
+        for i in range(args.warmup):
+            body = dict(
+                bodies[0],
+                destination=destination(f"warmup{i}"),
+                referenceImage=_reference_image(-1 - i, width, height),
+            )
+            await client.post("/searchPhotographers", json=body)
+
+        calls_before = runner.calls - runner.style_calls
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "agent_latency_ms": args.agent_latency * 1000,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "statuses": statuses,
+        "results_per_request": round(results / args.requests, 2),
+        "destinations": destinations,
+        # 写真家を探すモデル呼び出しの回数 (インデックス・キャッシュに当たると減る)
+        "search_model_calls": runner.calls - runner.style_calls - calls_before,
+        # Linux の ru_maxrss は KiB
+        "peak_rss_mib": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "rss_before_load_mib": round(rss_before / 1024, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--agent-latency", type=float, default=0.2)
+    parser.add_argument("--agent-jitter", type=float, default=0.05)
+    parser.add_argument("--storage-latency", type=float, default=0.005)
+    parser.add_argument("--fetch-latency", type=float, default=0.02)
+    parser.add_argument(
+        "--distinct",
+        type=int,
+        default=0,
+        help="異なる参考画像の数 (0 ならリクエストごとに別の画像)",
+    )
+    parser.add_argument("--image-size", default="1600x1200")
+    parser.add_argument("--destination", default="Bali")
+    parser.add_argument(
+        "--destinations",
+        type=int,
+        default=0,
+        help="異なる目的地の数 (0 ならリクエストごとに別の目的地)",
+    )
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    print(
+        f"requests={report['requests']} concurrency={report['concurrency']} "
+        f"agent latency={report['agent_latency_ms']:.0f}ms"
+    )
+    print(f"  throughput : {report['throughput_rps']:8.1f} req/s")
+    print(f"  p50        : {report['p50_ms']:8.1f} ms")
+    print(f"  p95        : {report['p95_ms']:8.1f} ms")
+    print(f"  p99        : {report['p99_ms']:8.1f} ms")
+    print(f"  statuses   : {report['statuses']}")
+    print(f"  results/req: {report['results_per_request']:8.2f}")
+    print(f"  model calls: {report['search_model_calls']:8d}")
+    print(f"  peak RSS   : {report['peak_rss_mib']:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+リクエストあたりのログ出力コストのベンチマーク
+
+変更前のログ (DEBUG レベル、f-string で 40 行前後、レスポンス全体のダンプ) と、
+変更後のログ (INFO レベル、遅延フォーマット、ペイロードのサンプリング、
+リクエストごとに 1 件の JSON レコード) を、検索 1 回分の呼び出し列で比較する。
+出力先は /dev/null で、フォーマットと書き込みのコストだけを測る。
+
+    uv run python -m bench.bench_logging --requests 2000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import TextIO
+
+from app.logs import (
+    JsonFormatter,
+    RequestLogMiddleware,
+    add_fields,
+    log_payload,
+)
+from app.metrics import stage
+from app.models import ImageResult, SearchResponse
+
+logger = logging.getLogger("bench.search")
+
+RESULTS = [
+    ImageResult(
+        image_url=f"gs://bench-bucket/images/20250101_000000/instagram_p{i}.jpg",
+        instagram_url=f"https://instagram.com/photographer_{i}",
+    )
+    for i in range(9)
+]
+RESPONSE = SearchResponse(images=RESULTS)
+AGENT_JSON = json.dumps(
+    {"images": [r.model_dump(mode="json", by_alias=True) for r in RESULTS]}
+)
+PROMPT = (
+    "Please help me find photographers in Kyoto who can communicate in japanese." * 4
+)
+
+
+def _before(destination: str, language: str) -> None:
+    """変更前の 1 リクエスト分のログ呼び出し (主要なものを抜粋)"""
+    logger.info("=== Search photographers endpoint called ===")
+    logger.info(f"Request destination: {destination}")
+    logger.info(f"Request language: {language}")
+    logger.info(f"Request image length: {len(AGENT_JSON) * 100}")
+    logger.info("PhotographerSearchService initialized")
+    logger.info(f"Image decoded successfully, size: {len(AGENT_JSON) * 75} bytes")
+    logger.info("Step 1: Uploading reference image to Cloud Storage")
+    logger.info(f"Image uploaded successfully: {RESULTS[0].image_url}")
+    logger.info(f"Search prompt created: {PROMPT[:200]}...")
+    logger.info("Step 3: Calling AI agent")
+    logger.info(f"Input prompt: {PROMPT[:200]}...")
+    logger.info(f"Final JSON response: {AGENT_JSON}")
+    logger.info(f"Agent response received: {AGENT_JSON[:200]}...")
+    logger.info(f"Response type: {type(AGENT_JSON)}")
+    logger.info(f"Response content: {repr(AGENT_JSON)}")
+    data = json.loads(AGENT_JSON)
+    logger.info(f"Parsed data: {data}")
+    for i, item in enumerate(data["images"]):
+        logger.info(f"Processing image {i + 1}: {item}")
+        logger.info(f"Getting Instagram URL from storage path: {item['instagramUrl']}")
+        logger.info(f"Added result {i + 1}: {item['imageUrl']}")
+    for i, result in enumerate(RESULTS):
+        logger.info(f"Result {i + 1}:")
+        logger.info(f"  - Image URL: {result.image_url}")
+        logger.info(f"  - Instagram URL: {result.instagram_url}")
+    logger.info(f"Full response data: {RESPONSE.model_dump()}")
+    logger.info("=== END API RESPONSE ===")
+
+
+def _after(destination: str, language: str) -> None:
+    """変更後の 1 リクエスト分のログ呼び出し"""
+    logger.debug("Starting search: destination=%s, language=%s", destination, language)
+    with stage("normalize"):
+        logger.debug("Image normalized: %d -> %d bytes", 100000, 15000)
+    with stage("upload"):
+        logger.debug("Reference image uploaded: %s", RESULTS[0].image_url)
+    with stage("agent"):
+        add_fields(photographers=len(RESULTS), fetched=len(RESULTS))
+        log_payload(logger, "Final JSON response: %s", lambda: AGENT_JSON)
+    with stage("parse"):
+        data = json.loads(AGENT_JSON)
+        for item in data["images"]:
+            logger.debug("Storage file does not exist: %s", item["instagramUrl"])
+        logger.debug("Parsed %d results", len(data["images"]))
+    add_fields(cacheHit=False, results=len(RESULTS))
+    log_payload(logger, "Full response data: %s", RESPONSE.model_dump)
+
+
+def _configure(
+    level: int, formatter: logging.Formatter, stream: TextIO
+) -> logging.Handler:
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(formatter)
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    return handler
+
+
+async def _run(requests: int, body) -> float:
+    async def app(scope, receive, send):
+        body("Kyoto", "japanese")
+        await send({"type": "http.response.start", "status": 200})
+
+    async def send(message):
+        pass
+
+    middleware = RequestLogMiddleware(app)
+    scope = {"type": "http", "method": "POST", "path": "/searchPhotographers"}
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await middleware(scope, None, send)
+    return time.perf_counter() - started
+
+
+def main(requests: int) -> None:
+    text = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    with open(os.devnull, "w") as devnull:
+        _configure(logging.DEBUG, text, devnull)
+        before = asyncio.run(_run(requests, _before))
+
+        _configure(logging.INFO, JsonFormatter(), devnull)
+        after = asyncio.run(_run(requests, _after))
+
+    print(f"requests={requests}")
+    print(f"  before (DEBUG, f-string) : {before / requests * 1e6:8.1f} us/request")
+    print(f"  after  (INFO, JSON x1)   : {after / requests * 1e6:8.1f} us/request")
+    print(f"  speedup                  : {before / after:8.1f} x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.requests)
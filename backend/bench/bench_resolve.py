@@ -0,0 +1,83 @@
+"""
+Instagram URL 参照の解決ベンチマーク
+
+1 件ずつ exists() → download_text() する従来の方法と、
+_resolve_instagram_urls() でまとめて並行に解決する方法を比較する。
+
+    uv run python -m bench.bench_resolve --latency 0.05 --items 9
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.resources import Resources
+from app.services import PhotographerSearchService
+from app.storage import LocalBackend, StorageGateway
+
+BUCKET = "bench-bucket"
+
+
+async def _per_item(gateway: StorageGateway, storage_paths):
+    """変更前の方法: 1 件ごとに存在確認とダウンロードを順番に行う"""
+    urls = []
+    for storage_path in storage_paths:
+        file_path = gateway.path_from_url(storage_path)
+        if await gateway.exists(file_path):
+            data = json.loads(await gateway.download_text(file_path))
+            urls.append(data["instagram_url"])
+        else:
+            username = file_path.split("/")[-1].replace(".json", "")
+            urls.append(f"https://instagram.com/{username}")
+    return urls
+
+
+async def _prepare(gateway: StorageGateway, items: int):
+    storage_paths = []
+    for i in range(items):
+        path = f"instagram_urls/photographer{i}.json"
+        # 半分だけ実体を置き、残りはフォールバックさせる
+        if i % 2 == 0:
+            body = json.dumps({"instagram_url": f"https://instagram.com/p{i}"})
+            await gateway.upload_bytes(path, body.encode(), "application/json")
+        storage_paths.append(gateway.url_for(path))
+    return storage_paths
+
+
+async def main(latency: float, items: int, rounds: int) -> None:
+    gateway = StorageGateway(LocalBackend(BUCKET), max_concurrency=16)
+    storage_paths = await _prepare(gateway, items)
+    gateway.backend._latency = latency
+
+    service = PhotographerSearchService(Resources(storage_factory=lambda: gateway))
+
+    timings = {"per_item": [], "batched": []}
+    for _ in range(rounds):
+        started = time.perf_counter()
+        expected = await _per_item(gateway, storage_paths)
+        timings["per_item"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        actual = await service._resolve_instagram_urls(storage_paths)
+        timings["batched"].append(time.perf_counter() - started)
+        assert actual == expected
+
+    print(f"items={items} latency={latency * 1000:.0f}ms rounds={rounds}")
+    for name, values in timings.items():
+        print(f"  {name:>8}: median {statistics.median(values) * 1000:8.1f} ms")
+    speedup = statistics.median(timings["per_item"]) / statistics.median(
+        timings["batched"]
+    )
+    print(f"  speedup : {speedup:.1f}x")
+    gateway.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--items", type=int, default=9)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.items, args.rounds))
@@ -0,0 +1,79 @@
+"""
+スタイル索引のベンチマーク
+
+写真家の画像の埋め込み計算、索引への追加、目的地で絞り込んだ上位 k 件の検索に
+かかる時間を表示する (エージェントに画像のスタイル分析を頼む往復の代わり)。
+
+    uv run python -m bench.bench_style --photographers 5000 --destinations 50
+"""
+
+import argparse
+import io
+import random
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.style_index import EMBEDDING_DIM, StyleIndex, style_embedding
+
+
+def _image(seed: int) -> bytes:
+    rng = random.Random(seed)
+    size = (400, 400)
+    image = Image.effect_noise(size, rng.uniform(10, 60)).convert("RGB")
+    color = tuple(rng.randrange(256) for _ in range(3))
+    image = Image.blend(image, Image.new("RGB", size, color), 0.6)
+    output = io.BytesIO()
+    image.save(output, format="JPEG")
+    return output.getvalue()
+
+
+def main(photographers: int, destinations: int, queries: int, k: int) -> None:
+    samples = [_image(i) for i in range(32)]
+    started = time.perf_counter()
+    vectors = [style_embedding(sample) for sample in samples]
+    embed = (time.perf_counter() - started) / len(samples)
+
+    rng = np.random.default_rng(0)
+    noise = rng.normal(scale=0.05, size=(photographers, EMBEDDING_DIM))
+    with tempfile.TemporaryDirectory() as tmp:
+        index = StyleIndex(f"{tmp}/styles")
+        started = time.perf_counter()
+        for i in range(photographers):
+            vector = vectors[i % len(vectors)] + noise[i].astype(np.float32)
+            index.add(
+                f"destination {i % destinations}",
+                "english",
+                f"photographer_{i}",
+                f"gs://bench/{i}.jpg",
+                vector / np.linalg.norm(vector),
+            )
+        add = (time.perf_counter() - started) / photographers
+
+        started = time.perf_counter()
+        for i in range(queries):
+            index.search(
+                vectors[i % len(vectors)],
+                f"destination {i % destinations}",
+                "english",
+                k,
+            )
+        search = (time.perf_counter() - started) / queries
+        index.close()
+
+    print(f"photographers={photographers} destinations={destinations} k={k}")
+    print(f"  embedding (400x400) : {embed * 1000:8.2f} ms/image")
+    print(f"  add (memmap)        : {add * 1e6:8.1f} us/image")
+    print(f"  top-{k} search       : {search * 1e6:8.1f} us/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photographers", type=int, default=5000)
+    parser.add_argument("--destinations", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=6)
+    args = parser.parse_args()
+    main(args.photographers, args.destinations, args.queries, args.k)
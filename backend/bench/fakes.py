@@ -0,0 +1,92 @@
+"""
+ベンチマーク用の Gemini (ADK Runner) の代替
+"""
+
+import asyncio
+import random
+import time
+
+from google.adk.events import Event
+from google.genai import types
+
+DEFAULT_USERNAMES = [
+    "bali_wedding_photo",
+    "ubud_love_stories",
+    "seminyak_shoots",
+    "island_bride_films",
+    "tropical_moments_bali",
+    "uluwatu_portraits",
+]
+
+DEFAULT_STYLE_DESCRIPTION = "bright natural light, soft pastel tones, candid portraits"
+
+
+def _final_event(text: str, partial: bool = False) -> Event:
+    return Event(
+        author="photographer_search_agent",
+        partial=partial or None,
+        content=types.Content(role="model", parts=[types.Part(text=text)]),
+    )
+
+
+def _is_style_analysis(new_message) -> bool:
+    text = (new_message.parts[0].text or "") if new_message.parts else ""
+    return "analyze the photography style" in text
+
+
+class FakeRunner:
+    """指定した遅延の後に固定の応答を返す ADK Runner の代替
+
+    画像スタイルの分析にはスタイルの説明を、それ以外にはユーザー名の一覧を返す。
+
+    run_async() は非同期に待ち、run() は (従来の同期 API と同じく)
+    スレッドを止めて待つ。
+    run_async() に SSE のストリーミングを指定すると、応答を 1 行ずつ部分応答として返す。
+    jitter を指定すると遅延を latency ± jitter の一様分布にする (seed で再現可能)。
+    """
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        usernames: list[str] = None,
+        jitter: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.text = "\n".join(usernames or DEFAULT_USERNAMES)
+        self.calls = 0
+        self.style_calls = 0
+        self._random = random.Random(seed)
+
+    def _delay(self) -> float:
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _response(self, new_message) -> str:
+        self.calls += 1
+        if _is_style_analysis(new_message):
+            self.style_calls += 1
+            return DEFAULT_STYLE_DESCRIPTION
+        return self.text
+
+    async def run_async(
+        self, *, user_id, session_id, new_message, run_config=None, **kwargs
+    ):
+        text = self._response(new_message)
+        delay = self._delay()
+        if run_config is not None and run_config.streaming_mode.value == "sse":
+            # ストリーミングでは 1 行ずつ、遅延を行数で割った間隔で部分応答を返す
+            lines = text.splitlines(keepends=True)
+            for line in lines:
+                await asyncio.sleep(delay / len(lines))
+                yield _final_event(line, partial=True)
+        else:
+            await asyncio.sleep(delay)
+        yield _final_event(text)
+
+    def run(self, *, user_id, session_id, new_message, **kwargs):
+        text = self._response(new_message)
+        time.sleep(self._delay())
+        yield _final_event(text)
@@ -0,0 +1,218 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.admission import AdmissionController, RejectedError, TokenBucket
+from app.metrics import ADMISSION_REJECTED
+from app.resources import Resources, get_resources
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket:
+    def test_allows_burst_then_refills_at_rate(self):
+        bucket = TokenBucket(rate=2, burst=3, now=0)
+
+        assert [bucket.take(0)[0] for _ in range(4)] == [True, True, True, False]
+        allowed, retry_after = bucket.take(0)
+        assert not allowed
+        assert retry_after == pytest.approx(0.5)
+        assert bucket.take(0.5) == (True, 0.0)
+
+
+class TestAdmissionController:
+    def test_limits_in_flight_and_queues_the_rest(self):
+        controller = AdmissionController(max_in_flight=2, max_queue=4, queue_timeout=1)
+        peak = 0
+
+        async def search():
+            nonlocal peak
+            async with controller.admit("client"):
+                peak = max(peak, controller.in_flight)
+                await asyncio.sleep(0.01)
+
+        async def scenario():
+            await asyncio.gather(*(search() for _ in range(5)))
+
+        asyncio.run(scenario())
+        assert peak == 2
+        assert controller.stats()["admitted"] == 5
+        assert controller.in_flight == controller.queued == 0
+
+    def test_try_acquire_does_not_wait(self):
+        controller = AdmissionController(max_in_flight=1)
+
+        async def scenario():
+            assert await controller.try_acquire()
+            assert not await controller.try_acquire()
+            controller.release()
+            assert await controller.try_acquire()
+            controller.release()
+
+        asyncio.run(scenario())
+        assert controller.stats()["admitted"] == 2
+        assert controller.in_flight == controller.queued == 0
+
+    def test_rejects_when_queue_is_full(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=1)
+        rejected = ADMISSION_REJECTED.value(reason="queue_full")
+
+        async def scenario():
+            await controller.acquire("a")
+            waiter = asyncio.create_task(controller.acquire("b"))
+            await asyncio.sleep(0)
+            with pytest.raises(RejectedError) as e:
+                await controller.acquire("c")
+            controller.release()
+            await waiter
+            controller.release()
+            return e.value
+
+        error = asyncio.run(scenario())
+        assert error.status_code == 503
+        assert error.retry_after_header == "1"
+        assert ADMISSION_REJECTED.value(reason="queue_full") == rejected + 1
+
+    def test_queue_wait_has_a_deadline(self):
+        controller = AdmissionController(
+            max_in_flight=1, max_queue=4, queue_timeout=0.02
+        )
+
+        async def scenario():
+            await controller.acquire("a")
+            with pytest.raises(RejectedError) as e:
+                await controller.acquire("b")
+            return e.value
+
+        error = asyncio.run(scenario())
+        assert (error.status_code, error.reason) == (503, "queue_timeout")
+        assert controller.queued == 0
+
+    def test_rate_limits_each_client_separately(self):
+        clock = _Clock()
+        controller = AdmissionController(rate=1, burst=2, clock=clock)
+
+        async def scenario():
+            for _ in range(2):
+                async with controller.admit("a"):
+                    pass
+            with pytest.raises(RejectedError) as e:
+                await controller.acquire("a")
+            # 他のクライアントは影響を受けない
+            async with controller.admit("b"):
+                pass
+            clock.now += 1
+            async with controller.admit("a"):
+                pass
+            return e.value
+
+        error = asyncio.run(scenario())
+        assert (error.status_code, error.reason) == (429, "rate_limited")
+        assert error.retry_after_header == "1"
+        assert controller.in_flight == 0
+
+    def test_job_slot_waits_without_rate_or_queue_limits(self):
+        controller = AdmissionController(
+            max_in_flight=1, max_queue=0, queue_timeout=0.01, rate=0.1, burst=1
+        )
+
+        async def scenario():
+            order = []
+
+            async def job(name):
+                async with controller.slot():
+                    order.append(name)
+                    await asyncio.sleep(0.02)
+
+            async with controller.admit("a"):
+                waiting = asyncio.create_task(job("job"))
+                await asyncio.sleep(0.05)
+                # 枠が空くまで待ち、待ち行列の期限で断られない
+                assert not waiting.done()
+                order.append("search")
+            await waiting
+            return order
+
+        assert asyncio.run(scenario()) == ["search", "job"]
+        assert (controller.admitted, controller.in_flight) == (2, 0)
+
+
+class TestAdmissionEndpoint:
+    def test_rejected_search_returns_retry_after(self):
+        from app.app import app
+
+        resources = Resources(
+            admission_factory=lambda: AdmissionController(rate=0.1, burst=1)
+        )
+        app.dependency_overrides[get_resources] = lambda: resources
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                body = {
+                    "destination": "Bali",
+                    "preferredLanguage": "klingon",
+                    "referenceImage": "data:image/jpeg;base64,AA==",
+                }
+                first = await client.post("/searchPhotographers", json=body)
+                second = await client.post("/searchPhotographers", json=body)
+                return first, second
+
+        try:
+            first, second = asyncio.run(scenario())
+        finally:
+            app.dependency_overrides.clear()
+
+        # 1 件目は受け付けられ (言語の検証で 400)、2 件目はレート制限で断られる
+        assert first.status_code == 400
+        assert second.status_code == 429
+        assert second.headers["retry-after"] == "10"
+        assert resources.admission.in_flight == 0
+
+    def test_spoofed_forwarded_hop_does_not_get_fresh_bucket(self, monkeypatch):
+        from app.app import app
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "TRUSTED_PROXY_HOPS", 1)
+        resources = Resources(
+            admission_factory=lambda: AdmissionController(rate=0.1, burst=1)
+        )
+        app.dependency_overrides[get_resources] = lambda: resources
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                body = {
+                    "destination": "Bali",
+                    "preferredLanguage": "klingon",
+                    "referenceImage": "data:image/jpeg;base64,AA==",
+                }
+                responses = []
+                # 先頭を書き換えても、プロキシが付けた末尾 (実際の接続元) は同じ
+                for spoofed in ("1.1.1.1", "2.2.2.2"):
+                    headers = {"X-Forwarded-For": f"{spoofed}, 203.0.113.7"}
+                    responses.append(
+                        await client.post(
+                            "/searchPhotographers", json=body, headers=headers
+                        )
+                    )
+                return responses
+
+        try:
+            first, second = asyncio.run(scenario())
+        finally:
+            app.dependency_overrides.clear()
+
+        assert first.status_code == 400
+        assert second.status_code == 429
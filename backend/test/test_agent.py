@@ -1,14 +1,139 @@
+import asyncio
+
 import pytest
+from google.adk.events import Event
+from google.adk.runners import Runner
+from google.genai import types
 
-from app.agent import root_agent
+from app.agent import agent, root_agent
+from app.agent.agent import analyze_image_style, search_photographer_on_instagram
+from app.agent.policy import Route
+from app.config import settings
 
 
 class TestAgent:
     def test_agent_info(self):
         assert root_agent.name == "photographer_search_agent"
-        assert (
-            root_agent.description
-            == "Agent that provides photographer search information for specific destination on Instagram."
+        assert root_agent.description.startswith(
+            "AI agent that helps find photographers for destination photography"
+        )
+        # 起動時に共有クライアント付きの Gemini に差し替えられている場合もある
+        assert root_agent.canonical_model.model == settings.AGENT_MODEL
+        assert root_agent.tools == [
+            search_photographer_on_instagram,
+            analyze_image_style,
+        ]
+
+
+class _SlowRunner:
+    def __init__(self, latency):
+        self.latency = latency
+        self.cancelled = False
+        self.messages = []
+
+    async def run_async(self, *, user_id, session_id, new_message, **kwargs):
+        self.messages.append(new_message)
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        yield Event(
+            author="photographer_search_agent",
+            content=types.Content(role="model", parts=[types.Part(text="user001")]),
+        )
+
+
+class TestCallAgent:
+    def test_returns_final_response(self, monkeypatch):
+        monkeypatch.setattr(agent, "runner", _SlowRunner(0.01))
+
+        assert asyncio.run(agent.call_agent("query")) == "user001"
+
+    def test_timeout_cancels_agent_call(self, monkeypatch):
+        runner = _SlowRunner(1.0)
+        monkeypatch.setattr(agent, "runner", runner)
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(agent.call_agent("query", timeout=0.05))
+        assert runner.cancelled
+
+    def test_image_is_attached_to_message(self, monkeypatch):
+        runner = _SlowRunner(0.01)
+        monkeypatch.setattr(agent, "runner", runner)
+
+        asyncio.run(agent.call_agent("query", image=(b"\xff\xd8\xff", "image/jpeg")))
+
+        text, image = runner.messages[0].parts
+        assert text.text == "query"
+        assert image.inline_data.data == b"\xff\xd8\xff"
+        assert image.inline_data.mime_type == "image/jpeg"
+
+
+class TestRouteRunner:
+    def test_route_runner_uses_same_agent_with_route_model(self, monkeypatch):
+        agent._runtime()
+        monkeypatch.setattr(
+            agent,
+            "runner",
+            Runner(
+                agent=root_agent,
+                app_name="photographer-search",
+                session_service=agent.session_service,
+            ),
+        )
+        monkeypatch.setattr(agent, "_route_runners", {})
+        monkeypatch.setattr(agent, "_llm_for", None)
+
+        route_runner = agent._runner_for(Route("fallback", "gemini-2.5-flash-lite"))
+
+        assert route_runner is not agent.runner
+        assert route_runner.agent.model == "gemini-2.5-flash-lite"
+        assert route_runner.agent.name == root_agent.name
+        assert route_runner.agent.tools == root_agent.tools
+        # 同じ経路は生成済みの Runner を使う
+        assert agent._runner_for(Route("fallback", "gemini-2.5-flash-lite")) is (
+            route_runner
+        )
+
+
+class _StreamingRunner:
+    def __init__(self, chunks, partial=True):
+        self.chunks = chunks
+        self.partial = partial
+        self.run_config = None
+
+    async def run_async(self, *, user_id, session_id, new_message, run_config=None):
+        self.run_config = run_config
+        if self.partial:
+            for chunk in self.chunks:
+                yield Event(
+                    author="photographer_search_agent",
+                    partial=True,
+                    content=types.Content(role="model", parts=[types.Part(text=chunk)]),
+                )
+        yield Event(
+            author="photographer_search_agent",
+            content=types.Content(
+                role="model", parts=[types.Part(text="".join(self.chunks))]
+            ),
         )
-        assert root_agent.model == "gemini-2.5-flash"
-        assert root_agent.tools == [search_photographer_on_instagram]
+
+
+class TestStreamAgent:
+    async def _collect(self, query):
+        return [chunk async for chunk in agent.stream_agent(query)]
+
+    def test_yields_partial_chunks_without_repeating_final_text(self, monkeypatch):
+        runner = _StreamingRunner(["user001\nuse", "r002\n"])
+        monkeypatch.setattr(agent, "runner", runner)
+
+        assert asyncio.run(self._collect("query")) == ["user001\nuse", "r002\n"]
+        assert runner.run_config.streaming_mode.value == "sse"
+
+    def test_falls_back_to_final_response(self, monkeypatch):
+        monkeypatch.setattr(
+            agent, "runner", _StreamingRunner(["user001\nuser002"], partial=False)
+        )
+
+        assert asyncio.run(self._collect("query")) == ["user001\nuser002"]
@@ -0,0 +1,112 @@
+import asyncio
+
+from app.admission import AdmissionController
+from app.cache import InMemoryRedis, TTLCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache:
+    def test_hit_miss_and_lru_eviction(self):
+        cache = TTLCache("t", max_size=2, ttl=60)
+
+        async def scenario():
+            await cache.set("a", 1)
+            await cache.set("b", 2)
+            assert await cache.get("a") == 1  # a を最近使ったことにする
+            await cache.set("c", 3)  # b が追い出される
+            assert await cache.get("b") is None
+            assert await cache.get("c") == 3
+
+        asyncio.run(scenario())
+        assert cache.stats()["hits"] == 2
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["evictions"] == 1
+
+    def test_entries_expire_after_ttl(self):
+        clock = _Clock()
+        cache = TTLCache("t", ttl=10, clock=clock)
+
+        async def scenario():
+            await cache.set("a", 1)
+            clock.now += 11
+            return await cache.get("a")
+
+        assert asyncio.run(scenario()) is None
+
+    def test_stale_while_revalidate(self):
+        clock = _Clock()
+        cache = TTLCache("t", ttl=10, stale_ttl=100, clock=clock)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return len(calls)
+
+        async def scenario():
+            assert await cache.get_or_compute("k", compute) == 1
+            clock.now += 20
+            # 期限切れでも古い値をすぐ返し、裏で更新する
+            assert await cache.get_or_compute("k", compute) == 1
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            assert await cache.get_or_compute("k", compute) == 2
+
+        asyncio.run(scenario())
+        assert cache.stats()["stale_hits"] == 1
+        assert cache.stats()["refreshes"] == 1
+
+    def test_refresh_takes_an_admission_slot(self):
+        clock = _Clock()
+        cache = TTLCache("t", ttl=10, stale_ttl=100, clock=clock)
+        admission = AdmissionController(max_in_flight=1)
+        in_flight = []
+
+        async def compute():
+            in_flight.append(admission.in_flight)
+            return len(in_flight)
+
+        async def scenario():
+            await cache.get_or_compute("k", compute)
+            clock.now += 20
+            await admission.acquire("client")
+            # 枠が埋まっている間は更新を見送る
+            assert await cache.get_or_compute("k", compute, admission=admission) == 1
+            await asyncio.sleep(0)
+            admission.release()
+            assert await cache.get_or_compute("k", compute, admission=admission) == 1
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            return await cache.get_or_compute("k", compute, admission=admission)
+
+        assert asyncio.run(scenario()) == 2
+        assert in_flight == [0, 1]
+        assert admission.in_flight == 0
+        assert cache.stats()["skipped_refreshes"] == 1
+        assert cache.stats()["refreshes"] == 1
+
+    def test_empty_results_are_not_cached(self):
+        cache = TTLCache("t", ttl=60)
+
+        async def scenario():
+            await cache.get_or_compute("k", lambda: asyncio.sleep(0, []), bool)
+            return await cache.get("k")
+
+        assert asyncio.run(scenario()) is None
+
+    def test_backend_is_shared_between_instances(self):
+        backend = InMemoryRedis()
+        first = TTLCache("t", ttl=60, backend=backend)
+        second = TTLCache("t", ttl=60, backend=backend)
+
+        async def scenario():
+            await first.set("k", [{"imageUrl": "https://example.com/a.jpg"}])
+            return await second.get("k")
+
+        assert asyncio.run(scenario()) == [{"imageUrl": "https://example.com/a.jpg"}]
@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+import pytest
+
+from app.fanout import iter_bounded_stream
+
+
+async def _sleep_and_return(delay: float, value: str, running: list = None):
+    if running is not None:
+        running.append(1)
+        assert len(running) <= 2
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        if running is not None:
+            running.pop()
+    return value
+
+
+def _bounded(items, fn, **kwargs):
+    """items を非同期のソースとして iter_bounded_stream に渡し、結果を入力順に並べる
+
+    失敗・期限切れの要素は None にする。
+    """
+
+    async def source():
+        for item in items:
+            yield item
+
+    async def scenario():
+        results = [None] * len(items)
+        async for index, result in iter_bounded_stream(source(), fn, **kwargs):
+            results[index] = result
+        return results
+
+    return asyncio.run(scenario())
+
+
+class TestIterBounded:
+    def test_results_keep_input_index(self):
+        delays = {"a": 0.05, "b": 0.01, "c": 0.03}
+
+        results = _bounded(
+            list(delays), lambda k: _sleep_and_return(delays[k], k), limit=3
+        )
+
+        assert results == ["a", "b", "c"]
+
+    def test_concurrency_is_limited(self):
+        running = []
+
+        started = time.perf_counter()
+        results = _bounded(
+            ["a", "b", "c", "d"],
+            lambda k: _sleep_and_return(0.05, k, running),
+            limit=2,
+        )
+        elapsed = time.perf_counter() - started
+
+        assert results == ["a", "b", "c", "d"]
+        assert 0.1 <= elapsed < 0.2
+
+    def test_item_timeout_drops_only_slow_items(self):
+        delays = {"fast": 0.01, "slow": 1.0, "ok": 0.02}
+
+        results = _bounded(
+            list(delays),
+            lambda k: _sleep_and_return(delays[k], k),
+            limit=3,
+            item_timeout=0.1,
+        )
+
+        assert results == ["fast", None, "ok"]
+
+    def test_total_timeout_returns_partial_results(self):
+        delays = {"a": 0.01, "b": 1.0, "c": 1.0}
+
+        started = time.perf_counter()
+        results = _bounded(
+            list(delays),
+            lambda k: _sleep_and_return(delays[k], k),
+            limit=3,
+            total_timeout=0.1,
+        )
+
+        assert results == ["a", None, None]
+        assert time.perf_counter() - started < 0.5
+
+    def test_failures_are_skipped(self):
+        async def fail_on_b(k):
+            if k == "b":
+                raise ValueError(k)
+            return k
+
+        assert _bounded(["a", "b"], fail_on_b, limit=2) == ["a", None]
+
+
+class TestIterBoundedStream:
+    def test_items_start_before_source_is_exhausted(self):
+        events = []
+
+        async def source():
+            for name in ["a", "b"]:
+                events.append(f"produced {name}")
+                yield name
+                await asyncio.sleep(0.05)
+            events.append("exhausted")
+
+        async def fetch(name):
+            events.append(f"fetched {name}")
+            return name.upper()
+
+        async def scenario():
+            return [
+                item async for item in iter_bounded_stream(source(), fetch, limit=2)
+            ]
+
+        results = asyncio.run(scenario())
+
+        assert results == [(0, "A"), (1, "B")]
+        # 1 件目の処理は、ソースが 2 件目を生成する前に終わる
+        assert events.index("fetched a") < events.index("produced b")
+
+    def test_total_timeout_counts_from_exhausted_source(self):
+        async def source():
+            yield 0.01
+            await asyncio.sleep(0.05)
+            yield 1.0
+
+        async def scenario():
+            return [
+                item
+                async for item in iter_bounded_stream(
+                    source(),
+                    lambda d: _sleep_and_return(d, d),
+                    limit=2,
+                    total_timeout=0.03,
+                )
+            ]
+
+        assert asyncio.run(scenario()) == [(0, 0.01)]
+
+    def test_source_failure_is_raised_after_items_already_received(self):
+        received = []
+
+        async def source():
+            yield "a"
+            raise TimeoutError
+
+        async def scenario():
+            async for item in iter_bounded_stream(
+                source(), lambda k: _sleep_and_return(0.01, k), limit=2
+            ):
+                received.append(item)
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(scenario())
+        assert received == [(0, "a")]
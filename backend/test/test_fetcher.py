@@ -0,0 +1,195 @@
+import asyncio
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from app.fetcher import FetchTooLargeError, ImageFetcher
+from app.storage import LocalBackend, StorageGateway
+
+IMAGE = bytes(range(256)) * 1024  # 256 KiB
+
+
+class _StubServer:
+    """ローカルの HTTP スタブサーバー (パスごとに応答を変える)"""
+
+    def __init__(self):
+        self.requests = []
+        self.connections = set()
+        self.active = 0
+        self.max_active = 0
+        self.failures_left = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests.append(self.path)
+                    stub.connections.add(self.client_address)
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                try:
+                    stub.handle(self)
+                finally:
+                    with stub._lock:
+                        stub.active -= 1
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.01,), daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def handle(self, request: BaseHTTPRequestHandler) -> None:
+        if request.path == "/flaky" and self.failures_left > 0:
+            self.failures_left -= 1
+            self._send(request, 503, b"busy")
+        elif request.path == "/missing":
+            self._send(request, 404, b"not found")
+        elif request.path == "/slow":
+            time.sleep(0.05)
+            self._send(request, 200, IMAGE)
+        else:
+            self._send(request, 200, IMAGE)
+
+    def _send(self, request, status: int, body: bytes) -> None:
+        request.send_response(status)
+        request.send_header("Content-Type", "image/jpeg")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+async def _no_sleep(seconds: float) -> None:
+    pass
+
+
+def _fetch(fn, **kwargs):
+    async def scenario():
+        async with httpx.AsyncClient() as client:
+            fetcher = ImageFetcher(
+                client, rng=random.Random(0), sleep=_no_sleep, **kwargs
+            )
+            return await fn(fetcher), fetcher
+
+    return asyncio.run(scenario())
+
+
+class TestImageFetcher:
+    def test_streams_body_and_reuses_connection(self):
+        with _StubServer() as server:
+
+            async def fetch(fetcher):
+                return [
+                    (await fetcher.download(f"{server.url}/a.jpg")).getvalue()
+                    for _ in range(3)
+                ]
+
+            bodies, fetcher = _fetch(fetch, chunk_size=4096)
+
+        assert bodies == [IMAGE] * 3
+        # keep-alive で 1 本の接続を使い回す
+        assert len(server.connections) == 1
+        assert fetcher.stats()["bytes"] == 3 * len(IMAGE)
+
+    def test_retries_server_errors(self):
+        with _StubServer() as server:
+            server.failures_left = 2
+
+            async def fetch(fetcher):
+                return (await fetcher.download(f"{server.url}/flaky")).getvalue()
+
+            body, fetcher = _fetch(fetch, retries=2)
+
+        assert body == IMAGE
+        assert server.requests == ["/flaky"] * 3
+        assert fetcher.stats()["retried"] == 2
+
+    def test_gives_up_after_retries(self):
+        with _StubServer() as server:
+            server.failures_left = 5
+
+            async def fetch(fetcher):
+                with pytest.raises(httpx.HTTPStatusError):
+                    await fetcher.download(f"{server.url}/flaky")
+
+            _, fetcher = _fetch(fetch, retries=1)
+
+        assert len(server.requests) == 2
+        assert fetcher.stats()["failures"] == 1
+
+    def test_client_errors_are_not_retried(self):
+        with _StubServer() as server:
+
+            async def fetch(fetcher):
+                with pytest.raises(httpx.HTTPStatusError):
+                    await fetcher.download(f"{server.url}/missing")
+
+            _fetch(fetch, retries=3)
+
+        assert server.requests == ["/missing"]
+
+    def test_rejects_bodies_over_max_bytes(self):
+        with _StubServer() as server:
+
+            async def fetch(fetcher):
+                with pytest.raises(FetchTooLargeError):
+                    await fetcher.download(f"{server.url}/a.jpg")
+
+            _fetch(fetch, max_bytes=1024)
+
+    def test_limits_concurrent_requests_per_host(self):
+        with _StubServer() as server:
+
+            async def fetch(fetcher):
+                await asyncio.gather(
+                    *(fetcher.download(f"{server.url}/slow") for _ in range(6))
+                )
+
+            _fetch(fetch, per_host_limit=2)
+
+        assert len(server.requests) == 6
+        assert server.max_active <= 2
+
+    def test_backoff_is_jittered_and_capped(self):
+        fetcher = ImageFetcher(
+            httpx.AsyncClient(), backoff=0.2, backoff_max=1.0, rng=random.Random(0)
+        )
+        delays = [fetcher._delay(attempt, None) for attempt in range(6)]
+
+        assert all(0 <= d <= 1.0 for d in delays)
+        assert len(set(delays)) == len(delays)
+
+    def test_downloaded_buffer_uploads_to_storage(self):
+        gateway = StorageGateway(LocalBackend("bucket"))
+        with _StubServer() as server:
+
+            async def fetch(fetcher):
+                body = await fetcher.download(f"{server.url}/a.jpg")
+                return await gateway.upload_file("images/a.jpg", body)
+
+            url, _ = _fetch(fetch)
+
+        assert url == "gs://bucket/images/a.jpg"
+        assert gateway.backend._objects["images/a.jpg"] == IMAGE
@@ -0,0 +1,54 @@
+import io
+
+from PIL import Image
+
+from app.images import (
+    image_mime_type,
+    normalize_image,
+    parse_image_size,
+    perceptual_hash,
+)
+
+
+def _jpeg(width: int, height: int, orientation: int = 1) -> bytes:
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    output = io.BytesIO()
+    image.save(output, format="JPEG", exif=exif)
+    return output.getvalue()
+
+
+class TestImages:
+    def test_parse_image_size(self):
+        assert parse_image_size("400x300") == (400, 300)
+
+    def test_normalize_crops_to_configured_size(self):
+        normalized = normalize_image(_jpeg(1600, 1200), size=(400, 400), mode="crop")
+
+        with Image.open(io.BytesIO(normalized)) as image:
+            assert image.format == "JPEG"
+            assert image.size == (400, 400)
+
+    def test_normalize_applies_exif_orientation(self):
+        # Orientation=6 は 90 度回転して表示される縦長の画像
+        normalized = normalize_image(
+            _jpeg(1600, 1200, orientation=6), size=(400, 400), mode="fit"
+        )
+
+        with Image.open(io.BytesIO(normalized)) as image:
+            assert image.size == (300, 400)
+
+    def test_perceptual_hash_survives_recompression(self):
+        original = _jpeg(800, 600)
+        recompressed = normalize_image(original, size=(400, 300), mode="fit")
+
+        assert perceptual_hash(original) == perceptual_hash(recompressed)
+
+    def test_image_mime_type(self):
+        png = io.BytesIO()
+        Image.new("RGB", (4, 4)).save(png, format="PNG")
+
+        assert image_mime_type(_jpeg(8, 8)) == "image/jpeg"
+        assert image_mime_type(png.getvalue()) == "image/png"
+        assert image_mime_type(b"not an image") == "image/jpeg"
@@ -0,0 +1,145 @@
+import asyncio
+import base64
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.ingest import Base64StreamDecoder, ImageTooLargeError, read_reference_image
+from app.models import ImageResult
+from app.resources import Resources, get_resources
+
+IMAGE = bytes(range(256)) * 40
+
+
+async def _chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+class TestBase64StreamDecoder:
+    @pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 4096])
+    def test_decodes_data_url_across_chunk_boundaries(self, chunk_size):
+        body = b"data:image/jpeg;base64," + base64.b64encode(IMAGE)
+        decoder = Base64StreamDecoder()
+
+        decoded = b"".join(
+            decoder.feed(body[i : i + chunk_size])
+            for i in range(0, len(body), chunk_size)
+        )
+        decoded += decoder.finish()
+
+        assert decoded == IMAGE
+
+    def test_ignores_whitespace_and_missing_padding(self):
+        encoded = base64.b64encode(b"abcde").rstrip(b"=")
+        decoder = Base64StreamDecoder()
+
+        decoded = decoder.feed(encoded[:3] + b"\n" + encoded[3:]) + decoder.finish()
+
+        assert decoded == b"abcde"
+
+    def test_rejects_invalid_characters(self):
+        decoder = Base64StreamDecoder()
+        with pytest.raises(ValueError):
+            decoder.feed(b"!!!!")
+
+
+class TestReadReferenceImage:
+    def test_reads_binary_stream(self):
+        image = asyncio.run(
+            read_reference_image(_chunks(IMAGE, 1000), False, len(IMAGE))
+        )
+        assert image == IMAGE
+
+    def test_reads_base64_stream(self):
+        body = base64.b64encode(IMAGE)
+        image = asyncio.run(read_reference_image(_chunks(body, 333), True, len(IMAGE)))
+        assert image == IMAGE
+
+    def test_rejects_too_large_image(self):
+        with pytest.raises(ImageTooLargeError):
+            asyncio.run(read_reference_image(_chunks(IMAGE, 1000), False, 100))
+
+
+class _RecordingService:
+    def __init__(self):
+        self.images = []
+
+    async def search_with_image(self, destination, language, image_bytes):
+        self.images.append(image_bytes)
+        return [
+            ImageResult(
+                image_url="https://storage.googleapis.com/b/a.jpg",
+                instagram_url="https://instagram.com/a",
+            )
+        ]
+
+
+class TestUploadEndpoint:
+    def _post(self, body, content_type, monkeypatch=None, max_bytes=None):
+        from app.app import app, get_search_service
+
+        if max_bytes is not None:
+            monkeypatch.setattr(settings, "MAX_REFERENCE_IMAGE_BYTES", max_bytes)
+        service = _RecordingService()
+        resources = Resources()
+        app.dependency_overrides[get_resources] = lambda: resources
+        app.dependency_overrides[get_search_service] = lambda: service
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                return await client.post(
+                    "/searchPhotographers/upload",
+                    params={"destination": "Bali", "preferredLanguage": "english"},
+                    content=body,
+                    headers={"content-type": content_type},
+                )
+
+        try:
+            response = asyncio.run(scenario())
+        finally:
+            app.dependency_overrides.clear()
+        assert resources.admission.in_flight == 0
+        return response, service.images
+
+    def test_binary_body(self):
+        response, images = self._post(IMAGE, "image/jpeg")
+
+        assert response.status_code == 200
+        assert response.json()["images"][0]["instagramUrl"] == (
+            "https://instagram.com/a"
+        )
+        assert images == [IMAGE]
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            base64.b64encode(IMAGE),
+            b"data:image/jpeg;base64," + base64.b64encode(IMAGE),
+        ],
+    )
+    def test_base64_and_data_url_body(self, body):
+        response, images = self._post(body, "text/plain")
+
+        assert response.status_code == 200
+        assert images == [IMAGE]
+
+    def test_too_large_image_is_rejected(self, monkeypatch):
+        response, images = self._post(
+            IMAGE, "image/jpeg", monkeypatch, max_bytes=len(IMAGE) - 1
+        )
+
+        assert response.status_code == 413
+        assert response.json()["detail"]["error"] == "Reference image too large"
+        assert images == []
+
+    def test_invalid_base64_is_rejected(self):
+        response, images = self._post(b"not base64!", "text/plain")
+
+        assert response.status_code == 400
+        assert response.json()["detail"]["error"] == "Invalid reference image"
+        assert images == []
@@ -0,0 +1,279 @@
+import asyncio
+import base64
+import io
+
+import httpx
+import pytest
+from PIL import Image
+
+from app.admission import AdmissionController
+from app.agent import agent
+from app.cache import InMemoryRedis
+from app.config import settings
+from app.jobs import InMemoryJobStore, JobManager, JobQueueFullError, RedisJobStore
+from app.resources import Resources, get_resources
+from app.storage import LocalBackend, StorageGateway
+
+IMAGES = [{"imageUrl": "gs://b/a.jpg", "instagramUrl": "https://instagram.com/a/"}]
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def _search(payload):
+    await asyncio.sleep(0.01)
+    if payload == "fail":
+        raise RuntimeError("agent unavailable")
+    return IMAGES
+
+
+class TestJobManager:
+    def test_job_runs_in_background_and_long_poll_returns_result(self):
+        async def scenario():
+            jobs = JobManager(InMemoryJobStore(), _search, workers=2)
+            job = await jobs.submit("bali")
+            assert job["status"] == "queued"
+            done = await jobs.get(job["jobId"], wait=1)
+            await jobs.aclose()
+            return done
+
+        job = asyncio.run(scenario())
+        assert job["status"] == "succeeded"
+        assert job["images"] == IMAGES
+
+    def test_failed_job_records_error(self):
+        async def scenario():
+            jobs = JobManager(InMemoryJobStore(), _search)
+            job = await jobs.submit("fail")
+            done = await jobs.get(job["jobId"], wait=1)
+            await jobs.aclose()
+            return done, jobs.stats()
+
+        job, stats = asyncio.run(scenario())
+        assert job["status"] == "failed"
+        assert job["error"] == "agent unavailable"
+        assert stats["failed"] == 1
+
+    def test_workers_bound_concurrency(self):
+        running = 0
+        peak = 0
+
+        async def search(payload):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return []
+
+        async def scenario():
+            jobs = JobManager(InMemoryJobStore(), search, workers=2)
+            submitted = [await jobs.submit(i) for i in range(6)]
+            for job in submitted:
+                await jobs.get(job["jobId"], wait=1)
+            await jobs.aclose()
+
+        asyncio.run(scenario())
+        assert peak == 2
+
+    def test_rejects_when_too_many_jobs_are_pending(self):
+        async def scenario():
+            jobs = JobManager(InMemoryJobStore(), _search, workers=1, max_pending=1)
+            await jobs.submit("a")
+            await asyncio.sleep(0)  # ワーカーが a を取り出して実行する
+            await jobs.submit("b")
+            with pytest.raises(JobQueueFullError):
+                await jobs.submit("c")
+            await jobs.aclose()
+
+        asyncio.run(scenario())
+
+    def test_short_poll_returns_current_status(self):
+        async def scenario():
+            jobs = JobManager(InMemoryJobStore(), _search)
+            job = await jobs.submit("bali")
+            current = await jobs.get(job["jobId"])
+            await jobs.aclose()
+            return current
+
+        assert asyncio.run(scenario())["status"] in ("queued", "running")
+
+
+class TestJobStores:
+    def test_in_memory_jobs_expire_after_ttl(self):
+        clock = _Clock()
+        store = InMemoryJobStore(clock=clock)
+
+        async def scenario():
+            await store.put({"jobId": "a"}, ttl=10)
+            await store.put({"jobId": "b"}, ttl=100)
+            clock.now += 11
+            assert await store.get("a") is None
+            await store.put({"jobId": "c"}, ttl=5)
+            clock.now += 10
+            return await store.purge(), await store.get("b")
+
+        purged, job = asyncio.run(scenario())
+        assert purged == 1
+        assert job == {"jobId": "b"}
+
+    def test_redis_store_round_trips_json(self):
+        store = RedisJobStore(InMemoryRedis())
+
+        async def scenario():
+            await store.put({"jobId": "a", "images": IMAGES}, ttl=10)
+            return await store.get("a"), await store.get("missing")
+
+        job, missing = asyncio.run(scenario())
+        assert job == {"jobId": "a", "images": IMAGES}
+        assert missing is None
+
+
+class TestJobEndpoints:
+    def test_submit_then_poll(self):
+        from app.app import app
+
+        resources = Resources(
+            jobs_factory=lambda: JobManager(InMemoryJobStore(), _search)
+        )
+        app.dependency_overrides[get_resources] = lambda: resources
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                submitted = await client.post(
+                    "/searchPhotographers/jobs",
+                    json={
+                        "destination": "Bali",
+                        "preferredLanguage": "english",
+                        "referenceImage": "data:image/jpeg;base64,AA==",
+                    },
+                )
+                polled = await client.get(
+                    submitted.headers["location"], params={"wait": 1}
+                )
+                missing = await client.get("/searchPhotographers/jobs/unknown")
+            await resources.jobs.aclose()
+            return submitted, polled, missing
+
+        try:
+            submitted, polled, missing = asyncio.run(scenario())
+        finally:
+            app.dependency_overrides.clear()
+
+        assert submitted.status_code == 202
+        assert submitted.json()["status"] == "queued"
+        assert polled.json()["status"] == "succeeded"
+        # 保存先の gs:// URL はクライアントが読み込める https の URL で返す
+        assert polled.json()["images"] == [
+            {
+                "imageUrl": "https://storage.googleapis.com/b/a.jpg",
+                "instagramUrl": "https://instagram.com/a/",
+            }
+        ]
+        assert missing.status_code == 404
+
+    def test_submit_is_rate_limited(self):
+        from app.app import app
+
+        resources = Resources(
+            admission_factory=lambda: AdmissionController(rate=0.1, burst=1),
+            jobs_factory=lambda: JobManager(InMemoryJobStore(), _search),
+        )
+        app.dependency_overrides[get_resources] = lambda: resources
+        body = {
+            "destination": "Bali",
+            "preferredLanguage": "english",
+            "referenceImage": "data:image/jpeg;base64,AA==",
+        }
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                first = await client.post("/searchPhotographers/jobs", json=body)
+                second = await client.post("/searchPhotographers/jobs", json=body)
+            await resources.jobs.aclose()
+            return first, second
+
+        try:
+            first, second = asyncio.run(scenario())
+        finally:
+            app.dependency_overrides.clear()
+
+        assert first.status_code == 202
+        assert second.status_code == 429
+        assert second.headers["retry-after"] == "10"
+        assert resources.jobs.stats()["submitted"] == 1
+
+    def test_search_error_fails_job_inside_admission_slot(self):
+        from app.models import SearchRequest
+
+        resources = Resources()
+
+        async def scenario():
+            request = SearchRequest.model_validate(
+                {
+                    "destination": "Bali",
+                    "preferredLanguage": "english",
+                    "referenceImage": "not base64!",
+                }
+            )
+            job = await resources.jobs.submit(request)
+            done = await resources.jobs.get(job["jobId"], wait=1)
+            await resources.jobs.aclose()
+            return done
+
+        job = asyncio.run(scenario())
+
+        # 同期の検索では空の結果になる失敗も、ジョブでは failed として残す
+        assert job["status"] == "failed"
+        assert job["error"].startswith("Invalid reference image")
+        admission = resources.admission.stats()
+        assert (admission["admitted"], admission["in_flight"]) == (1, 0)
+
+    def test_agent_timeout_fails_job(self, monkeypatch):
+        from app.models import SearchRequest
+
+        class _HangingRunner:
+            async def run_async(self, **kwargs):
+                await asyncio.sleep(1)
+                yield  # pragma: no cover
+
+        monkeypatch.setattr(agent, "runner", _HangingRunner())
+        monkeypatch.setattr(settings, "AGENT_TIMEOUT", 0.05)
+        resources = Resources(
+            storage_factory=lambda: StorageGateway(LocalBackend("bucket")),
+            genai_factory=object,
+        )
+        output = io.BytesIO()
+        Image.new("RGB", (64, 64), (0, 102, 204)).save(output, format="JPEG")
+        reference = base64.b64encode(output.getvalue()).decode()
+
+        async def scenario():
+            request = SearchRequest.model_validate(
+                {
+                    "destination": "Bali",
+                    "preferredLanguage": "english",
+                    "referenceImage": f"data:image/jpeg;base64,{reference}",
+                }
+            )
+            job = await resources.jobs.submit(request)
+            done = await resources.jobs.get(job["jobId"], wait=2)
+            await resources.aclose()
+            return done
+
+        job = asyncio.run(scenario())
+
+        # モデルの期限切れは、画像 0 件の成功ではなく失敗として残す
+        assert job["status"] == "failed"
+        assert "Model call exceeded" in job["error"]
+        assert job["images"] is None
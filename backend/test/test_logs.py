@@ -0,0 +1,92 @@
+import asyncio
+import io
+import json
+import logging
+
+from app.logs import (
+    JsonFormatter,
+    RequestLogMiddleware,
+    add_fields,
+    log_payload,
+)
+from app.metrics import stage
+
+
+def _capture(name: str, level=logging.DEBUG):
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    log = logging.getLogger(name)
+    log.handlers = [handler]
+    log.setLevel(level)
+    log.propagate = False
+    return log, stream
+
+
+def _records(stream: io.StringIO):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestJsonFormatter:
+    def test_extra_fields_are_top_level(self):
+        log, stream = _capture("test.logs.json")
+        log.info("hello %s", "world", extra={"durationMs": 1.5})
+
+        (record,) = _records(stream)
+        assert record["message"] == "hello world"
+        assert record["level"] == "INFO"
+        assert record["durationMs"] == 1.5
+
+
+class TestLogPayload:
+    def test_payload_is_not_built_when_not_sampled(self):
+        log, stream = _capture("test.logs.payload")
+        calls = []
+
+        def payload():
+            calls.append(1)
+            return {"x": 1}
+
+        log_payload(log, "payload: %s", payload, sample_rate=0.0)
+        log.setLevel(logging.INFO)
+        log_payload(log, "payload: %s", payload, sample_rate=1.0)
+
+        assert calls == []
+        assert stream.getvalue() == ""
+
+    def test_payload_is_logged_when_sampled(self):
+        log, stream = _capture("test.logs.payload_sampled")
+        log_payload(log, "payload: %s", lambda: {"x": 1}, sample_rate=1.0)
+
+        (record,) = _records(stream)
+        assert record["message"] == "payload: {'x': 1}"
+
+
+class TestRequestLogMiddleware:
+    def test_one_record_per_request_with_stages(self):
+        _, stream = _capture("app.request", logging.INFO)
+
+        async def app(scope, receive, send):
+            with stage("agent"):
+                await asyncio.sleep(0.01)
+            add_fields(cacheHit=False)
+            await send({"type": "http.response.start", "status": 201})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def send(message):
+            pass
+
+        middleware = RequestLogMiddleware(app)
+        scope = {"type": "http", "method": "POST", "path": "/searchPhotographers"}
+        asyncio.run(middleware(scope, None, send))
+
+        (record,) = _records(stream)
+        assert record["status"] == 201
+        assert record["path"] == "/searchPhotographers"
+        assert record["cacheHit"] is False
+        assert record["stages"]["agentMs"] >= 10
+        assert record["durationMs"] >= record["stages"]["agentMs"]
+
+    def test_stage_outside_request_is_noop(self):
+        with stage("agent"):
+            add_fields(ignored=True)
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from app.metrics import STAGE_SECONDS, STORAGE_CALLS, Registry, stage
+from app.storage import LocalBackend, StorageGateway, StorageNotFoundError
+
+
+class TestRegistry:
+    def test_renders_counter_and_histogram(self):
+        registry = Registry()
+        requests = registry.counter("requests_total", "Requests.", ("path",))
+        latency = registry.histogram(
+            "latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0)
+        )
+
+        requests.inc(path="/a")
+        requests.inc(2, path="/a")
+        latency.observe(0.05, stage="agent")
+        latency.observe(0.5, stage="agent")
+        latency.observe(5, stage="agent")
+
+        lines = registry.render().splitlines()
+        assert "# TYPE requests_total counter" in lines
+        assert 'requests_total{path="/a"} 3' in lines
+        assert "# TYPE latency_seconds histogram" in lines
+        assert 'latency_seconds_bucket{stage="agent",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{stage="agent",le="1.0"} 2' in lines
+        assert 'latency_seconds_bucket{stage="agent",le="+Inf"} 3' in lines
+        assert 'latency_seconds_count{stage="agent"} 3' in lines
+        assert 'latency_seconds_sum{stage="agent"} 5.55' in lines
+
+    def test_rejects_wrong_labels(self):
+        registry = Registry()
+        counter = registry.counter("c_total", "C.", ("kind",))
+        with pytest.raises(ValueError):
+            counter.inc(other="x")
+
+    def test_escapes_label_values(self):
+        registry = Registry()
+        registry.counter("c_total", "C.", ("kind",)).inc(kind='a"b')
+        assert 'c_total{kind="a\\"b"} 1' in registry.render()
+
+
+class TestInstrumentation:
+    def test_stage_records_histogram(self):
+        before = STAGE_SECONDS.count(stage="test_stage")
+        with stage("test_stage"):
+            pass
+        assert STAGE_SECONDS.count(stage="test_stage") == before + 1
+
+    def test_storage_calls_are_counted_by_outcome(self):
+        gateway = StorageGateway(LocalBackend("test-bucket"))
+        ok = STORAGE_CALLS.value(operation="download_text", outcome="ok")
+        missing = STORAGE_CALLS.value(operation="download_text", outcome="not_found")
+
+        async def scenario():
+            await gateway.upload_bytes("a.json", b"{}", "application/json")
+            await gateway.download_text("a.json")
+            with pytest.raises(StorageNotFoundError):
+                await gateway.download_text("missing.json")
+
+        asyncio.run(scenario())
+
+        assert STORAGE_CALLS.value(operation="download_text", outcome="ok") == ok + 1
+        assert (
+            STORAGE_CALLS.value(operation="download_text", outcome="not_found")
+            == missing + 1
+        )
@@ -0,0 +1,177 @@
+import asyncio
+import json
+from contextlib import aclosing
+
+from app import utils
+from app.photographer_index import PhotographerIndex
+from app.resources import Resources
+from app.storage import LocalBackend, StorageGateway
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPhotographerIndex:
+    def test_lookup_normalizes_destination(self):
+        index = PhotographerIndex()
+        index.add("Bali", "japanese", ["a", "b", "a"])
+
+        assert sorted(index.lookup("  ＢＡＬＩ ", "japanese", 10)) == ["a", "b"]
+        assert index.lookup("Bali", "english", 10) == []
+
+    def test_fuzzy_match_absorbs_typos(self):
+        index = PhotographerIndex()
+        index.add("Honolulu", "english", ["aloha_photo"])
+
+        assert index.lookup("Honolullu", "english", 10) == ["aloha_photo"]
+        assert index.lookup("Paris", "english", 10) == []
+        assert index.stats()["fuzzy_hits"] == 1
+
+    def test_stale_candidates_are_ignored_and_pruned(self):
+        clock = _Clock()
+        index = PhotographerIndex(max_age=100, clock=clock)
+        index.add("Paris", "english", ["old"])
+        clock.now += 60
+        index.add("Paris", "english", ["new"])
+        clock.now += 60
+
+        assert index.lookup("Paris", "english", 10) == ["new"]
+        assert index.prune() == 1
+        assert index.stats()["size"] == 1
+
+    def test_candidates_confirmed_by_the_model_come_first(self):
+        clock = _Clock()
+        index = PhotographerIndex(clock=clock)
+        index.add("Kyoto", "japanese", ["a", "b"])
+        clock.now += 1
+        index.add("Kyoto", "japanese", ["b", "c"])
+        clock.now += 1
+        index.add("Kyoto", "japanese", ["d"], source="bulk")
+
+        # 参照しても順序は変わらない (返した回数では数えない)
+        for _ in range(3):
+            index.lookup("Kyoto", "japanese", 1)
+
+        # モデルの回答に含まれた回数、新しい候補の順
+        assert index.lookup("Kyoto", "japanese", 4) == ["b", "c", "a", "d"]
+
+    def test_fuzzy_aliases_are_bounded(self):
+        index = PhotographerIndex(max_aliases=2)
+        index.add("Honolulu", "english", ["aloha_photo"])
+
+        for typo in ("Honolullu", "Honolulo", "Honnolulu"):
+            assert index.lookup(typo, "english", 10) == ["aloha_photo"]
+
+        assert len(index._aliases) == 2
+
+    def test_bulk_load_json_and_csv(self, tmp_path):
+        json_path = tmp_path / "seed.json"
+        json_path.write_text(
+            json.dumps(
+                [
+                    {
+                        "destination": "Bali",
+                        "language": "english",
+                        "usernames": ["x", "y"],
+                    }
+                ]
+            )
+        )
+        csv_path = tmp_path / "seed.csv"
+        csv_path.write_text("destination,language,username\nParis,english,z\n")
+        index = PhotographerIndex()
+
+        assert index.bulk_load(str(json_path)) == 2
+        assert index.bulk_load(str(csv_path)) == 1
+        assert index.lookup("paris", "english", 10) == ["z"]
+
+    def test_persists_to_file(self, tmp_path):
+        path = str(tmp_path / "index.db")
+        index = PhotographerIndex(path)
+        index.add("Bali", "english", ["x"])
+        index.close()
+
+        assert PhotographerIndex(path).lookup("bali", "english", 10) == ["x"]
+
+
+async def _collect(usernames):
+    async with aclosing(usernames):
+        return [username async for username in usernames]
+
+
+class TestCandidateUsernames:
+    def _run(self, index, found, monkeypatch=None, explore_rate=0.0):
+        if monkeypatch is not None:
+            monkeypatch.setattr(
+                utils.settings, "PHOTOGRAPHER_INDEX_EXPLORE_RATE", explore_rate
+            )
+        calls = []
+
+        async def find(
+            prompt, destination, language, timeout=None, describe_style=None
+        ):
+            calls.append(destination)
+            for username in found:
+                yield username
+
+        resources = Resources(
+            storage_factory=lambda: StorageGateway(LocalBackend()),
+            photographer_index_factory=lambda: index,
+        )
+        original = utils._iter_agent_usernames
+        utils._iter_agent_usernames = find
+        try:
+            usernames = asyncio.run(
+                _collect(
+                    utils._iter_candidate_usernames(
+                        "prompt", "Bali", "english", resources
+                    )
+                )
+            )
+        finally:
+            utils._iter_agent_usernames = original
+        return usernames, calls
+
+    def test_enough_candidates_skip_the_model(self, monkeypatch):
+        index = PhotographerIndex()
+        index.add("Bali", "english", [f"p{i}" for i in range(12)])
+
+        usernames, calls = self._run(index, ["unused"], monkeypatch)
+
+        assert len(usernames) == 6
+        assert calls == []
+
+    def test_one_answer_is_not_full_coverage(self, monkeypatch):
+        index = PhotographerIndex()
+        index.add("Bali", "english", [f"p{i}" for i in range(6)])
+
+        usernames, calls = self._run(index, ["new1", "new2"], monkeypatch)
+
+        # インデックスの候補で埋まっていても、モデルの回答は全てインデックスに追加する
+        assert usernames == [f"p{i}" for i in range(6)]
+        assert calls == ["Bali"]
+        assert len(index.lookup("bali", "english", 20)) == 8
+
+    def test_explore_asks_the_model_despite_coverage(self, monkeypatch):
+        index = PhotographerIndex()
+        index.add("Bali", "english", [f"p{i}" for i in range(12)])
+
+        _, calls = self._run(index, ["fresh"], monkeypatch, explore_rate=1.0)
+
+        assert calls == ["Bali"]
+        assert index.lookup("bali", "english", 1) == ["fresh"]
+
+    def test_model_fills_gaps_and_populates_index(self):
+        index = PhotographerIndex()
+        index.add("Bali", "english", ["known"])
+
+        usernames, calls = self._run(index, ["known", "new1", "new2"])
+
+        assert usernames == ["known", "new1", "new2"]
+        assert calls == ["Bali"]
+        assert sorted(index.lookup("bali", "english", 10)) == ["known", "new1", "new2"]
@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from app.metrics import WRITE_BEHIND
+from app.pipeline import Pipeline, WriteBehind
+
+
+class TestPipeline:
+    def test_independent_stages_run_concurrently(self):
+        started = []
+
+        async def slow(name, value):
+            started.append(name)
+            await asyncio.sleep(0.02)
+            return value
+
+        pipeline = (
+            Pipeline()
+            .add("decode", lambda: slow("decode", 2))
+            .add("upload", lambda n: slow("upload", n * 10), "decode")
+            .add("style", lambda n: slow("style", n + 1), "decode")
+            .add("agent", lambda url, style: url + style, "upload", "style")
+        )
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            begun = loop.time()
+            results = await pipeline.run()
+            return results, loop.time() - begun
+
+        results, elapsed = asyncio.run(scenario())
+
+        assert results == {"decode": 2, "upload": 20, "style": 3, "agent": 23}
+        assert started[0] == "decode"
+        # upload と style は並行に実行される (直列なら 3 段分かかる)
+        assert elapsed < 0.055
+
+    def test_failure_cancels_remaining_stages(self):
+        cancelled = []
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("decode failed")
+
+        async def slow():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append("style")
+                raise
+
+        pipeline = (
+            Pipeline()
+            .add("decode", fail)
+            .add("style", slow)
+            .add("agent", lambda n: n, "decode")
+        )
+
+        with pytest.raises(ValueError):
+            asyncio.run(pipeline.run())
+        assert cancelled == ["style"]
+
+    def test_dependencies_must_be_added_first(self):
+        with pytest.raises(ValueError):
+            Pipeline().add("agent", lambda prompt: prompt, "prompt")
+
+
+class TestWriteBehind:
+    def test_writes_finish_in_background_and_flush_on_close(self):
+        written = []
+
+        async def write(name):
+            await asyncio.sleep(0.01)
+            written.append(name)
+            return name
+
+        async def scenario():
+            queue = WriteBehind(workers=1)
+            first = queue.submit("upload", lambda: write("a"))
+            queue.submit("upload", lambda: write("b"))
+            assert written == []
+            result = await first
+            await queue.aclose()
+            return result, queue.stats()
+
+        result, stats = asyncio.run(scenario())
+
+        assert result == "a"
+        assert written == ["a", "b"]
+        assert stats["completed"] == 2
+
+    def test_failed_write_is_counted_and_surfaced_to_waiters(self):
+        async def fail():
+            raise OSError("storage unavailable")
+
+        async def scenario():
+            queue = WriteBehind()
+            done = queue.submit("upload", fail)
+            with pytest.raises(OSError):
+                await done
+            # 待たない書き込みの失敗も記録だけして進む
+            queue.submit("upload", fail)
+            await queue.aclose()
+            return queue.stats()
+
+        assert asyncio.run(scenario())["failed"] == 2
+
+    def test_drops_writes_when_queue_is_full(self):
+        dropped = WRITE_BEHIND.value(name="style_index", outcome="dropped")
+
+        async def write():
+            await asyncio.sleep(0.01)
+
+        async def scenario():
+            queue = WriteBehind(workers=1, max_pending=1)
+            queue.submit("style_index", write)
+            await asyncio.sleep(0)  # ワーカーが 1 件目を取り出して実行する
+            queue.submit("style_index", write)
+            third = queue.submit("style_index", write)
+            await queue.aclose()
+            return third, queue.stats()
+
+        third, stats = asyncio.run(scenario())
+
+        assert third is None
+        assert stats["dropped"] == 1
+        assert stats["completed"] == 2
+        assert WRITE_BEHIND.value(name="style_index", outcome="dropped") == dropped + 1
+
+    def test_run_now_is_kept_until_done_and_awaited_on_close(self):
+        written = []
+
+        async def write():
+            await asyncio.sleep(0.01)
+            written.append("upload")
+
+        async def fail():
+            raise OSError("storage unavailable")
+
+        async def scenario():
+            queue = WriteBehind(workers=1, max_pending=1)
+            queue.run_now("upload", write)
+            # 誰も待たない書き込みの失敗も回収して記録する
+            queue.run_now("upload", fail)
+            assert queue.stats()["running"] == 2
+            await queue.aclose()
+            return queue.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert written == ["upload"]
+        assert (stats["running"], stats["completed"], stats["failed"]) == (0, 1, 1)
@@ -0,0 +1,227 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from app.agent.policy import LatencyWindow, ModelCallPolicy, Route
+from app.metrics import AGENT_FALLBACKS, AGENT_HEDGE_WINS, AGENT_HEDGES
+
+PRIMARY = Route("primary", "gemini-2.5-flash")
+HEDGE = Route("hedge", "gemini-2.5-flash", "europe-west1")
+FALLBACK = Route("fallback", "gemini-2.5-flash-lite")
+
+
+def _policy(**kwargs):
+    options = {
+        "hedge": HEDGE,
+        "fallback": FALLBACK,
+        "hedge_min_delay": 0.02,
+        "hedge_min_samples": 3,
+        "hedge_max_rate": 1.0,
+    }
+    options.update(kwargs)
+    return ModelCallPolicy(PRIMARY, **options)
+
+
+def _warm(policy, kind, seconds=0.01, n=3):
+    """ヘッジ判断に使う応答時間のサンプルを入れる"""
+    stats = policy._stats_for(kind)
+    for _ in range(n):
+        stats.calls += 1
+        stats.latency.add(seconds)
+
+
+class TestLatencyWindow:
+    def test_percentile_over_recent_samples(self):
+        window = LatencyWindow(size=10)
+        assert window.percentile(0.5) is None
+
+        for seconds in range(100):
+            window.add(float(seconds))
+
+        # 直近 10 件 (90〜99) だけを使う
+        assert len(window) == 10
+        assert window.percentile(0.0) == 90.0
+        assert window.percentile(0.95) == 99.0
+
+
+class TestModelCallPolicy:
+    def test_no_hedge_until_enough_samples(self):
+        policy = _policy()
+        routes = []
+
+        async def attempt(route):
+            routes.append(route)
+            await asyncio.sleep(0.05)
+            return route.name
+
+        assert policy.hedge_delay("agent") is None
+        assert asyncio.run(policy.call("agent", attempt)) == "primary"
+        assert routes == [PRIMARY]
+        assert len(policy._stats_for("agent").latency) == 1
+
+    def test_slow_primary_is_hedged_and_loser_cancelled(self):
+        policy = _policy()
+        _warm(policy, "agent")
+        cancelled = []
+        hedges = AGENT_HEDGES.value(kind="agent", reason="slow")
+        wins = AGENT_HEDGE_WINS.value(kind="agent")
+
+        async def attempt(route):
+            try:
+                await asyncio.sleep(1 if route is PRIMARY else 0.01)
+            except asyncio.CancelledError:
+                cancelled.append(route.name)
+                raise
+            return route.name
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            begun = loop.time()
+            result = await policy.call("agent", attempt)
+            return result, loop.time() - begun
+
+        result, elapsed = asyncio.run(scenario())
+
+        assert result == "hedge"
+        assert cancelled == ["primary"]
+        # ヘッジまでの 0.02 秒 + ヘッジの応答 0.01 秒
+        assert elapsed < 0.5
+        assert AGENT_HEDGES.value(kind="agent", reason="slow") == hedges + 1
+        assert AGENT_HEDGE_WINS.value(kind="agent") == wins + 1
+
+        stats = policy.stats()["kinds"]["agent"]
+        assert stats["hedged"] == 1
+        assert stats["hedge_wins"] == 1
+        assert stats["hedge_rate"] == 0.25
+        assert stats["hedge_win_rate"] == 1.0
+
+    def test_primary_that_answers_first_wins(self):
+        policy = _policy()
+        _warm(policy, "agent")
+        cancelled = []
+
+        async def attempt(route):
+            try:
+                await asyncio.sleep(0.04 if route is PRIMARY else 1)
+            except asyncio.CancelledError:
+                cancelled.append(route.name)
+                raise
+            return route.name
+
+        assert asyncio.run(policy.call("agent", attempt)) == "primary"
+        assert cancelled == ["hedge"]
+        stats = policy.stats()["kinds"]["agent"]
+        assert stats["hedged"] == 1
+        assert stats["hedge_win_rate"] == 0.0
+
+    def test_error_is_retried_on_hedge_route_immediately(self):
+        policy = _policy()
+        routes = []
+
+        async def attempt(route):
+            routes.append(route)
+            if route is PRIMARY:
+                raise ConnectionError("unavailable")
+            return route.name
+
+        assert asyncio.run(policy.call("agent", attempt)) == "hedge"
+        assert routes == [PRIMARY, HEDGE]
+        assert policy.stats()["kinds"]["agent"]["failures"] == 0
+
+    def test_error_without_hedge_is_raised(self):
+        policy = _policy(hedge=None)
+
+        async def attempt(route):
+            raise ConnectionError("unavailable")
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(policy.call("agent", attempt))
+        assert policy.stats()["kinds"]["agent"]["failures"] == 1
+
+    def test_deadline_cancels_all_attempts(self):
+        policy = _policy()
+        _warm(policy, "agent")
+        cancelled = []
+
+        async def attempt(route):
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(route.name)
+                raise
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(policy.call("agent", attempt, deadline=0.05))
+        assert sorted(cancelled) == ["hedge", "primary"]
+        assert policy.in_flight == 0
+
+    def test_hedge_rate_is_capped(self):
+        policy = _policy(hedge_max_rate=0.1)
+        _warm(policy, "agent", n=5)
+        policy._stats_for("agent").hedged = 1
+
+        # 5 回中 1 回ヘッジ済み (20%) なので、上限 10% を超える間はヘッジしない
+        assert policy.hedge_delay("agent") is None
+
+    def test_fallback_under_load(self):
+        policy = _policy(fallback_in_flight=2)
+        routes = []
+        fallbacks = AGENT_FALLBACKS.value(kind="agent")
+
+        async def scenario():
+            gate = asyncio.Event()
+
+            async def attempt(route):
+                routes.append(route)
+                await gate.wait()
+                return route.name
+
+            calls = [
+                asyncio.create_task(policy.call("agent", attempt)) for _ in range(3)
+            ]
+            await asyncio.sleep(0.01)
+            gate.set()
+            return await asyncio.gather(*calls)
+
+        results = asyncio.run(scenario())
+
+        assert results == ["primary", "primary", "fallback"]
+        assert routes == [PRIMARY, PRIMARY, FALLBACK]
+        assert AGENT_FALLBACKS.value(kind="agent") == fallbacks + 1
+        assert policy.stats()["kinds"]["agent"]["fallbacks"] == 1
+
+    def test_stream_hedges_on_first_chunk(self):
+        policy = _policy()
+        _warm(policy, "search")
+
+        async def attempt(route):
+            if route is PRIMARY:
+                await asyncio.sleep(1)
+            for chunk in (f"{route.name}_a\n", f"{route.name}_b\n"):
+                yield chunk
+                await asyncio.sleep(0.01)
+
+        async def scenario():
+            async with aclosing(policy.stream("search", attempt, 1.0)) as chunks:
+                return [chunk async for chunk in chunks]
+
+        assert asyncio.run(scenario()) == ["hedge_a\n", "hedge_b\n"]
+
+    def test_stream_deadline_applies_after_first_chunk(self):
+        policy = _policy(hedge=None)
+
+        async def attempt(route):
+            yield "first"
+            await asyncio.sleep(1)
+            yield "late"
+
+        async def scenario():
+            received = []
+            async with aclosing(policy.stream("search", attempt, 0.05)) as chunks:
+                async for chunk in chunks:
+                    received.append(chunk)
+            return received
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(scenario())
@@ -0,0 +1,174 @@
+import asyncio
+
+import httpx
+
+from app.metrics import SHARED_CLIENTS
+from app.resources import Resources, get_resources, request_scope
+from app.storage import LocalBackend, StorageGateway
+
+
+class _FakeHttpClient:
+    closed = False
+
+    async def aclose(self):
+        self.closed = True
+
+
+class TestResources:
+    def test_clients_are_created_once_and_reused(self):
+        resources = Resources(
+            storage_factory=lambda: StorageGateway(LocalBackend()),
+            http_factory=_FakeHttpClient,
+            genai_factory=object,
+        )
+
+        # 起動時の生成はリクエストの再利用に数えない
+        first = resources.storage
+        for _ in range(2):
+            with request_scope():
+                # 同じリクエスト内の参照と、他のファクトリーからの参照は 1 回に数える
+                assert resources.storage is first
+                assert resources.storage is first
+                assert resources.reference_store is not None
+
+        stats = resources.stats()
+        assert stats["storage"] == {"created": 1, "reused": 2}
+        assert stats["reference_store"] == {"created": 1, "reused": 1}
+        assert stats["http"] == {"created": 0, "reused": 0}
+
+    def test_requests_count_client_reuse_once(self):
+        from app.app import app
+
+        resources = Resources(
+            storage_factory=lambda: StorageGateway(LocalBackend()),
+            http_factory=_FakeHttpClient,
+            genai_factory=object,
+        )
+        app.dependency_overrides[get_resources] = lambda: resources
+        reused = SHARED_CLIENTS.value(client="admission", result="reused")
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                body = {
+                    "destination": "Bali",
+                    "preferredLanguage": "klingon",
+                    "referenceImage": "data:image/jpeg;base64,AA==",
+                }
+                for _ in range(3):
+                    await client.post("/searchPhotographers", json=body)
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            app.dependency_overrides.clear()
+
+        # 実行枠の確保と解放で 2 回参照するが、リクエストごとに 1 回だけ数える
+        assert resources.stats()["admission"] == {"created": 1, "reused": 2}
+        assert SHARED_CLIENTS.value(client="admission", result="reused") == reused + 2
+
+    def test_stats_endpoints_are_disabled_by_default(self, monkeypatch):
+        from app.app import app
+        from app.config import settings
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                return await client.get("/startup-stats")
+
+        monkeypatch.setattr(settings, "STATS_ENDPOINTS", False)
+        assert asyncio.run(scenario()).status_code == 404
+        monkeypatch.setattr(settings, "STATS_ENDPOINTS", True)
+        assert asyncio.run(scenario()).status_code == 200
+
+    def test_aclose_releases_clients(self):
+        resources = Resources(
+            storage_factory=lambda: StorageGateway(LocalBackend()),
+            http_factory=_FakeHttpClient,
+            genai_factory=object,
+        )
+        http = resources.http
+
+        asyncio.run(resources.aclose())
+
+        assert http.closed
+        # 解放後は次回アクセス時に作り直される
+        assert resources.http is not http
+        assert resources.stats()["http"]["created"] == 2
+
+    def test_production_startup_warms_agent_in_background(self, monkeypatch):
+        from app.config import settings
+
+        resources = Resources(
+            storage_factory=lambda: StorageGateway(LocalBackend()),
+            http_factory=_FakeHttpClient,
+            genai_factory=object,
+            image_pool_factory=lambda: None,
+        )
+        warmed = asyncio.Event()
+
+        async def warm_agent():
+            await warmed.wait()
+
+        monkeypatch.setattr(settings, "APP_MODE", "production")
+        monkeypatch.setattr(resources, "_warm_agent", warm_agent)
+
+        async def scenario():
+            # エージェントの準備を待たずに起動が終わる
+            await asyncio.wait_for(resources.startup(), 1)
+            warmup = resources._agent_warmup
+            pending = not warmup.done()
+            await resources.aclose()
+            return pending, warmup.cancelled()
+
+        assert asyncio.run(scenario()) == (True, True)
+
+    def test_agent_ready_waits_for_warmup_without_blocking_loop(self, monkeypatch):
+        import time
+
+        from app import resources as resources_module
+        from app.config import settings
+
+        resources = Resources(
+            storage_factory=lambda: StorageGateway(LocalBackend()),
+            http_factory=_FakeHttpClient,
+            genai_factory=object,
+            image_pool_factory=lambda: None,
+        )
+        imported = []
+
+        def import_module(name):
+            # ADK・GenAI の読み込みの代わりに、スレッドを止める
+            time.sleep(0.1)
+            imported.append(name)
+
+        monkeypatch.setattr(settings, "APP_MODE", "production")
+        monkeypatch.setattr(resources_module, "_agent_imported", False)
+        monkeypatch.setattr(resources_module.importlib, "import_module", import_module)
+        monkeypatch.setattr(resources_module, "_resources", resources, raising=False)
+
+        async def scenario():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.create_task(tick())
+            await resources.startup()
+            await resources_module.agent_ready()
+            ready_ticks = ticks
+            ticker.cancel()
+            await resources.aclose()
+            return ready_ticks
+
+        # 読み込みの間もイベントループは他の処理を進める
+        assert asyncio.run(scenario()) >= 5
+        # 起動時の読み込みを待ち、もう一度は読み込まない
+        assert imported == ["app.agent.agent"]
@@ -0,0 +1,455 @@
+import asyncio
+import base64
+import io
+import json
+import time
+from contextlib import aclosing
+
+import httpx
+from PIL import Image
+
+from app import utils
+from app.cache import TTLCache
+from app.metrics import STYLE_CACHE, WRITE_BEHIND
+from app.resources import Resources, get_resources
+from app.services import PhotographerSearchService
+from app.storage import LocalBackend, StorageGateway
+from bench.fakes import FakeRunner
+
+
+def _service() -> PhotographerSearchService:
+    return PhotographerSearchService(
+        Resources(style_cache_factory=lambda: TTLCache("style", ttl=60))
+    )
+
+
+class TestStyleDescriber:
+    def _run(self, monkeypatch, service, searches, describe_image_style=None):
+        """searches ((画像, 知覚ハッシュ) の列) の順に説明を求め、その結果を返す"""
+        calls = []
+
+        async def analyze(data, timeout=None):
+            calls.append(data)
+            return "soft pastel tones"
+
+        monkeypatch.setattr(
+            utils, "describe_image_style", describe_image_style or analyze
+        )
+
+        async def scenario():
+            descriptions = []
+            for image_bytes, image_hash in searches:
+                describe = service._style_describer(image_bytes, image_hash)
+                descriptions.append(await describe())
+                # 裏で行う分析を、次の検索の前に終わらせる
+                await service.resources.write_behind.flush()
+            await service.resources.aclose()
+            return descriptions
+
+        return asyncio.run(scenario()), calls
+
+    def test_description_is_used_from_the_next_search(self, monkeypatch):
+        service = _service()
+        hits = STYLE_CACHE.value(result="hit")
+
+        # 最初の検索はモデルの呼び出しを分析で待たせず、説明なしで進む
+        # 目的地・言語を変えた再検索では、同じ画像の説明をキャッシュから使う
+        descriptions, calls = self._run(
+            monkeypatch, service, [(b"a", "abc"), (b"a", "abc"), (b"a", "abc")]
+        )
+
+        assert descriptions == ["", "soft pastel tones", "soft pastel tones"]
+        assert calls == [b"a"]
+        assert STYLE_CACHE.value(result="hit") == hits + 2
+
+    def test_different_images_are_analyzed_separately(self, monkeypatch):
+        service = _service()
+
+        _, calls = self._run(monkeypatch, service, [(b"a", "abc"), (b"b", "def")])
+
+        assert calls == [b"a", b"b"]
+
+    def test_failure_falls_back_to_empty_description(self, monkeypatch):
+        service = _service()
+        errors = WRITE_BEHIND.value(name="analyze", outcome="error")
+
+        async def describe_image_style(data, timeout=None):
+            raise TimeoutError
+
+        descriptions, _ = self._run(
+            monkeypatch, service, [(b"a", "abc"), (b"a", "abc")], describe_image_style
+        )
+
+        assert descriptions == ["", ""]
+        # 失敗はキャッシュせず、次の検索で分析し直す
+        assert service.resources.style_cache.stats()["size"] == 0
+        assert WRITE_BEHIND.value(name="analyze", outcome="error") == errors + 2
+
+
+class TestFindPhotographerUsernames:
+    def test_cached_description_replaces_search_prompt(self, monkeypatch):
+        from app.agent import agent
+
+        queries = []
+
+        async def stream_agent(query, timeout=None):
+            queries.append(query)
+            yield "user001\nuser002"
+
+        async def describe():
+            return "soft pastel tones"
+
+        monkeypatch.setattr(agent, "stream_agent", stream_agent)
+
+        async def scenario():
+            async with aclosing(
+                utils._iter_agent_usernames(
+                    "Please analyze the image at gs://b/r/a.jpg",
+                    "Bali",
+                    "english",
+                    describe_style=describe,
+                )
+            ) as usernames:
+                return [username async for username in usernames]
+
+        usernames = asyncio.run(scenario())
+
+        assert usernames == ["user001", "user002"]
+        assert "Style requirements: soft pastel tones" in queries[0]
+        assert "gs://b/r/a.jpg" not in queries[0]
+
+    def test_usernames_are_emitted_while_the_model_is_generating(self, monkeypatch):
+        from app.agent import agent
+
+        generated = []
+
+        async def stream_agent(query, timeout=None):
+            for chunk in ["bali_wed", "ding\nubud_", "love\n", "@seminyak", "_shoots"]:
+                generated.append(chunk)
+                yield chunk
+
+        async def scenario():
+            received = []
+            async for username in utils._iter_agent_usernames("prompt", "Bali", "en"):
+                received.append((username, len(generated)))
+            return received
+
+        monkeypatch.setattr(agent, "stream_agent", stream_agent)
+
+        # 行が揃った時点で返し、最後の行は応答の終わりで返す
+        assert asyncio.run(scenario()) == [
+            ("bali_wedding", 2),
+            ("ubud_love", 3),
+            ("seminyak_shoots", 5),
+        ]
+
+
+class TestSearchCoalescing:
+    def test_concurrent_identical_searches_run_once(self, monkeypatch):
+        from app.models import ImageResult
+
+        service = PhotographerSearchService(
+            Resources(search_cache_factory=lambda: TTLCache("search", ttl=60))
+        )
+        calls = []
+
+        async def image_hash(image_bytes):
+            return "abc"
+
+        async def search(
+            destination, language, image_bytes, image_hash=None, raise_errors=False
+        ):
+            calls.append(destination)
+            await asyncio.sleep(0.01)
+            return [
+                ImageResult(
+                    image_url="gs://b/a.jpg", instagram_url="https://instagram.com/a"
+                )
+            ]
+
+        monkeypatch.setattr(service, "_image_hash", image_hash)
+        monkeypatch.setattr(service, "_search", search)
+
+        async def scenario():
+            return await asyncio.gather(
+                *(
+                    service.search_with_image("Bali", "english", b"img")
+                    for _ in range(3)
+                )
+            )
+
+        results = asyncio.run(scenario())
+
+        assert calls == ["Bali"]
+        assert all(len(r) == 1 for r in results)
+        assert service.resources.search_flights.stats()["coalesced"] == 2
+
+
+class TestSearchPipeline:
+    def test_agent_does_not_wait_for_reference_upload(self, monkeypatch):
+        from app.storage import LocalBackend, StorageGateway
+
+        service = PhotographerSearchService(
+            Resources(storage_factory=lambda: StorageGateway(LocalBackend()))
+        )
+        events = []
+
+        async def normalize(image_bytes):
+            return image_bytes
+
+        async def style_embedding(image_bytes):
+            return None
+
+        async def upload(image_bytes):
+            await asyncio.sleep(0.05)
+            events.append("uploaded")
+            return service.resources.reference_store.url_for(image_bytes)
+
+        async def prompt_agent(prompt, destination, language, style_vector, describe):
+            events.append(prompt)
+            # スタイル説明はキャッシュにあるものだけを使い、分析もアップロードも待たない
+            events.append(await describe())
+            return '{"images": []}'
+
+        async def describe_image_style(image_bytes, timeout=None):
+            events.append(image_bytes)
+            return "soft pastel tones"
+
+        monkeypatch.setattr(service, "_normalize_reference_image", normalize)
+        monkeypatch.setattr(service, "_style_embedding", style_embedding)
+        monkeypatch.setattr(service, "_upload_reference_image", upload)
+        monkeypatch.setattr(service, "_prompt_agent", prompt_agent)
+        monkeypatch.setattr(utils, "describe_image_style", describe_image_style)
+
+        async def scenario():
+            results = await service._search("Bali", "english", b"img", "abc")
+            await service.resources.aclose()
+            return results
+
+        assert asyncio.run(scenario()) == []
+        url = service.resources.reference_store.url_for(b"img")
+        assert url in events[0]
+        assert events[1] == ""
+        # 分析 (画像を添付して送る) とアップロードは、
+        # エージェントの呼び出しの後に裏で終わる
+        assert sorted(events[2:], key=str) == [b"img", "uploaded"]
+
+
+def _reference_image() -> str:
+    output = io.BytesIO()
+    Image.new("RGB", (64, 64), (0, 102, 204)).save(output, format="JPEG")
+    return "data:image/jpeg;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def _stream_resources() -> Resources:
+    """ストレージはメモリ、画像の取得は固定の画像を返す Resources"""
+    output = io.BytesIO()
+    Image.new("RGB", (32, 32), (200, 120, 40)).save(output, format="JPEG")
+    image = output.getvalue()
+
+    async def handler(request):
+        return httpx.Response(
+            200, content=image, headers={"content-type": "image/jpeg"}
+        )
+
+    return Resources(
+        storage_factory=lambda: StorageGateway(LocalBackend("bucket")),
+        http_factory=lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        genai_factory=object,
+    )
+
+
+async def _post_stream(app, body: dict, disconnect_after: int = 0):
+    """ASGI で直接 /searchPhotographers/stream を呼び、(経過秒数, 行) の列を返す
+
+    disconnect_after 行を受け取った時点でクライアントが切断したことにする。
+    """
+    started = time.perf_counter()
+    lines = []
+    disconnected = asyncio.Event()
+    request = {"type": "http.request", "body": json.dumps(body).encode()}
+
+    async def receive():
+        nonlocal request
+        if request is not None:
+            message, request = request, None
+            return message
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] != "http.response.body":
+            return
+        for line in message.get("body", b"").decode().splitlines():
+            lines.append((time.perf_counter() - started, json.loads(line)))
+        if disconnect_after and len(lines) >= disconnect_after:
+            disconnected.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/searchPhotographers/stream",
+        "raw_path": b"/searchPhotographers/stream",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return lines
+
+
+class TestStreamEndpoint:
+    def _run(self, monkeypatch, runner, disconnect_after=0):
+        from app.agent import agent
+        from app.app import app
+
+        monkeypatch.setattr(agent, "runner", runner)
+        resources = _stream_resources()
+        app.dependency_overrides[get_resources] = lambda: resources
+        body = {
+            "destination": "Bali",
+            "preferredLanguage": "english",
+            "referenceImage": _reference_image(),
+        }
+
+        async def scenario():
+            lines = await _post_stream(app, body, disconnect_after)
+            in_flight = resources.admission.in_flight
+            await resources.aclose()
+            return lines, in_flight
+
+        try:
+            lines, in_flight = asyncio.run(scenario())
+        finally:
+            app.dependency_overrides.clear()
+        return lines, in_flight
+
+    def test_images_are_streamed_before_the_summary(self, monkeypatch):
+        # 6 件のユーザー名を 0.1 秒ごとに 1 行ずつ生成する
+        lines, in_flight = self._run(monkeypatch, FakeRunner(latency=0.6))
+
+        kinds = [line["type"] for _, line in lines]
+        assert kinds == ["image"] * 6 + ["summary"]
+        assert lines[-1][1]["count"] == 6
+        # 最初の画像は、モデルが残りの候補を生成している間に届く
+        assert lines[0][0] < lines[-1][0] - 0.2
+        assert in_flight == 0
+
+    def test_agent_failure_emits_error_line(self, monkeypatch):
+        class _FailingRunner:
+            async def run_async(self, **kwargs):
+                raise RuntimeError("agent unavailable")
+                yield  # pragma: no cover
+
+        lines, in_flight = self._run(monkeypatch, _FailingRunner())
+
+        assert [line["type"] for _, line in lines] == ["error", "summary"]
+        assert "agent unavailable" in lines[0][1]["message"]
+        assert lines[1][1]["count"] == 0
+        assert in_flight == 0
+
+    def test_client_disconnect_releases_admission_slot(self, monkeypatch):
+        lines, in_flight = self._run(
+            monkeypatch, FakeRunner(latency=0.6), disconnect_after=1
+        )
+
+        # 切断後は残りの行を送らず、実行枠を返す
+        assert [line["type"] for _, line in lines] == ["image"]
+        assert in_flight == 0
+
+
+class _RecordingBackend(LocalBackend):
+    """呼び出しを記録し、パスごとに指定した秒数だけ待つ LocalBackend"""
+
+    def __init__(self, delays=None):
+        super().__init__("bucket")
+        self.delays = delays or {}
+        self.calls = []
+
+    def download_text(self, path):
+        self.calls.append(("download_text", path))
+        time.sleep(self.delays.get(path, 0))
+        return super().download_text(path)
+
+    def exists(self, path):
+        self.calls.append(("exists", path))
+        return super().exists(path)
+
+
+class TestResolveInstagramUrls:
+    def _resolve(self, backend, storage_paths, objects=()):
+        service = PhotographerSearchService(
+            Resources(storage_factory=lambda: StorageGateway(backend))
+        )
+        for path, url in objects:
+            backend.upload_bytes(
+                path, json.dumps({"instagram_url": url}).encode(), "application/json"
+            )
+
+        async def scenario():
+            started = time.perf_counter()
+            urls = await service._resolve_instagram_urls(storage_paths)
+            return urls, time.perf_counter() - started
+
+        return asyncio.run(scenario())
+
+    def test_results_keep_input_order_and_run_concurrently(self):
+        # 先頭ほど遅く返る (順番に待つと 0.3 秒以上かかる)
+        backend = _RecordingBackend(
+            {"urls/a.json": 0.15, "urls/b.json": 0.1, "urls/c.json": 0.05}
+        )
+
+        urls, elapsed = self._resolve(
+            backend,
+            [
+                "gs://bucket/urls/a.json",
+                "gs://bucket/urls/b.json",
+                "gs://bucket/urls/c.json",
+            ],
+            objects=[
+                ("urls/a.json", "https://instagram.com/a_real"),
+                ("urls/b.json", "https://instagram.com/b_real"),
+                ("urls/c.json", "https://instagram.com/c_real"),
+            ],
+        )
+
+        assert urls == [
+            "https://instagram.com/a_real",
+            "https://instagram.com/b_real",
+            "https://instagram.com/c_real",
+        ]
+        assert elapsed < 0.25
+
+    def test_missing_object_falls_back_without_exists_call(self):
+        backend = _RecordingBackend()
+
+        urls, _ = self._resolve(backend, ["gs://bucket/instagram_urls/bali_wed.json"])
+
+        assert urls == ["https://instagram.com/bali_wed"]
+        # 存在確認をせずに取得し、無かった場合だけフォールバックする
+        assert backend.calls == [("download_text", "instagram_urls/bali_wed.json")]
+
+    def test_https_urls_are_returned_without_storage_calls(self):
+        backend = _RecordingBackend()
+
+        urls, _ = self._resolve(
+            backend,
+            [
+                "https://instagram.com/direct",
+                "gs://bucket/urls/stored.json",
+                "https://instagram.com/other",
+            ],
+            objects=[("urls/stored.json", "https://instagram.com/stored_real")],
+        )
+
+        assert urls == [
+            "https://instagram.com/direct",
+            "https://instagram.com/stored_real",
+            "https://instagram.com/other",
+        ]
+        assert backend.calls == [("download_text", "urls/stored.json")]
@@ -0,0 +1,67 @@
+import asyncio
+
+from google.adk.sessions import InMemorySessionService
+
+from app.agent.sessions import SessionManager
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def _session_count(service: InMemorySessionService) -> int:
+    response = await service.list_sessions(app_name="test", user_id="user")
+    return len(response.sessions)
+
+
+class TestSessionManager:
+    def test_each_call_gets_its_own_session(self):
+        manager = SessionManager(InMemorySessionService(), "test", stateless=False)
+
+        async def scenario():
+            async with (
+                manager.session() as (_, first),
+                manager.session() as (_, second),
+            ):
+                return first, second
+
+        first, second = asyncio.run(scenario())
+        assert first != second
+
+    def test_stateless_sessions_are_deleted_after_use(self):
+        service = InMemorySessionService()
+        manager = SessionManager(service, "test", stateless=True)
+
+        async def scenario():
+            async with manager.session():
+                assert await _session_count(service) == 1
+            return await _session_count(service)
+
+        assert asyncio.run(scenario()) == 0
+
+    def test_sessions_are_evicted_by_ttl_and_size(self):
+        service = InMemorySessionService()
+        clock = _Clock()
+        manager = SessionManager(
+            service, "test", stateless=False, ttl=60, max_sessions=2, clock=clock
+        )
+
+        async def scenario():
+            for _ in range(3):
+                async with manager.session():
+                    pass
+            # 上限 2 件を超えた古いものから削除される
+            count_after_overflow = await _session_count(service)
+
+            clock.now += 120
+            async with manager.session():
+                pass
+            # 期限切れの 2 件が削除され、新しい 1 件だけが残る
+            return count_after_overflow, await _session_count(service)
+
+        assert asyncio.run(scenario()) == (2, 1)
+        assert manager.stats()["evicted"] == 3
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_one_computation(self):
+        flights = SingleFlight("t")
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def scenario():
+            return await asyncio.gather(*(flights.do("k", compute) for _ in range(3)))
+
+        results = asyncio.run(scenario())
+
+        assert calls == [1]
+        assert results == [("result", False), ("result", True), ("result", True)]
+        assert flights.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 2}
+
+    def test_different_keys_run_separately(self):
+        flights = SingleFlight("t")
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def scenario():
+            await asyncio.gather(flights.do("a", compute), flights.do("b", compute))
+
+        asyncio.run(scenario())
+        assert flights.stats()["leaders"] == 2
+
+    def test_cancelling_a_waiter_keeps_shared_work_running(self):
+        flights = SingleFlight("t")
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def scenario():
+            leader = asyncio.create_task(flights.do("k", compute))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(flights.do("k", compute))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+            return await follower
+
+        assert asyncio.run(scenario()) == ("result", True)
+
+    def test_failure_is_shared_and_key_is_released(self):
+        flights = SingleFlight("t")
+        calls = []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def scenario():
+            results = await asyncio.gather(
+                flights.do("k", fail), flights.do("k", fail), return_exceptions=True
+            )
+            assert all(isinstance(r, ValueError) for r in results)
+            # 失敗した処理は残らず、次の呼び出しで再実行される
+            with pytest.raises(ValueError):
+                await flights.do("k", fail)
+
+        asyncio.run(scenario())
+        assert len(calls) == 2
+
+    def test_join_waits_only_for_in_flight_work(self):
+        flights = SingleFlight("t")
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def scenario():
+            assert await flights.join("k") is None
+            leader = asyncio.create_task(flights.do("k", compute))
+            await asyncio.sleep(0)
+            joined = await flights.join("k")
+            await leader
+            return joined
+
+        assert asyncio.run(scenario()) == ("result",)
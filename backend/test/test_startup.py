@@ -0,0 +1,37 @@
+from app.config import settings
+from app.metrics import STARTUP_SECONDS
+from app.startup import StartupTimer
+
+
+class TestStartupTimer:
+    def test_records_phases_and_total(self):
+        timer = StartupTimer()
+
+        timer.record("import", 0.25)
+        with timer.phase("create_app"):
+            pass
+        timer.finish()
+
+        stats = timer.stats()
+        assert list(stats) == ["import", "create_app", "total"]
+        assert stats["import"] == 250.0
+        assert stats["total"] >= stats["create_app"]
+        assert STARTUP_SECONDS.value(phase="import") == 0.25
+
+
+class TestCreateApp:
+    def test_production_app_skips_adk_dev_ui(self, monkeypatch):
+        from app.app import _create_app
+
+        monkeypatch.setattr(settings, "APP_MODE", "production")
+        paths = {route.path for route in _create_app().routes}
+
+        assert "/dev-ui/" not in paths
+        assert "/list-apps" not in paths
+
+    def test_development_app_serves_adk_dev_ui(self):
+        from app.app import app
+
+        paths = {route.path for route in app.routes}
+        assert "/list-apps" in paths
+        assert "/searchPhotographers" in paths
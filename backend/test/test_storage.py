@@ -0,0 +1,182 @@
+import asyncio
+import time
+
+import pytest
+
+from app.models import ImageResult
+from app.storage import (
+    ContentAddressedStore,
+    LocalBackend,
+    StorageGateway,
+    StorageNotFoundError,
+    public_url,
+)
+
+
+class _CountingBackend(LocalBackend):
+    """アップロードの回数を数え、最初の failures 回は失敗する"""
+
+    def __init__(self, *args, failures: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.uploads = 0
+        self.failures = failures
+
+    def upload_bytes(self, path: str, data: bytes, content_type: str) -> None:
+        self.uploads += 1
+        if self.uploads <= self.failures:
+            self._wait()
+            raise OSError("upload failed")
+        super().upload_bytes(path, data, content_type)
+
+
+class TestPublicUrl:
+    def test_gs_url_becomes_https(self, monkeypatch):
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "PUBLIC_STORAGE_URL", "https://cdn.example.com/")
+
+        assert public_url("gs://bucket/images/a.jpg") == (
+            "https://cdn.example.com/bucket/images/a.jpg"
+        )
+        assert public_url("https://example.com/a.jpg") == "https://example.com/a.jpg"
+
+    def test_image_result_returns_https_url(self):
+        result = ImageResult(
+            image_url="gs://bucket/images/a.jpg",
+            instagram_url="https://instagram.com/a",
+        )
+
+        assert str(result.image_url) == (
+            "https://storage.googleapis.com/bucket/images/a.jpg"
+        )
+        assert result.model_dump(mode="json", by_alias=True)["imageUrl"].startswith(
+            "https://"
+        )
+
+
+class TestStorageGateway:
+    def test_upload_and_download(self, tmp_path):
+        gateway = StorageGateway(LocalBackend("test-bucket", root=str(tmp_path)))
+
+        async def scenario():
+            url = await gateway.upload_bytes("a/b.json", b'{"x": 1}', "text/plain")
+            assert url == "gs://test-bucket/a/b.json"
+            assert await gateway.exists("a/b.json")
+            assert await gateway.download_text("a/b.json") == '{"x": 1}'
+
+        asyncio.run(scenario())
+
+    def test_missing_object_raises_not_found(self):
+        gateway = StorageGateway(LocalBackend("test-bucket"))
+
+        async def scenario():
+            assert not await gateway.exists("missing.json")
+            with pytest.raises(StorageNotFoundError):
+                await gateway.download_text("missing.json")
+
+        asyncio.run(scenario())
+
+    def test_io_does_not_block_event_loop(self):
+        gateway = StorageGateway(LocalBackend(latency=0.1), max_concurrency=4)
+
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.create_task(ticker())
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(gateway.upload_bytes(f"img/{i}.jpg", b"x") for i in range(4))
+            )
+            elapsed = time.perf_counter() - started
+            task.cancel()
+            return elapsed, ticks
+
+        elapsed, ticks = asyncio.run(scenario())
+        # 4 件が並行に処理され、その間もループは動き続ける
+        assert elapsed < 0.3
+        assert ticks >= 5
+
+    def test_path_from_url(self):
+        gateway = StorageGateway(LocalBackend("bth-dev-storage"))
+        assert (
+            gateway.path_from_url("gs://bth-dev-storage/instagram_urls/p1.json")
+            == "instagram_urls/p1.json"
+        )
+
+
+class TestContentAddressedStore:
+    def test_same_bytes_are_uploaded_once(self):
+        gateway = StorageGateway(LocalBackend("test-bucket"))
+        store = ContentAddressedStore(gateway, prefix="reference_images")
+
+        async def scenario():
+            first = await store.put(b"image-1")
+            second = await store.put(b"image-1")
+            other = await store.put(b"image-2")
+            return first, second, other
+
+        first, second, other = asyncio.run(scenario())
+
+        assert first == second
+        assert first != other
+        assert first.startswith("gs://test-bucket/reference_images/")
+        assert store.stats() == {
+            "uploads": 2,
+            "uploaded_bytes": 14,
+            "skipped_uploads": 1,
+            "saved_bytes": 7,
+        }
+
+    def test_existing_object_is_not_uploaded_again(self):
+        backend = LocalBackend("test-bucket")
+        gateway = StorageGateway(backend)
+
+        async def scenario():
+            # 別プロセスで既にアップロードされた状態
+            await ContentAddressedStore(gateway).put(b"image")
+            store = ContentAddressedStore(gateway)
+            await store.put(b"image")
+            return store.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert stats["uploads"] == 0
+        assert stats["skipped_uploads"] == 1
+
+    def test_concurrent_puts_of_same_bytes_upload_once(self):
+        backend = _CountingBackend("test-bucket", latency=0.05)
+        store = ContentAddressedStore(StorageGateway(backend))
+
+        async def scenario():
+            return await asyncio.gather(*(store.put(b"image") for _ in range(5)))
+
+        urls = asyncio.run(scenario())
+
+        assert len(set(urls)) == 1
+        assert backend.uploads == 1
+        assert store.stats()["uploads"] == 1
+        assert store.stats()["skipped_uploads"] == 4
+
+    def test_failed_upload_is_raised_to_waiters_and_retried(self):
+        backend = _CountingBackend("test-bucket", latency=0.05, failures=1)
+        store = ContentAddressedStore(StorageGateway(backend))
+
+        async def scenario():
+            results = await asyncio.gather(
+                *(store.put(b"image") for _ in range(3)), return_exceptions=True
+            )
+            # 失敗したハッシュは記録しないので、次の呼び出しでアップロードし直す
+            return results, await store.put(b"image")
+
+        results, url = asyncio.run(scenario())
+
+        assert all(isinstance(r, OSError) for r in results)
+        assert url.startswith("gs://test-bucket/reference_images/")
+        assert backend.uploads == 2
+        assert store.stats()["uploads"] == 1
@@ -0,0 +1,164 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+import numpy as np
+from PIL import Image
+
+from app import utils
+from app.photographer_index import PhotographerIndex
+from app.resources import Resources
+from app.storage import LocalBackend, StorageGateway
+from app.style_index import EMBEDDING_DIM, StyleIndex, style_embedding
+
+
+def _image(color, noise=30, size=(320, 240)) -> bytes:
+    image = Image.effect_noise(size, noise).convert("RGB")
+    image = Image.blend(image, Image.new("RGB", size, color), 0.6)
+    output = io.BytesIO()
+    image.save(output, format="JPEG")
+    return output.getvalue()
+
+
+def _vector(i: int) -> np.ndarray:
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+class TestStyleEmbedding:
+    def test_similar_styles_are_closer(self):
+        warm = style_embedding(_image((200, 60, 40)))
+        warm_again = style_embedding(_image((210, 70, 50), noise=40))
+        cool = style_embedding(_image((30, 60, 200)))
+
+        assert warm.shape == (EMBEDDING_DIM,)
+        assert warm.dtype == np.float32
+        assert abs(float(np.linalg.norm(warm)) - 1.0) < 1e-5
+        assert float(warm @ warm_again) > float(warm @ cool)
+
+
+class TestStyleIndex:
+    def test_search_filters_by_destination_and_ranks_by_similarity(self):
+        index = StyleIndex(initial_capacity=2)
+        index.add("Bali", "english", "near", "gs://b/near.jpg", _vector(0))
+        index.add("Bali", "english", "far", "gs://b/far.jpg", _vector(1))
+        index.add("Paris", "english", "other", "gs://b/other.jpg", _vector(0))
+
+        results = index.search(_vector(0), " bali ", "english", 5)
+
+        assert [username for username, _ in results] == ["near", "far"]
+        assert results[0][1] == 1.0
+        assert index.search(_vector(0), "Bali", "japanese", 5) == []
+
+    def test_one_entry_per_photographer(self):
+        index = StyleIndex()
+        index.add("Bali", "english", "a", "gs://b/a1.jpg", _vector(0))
+        index.add("Bali", "english", "a", "gs://b/a2.jpg", _vector(1))
+        index.add("Bali", "english", "b", "gs://b/b.jpg", _vector(2))
+
+        assert [u for u, _ in index.search(_vector(1), "Bali", "english", 5)] == [
+            "a",
+            "b",
+        ]
+
+    def test_same_photographer_is_indexed_once(self, tmp_path):
+        path = str(tmp_path / "styles")
+        index = StyleIndex(path)
+        # 検索ごとに画像を保存し直すため、同じ写真家でも画像 URL は毎回変わる
+        index.add("Bali", "english", "a", "gs://b/1/a.jpg", _vector(0))
+        index.add(" bali", "english", "a", "gs://b/2/a.jpg", _vector(1))
+        index.add("Bali", "english", "b", "gs://b/2/b.jpg", _vector(2))
+
+        assert len(index) == 2
+        assert index.search(_vector(1), "Bali", "english", 5)[0] == ("a", 1.0)
+        assert [u for u, _ in index.search(_vector(2), "Bali", "english", 5)] == [
+            "b",
+            "a",
+        ]
+        index.close()
+
+        reloaded = StyleIndex(path)
+        assert len(reloaded) == 2
+        assert reloaded.search(_vector(1), "Bali", "english", 1) == [("a", 1.0)]
+
+    def test_metadata_file_is_compacted(self, tmp_path):
+        path = str(tmp_path / "styles")
+        index = StyleIndex(path)
+        for i in range(200):
+            index.add("Bali", "english", "a", f"gs://b/{i}/a.jpg", _vector(i % 3))
+
+        with open(f"{path}.meta.jsonl", encoding="utf-8") as f:
+            assert len(f.readlines()) <= 2 * len(index) + 64
+        assert len(StyleIndex(path)) == 1
+
+    def test_same_image_is_overwritten(self):
+        index = StyleIndex()
+        index.add("Bali", "english", "a", "gs://b/a.jpg", _vector(0))
+        index.add("Bali", "english", "a", "gs://b/a.jpg", _vector(1))
+
+        assert len(index) == 1
+        assert index.search(_vector(1), "Bali", "english", 1) == [("a", 1.0)]
+
+    def test_persists_to_memmap_and_grows(self, tmp_path):
+        path = str(tmp_path / "styles")
+        index = StyleIndex(path, initial_capacity=2)
+        for i in range(5):
+            index.add("Bali", "english", f"p{i}", f"gs://b/{i}.jpg", _vector(i))
+        index.close()
+
+        reloaded = StyleIndex(path, initial_capacity=2)
+        assert len(reloaded) == 5
+        assert reloaded.search(_vector(3), "Bali", "english", 1) == [("p3", 1.0)]
+
+        reloaded.add("Bali", "english", "p5", "gs://b/5.jpg", _vector(5))
+        assert reloaded.search(_vector(5), "Bali", "english", 1) == [("p5", 1.0)]
+
+    def test_concurrent_adds_from_threads_are_not_lost(self, tmp_path):
+        path = str(tmp_path / "styles")
+        index = StyleIndex(path, initial_capacity=2)
+
+        def add(i):
+            # 容量の拡張とメタデータの書き直しが並行して起きる
+            for j in range(20):
+                index.add(
+                    "Bali", "english", f"p{i}_{j % 10}", "gs://b/x.jpg", _vector(i)
+                )
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(add, range(8)))
+        index.close()
+
+        assert len(index) == 80
+        reloaded = StyleIndex(path)
+        assert len(reloaded) == 80
+        assert reloaded.search(_vector(7), "Bali", "english", 1)[0][1] == 1.0
+
+
+class TestStyleRanking:
+    def test_candidates_similar_to_reference_come_first(self, monkeypatch):
+        monkeypatch.setattr(utils.settings, "PHOTOGRAPHER_INDEX_EXPLORE_RATE", 0.0)
+        photographers = PhotographerIndex()
+        photographers.add("Bali", "english", [f"p{i}" for i in range(12)])
+        styles = StyleIndex()
+        styles.add("Bali", "english", "p4", "gs://b/p4.jpg", _vector(0))
+        styles.add("Bali", "english", "p2", "gs://b/p2.jpg", _vector(1))
+        resources = Resources(
+            storage_factory=lambda: StorageGateway(LocalBackend()),
+            photographer_index_factory=lambda: photographers,
+            style_index_factory=lambda: styles,
+        )
+
+        async def collect():
+            async with aclosing(
+                utils._iter_candidate_usernames(
+                    "prompt", "Bali", "english", resources, style_vector=_vector(0)
+                )
+            ) as candidates:
+                return [username async for username in candidates]
+
+        usernames = asyncio.run(collect())
+
+        assert usernames[:2] == ["p4", "p2"]
+        assert len(usernames) == 6
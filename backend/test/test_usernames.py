@@ -0,0 +1,35 @@
+from app.usernames import UsernameParser, parse_username
+
+
+class TestParseUsername:
+    def test_accepts_usernames_with_list_markers_and_at_sign(self):
+        assert parse_username("  user001  ") == "user001"
+        assert parse_username("@bali.wedding_photo") == "bali.wedding_photo"
+        assert parse_username("- ubud_love") == "ubud_love"
+        assert parse_username("2. seminyak_shoots") == "seminyak_shoots"
+
+    def test_rejects_prose_and_invalid_names(self):
+        assert parse_username("Here are some photographers:") == ""
+        assert parse_username("ab") == ""
+        assert parse_username("x" * 31) == ""
+        assert parse_username("") == ""
+
+
+class TestUsernameParser:
+    def test_emits_each_username_when_its_line_completes(self):
+        parser = UsernameParser(limit=6)
+
+        assert parser.feed("user0") == []
+        assert parser.feed("01\nuser002, user") == ["user001", "user002"]
+        assert parser.feed("003") == []
+        assert parser.close() == ["user003"]
+
+    def test_skips_duplicates_and_stops_at_limit(self):
+        parser = UsernameParser(limit=2)
+
+        assert parser.feed("Alice_photo\nalice_photo\nbob_photo\ncarol_photo\n") == [
+            "Alice_photo",
+            "bob_photo",
+        ]
+        assert parser.done
+        assert parser.close() == []